@@ -0,0 +1,379 @@
+"""古いブロックの列指向ファイルへのアーカイブ
+
+終了した研究のブロックが DB に溜まり続けないよう、指定した日時より前に保存した
+ブロックを課題と月（保存日時、UTC）で分けた列指向のファイルに移し、DB から消す:
+
+    <ARCHIVE_DIR>/task=stroop/month=2026-04/blocks-00000001-00000420.parquet
+    <ARCHIVE_DIR>/task=stroop/month=2026-04/trials-00000001-00000420.parquet
+
+blocks-* はブロック1件を1行（id, session_id, study_id, task, seed, trials, created_at）、
+trials-* は試行1件を1行（block_id と score_<task> の結果の各項目）にしたもの。
+trials-* の列の型はすべての行の値から決め（整数だけの列は int64、整数と小数が混じる列は
+float64 など）、行ごとに欠けていた項目の名前を MISSING_COLUMN に書いておく。読み込むときは
+元の型に戻して欠けていた項目を除くので、アーカイブしたブロックの結果は DB にあったときと
+同じ dict になる。
+ディレクトリ名は Hive 形式なので、分析には pyarrow.dataset / pandas / DuckDB でそのまま
+課題や月で絞り込んで読める（例: DuckDB で
+read_parquet('instance/archive/*/*/trials-*.parquet', hive_partitioning = true)）。--format arrow を指定すると圧縮しない Arrow IPC 形式で書き出し、
+pyarrow.memory_map で読み込みなしに開ける（Parquet より大きくなる）。
+
+storage の get_block / iter_blocks / get_blocks_by_sessions はアーカイブも読むので、
+結果API・rescore.py・replay.py はアーカイブしたブロックもそのまま扱える。
+読むときは課題と月（ディレクトリ名）でファイルを絞り込み、blocks-* はまず ID・セッションID・
+研究ID・保存日時の列だけを読んで、該当するブロックがあるファイルだけ残りを読む。
+アーカイブした日時より前の response_log（実施中の反応の追記）も消す（ただし参加者が途中で
+中断し、まだ再開できるブロックの反応は残す）。
+
+pyarrow が必要（pip install pyarrow）。
+
+使い方:
+    python archive.py --before 2026-04-01             # この日より前に保存したブロックを移す
+    python archive.py --days 180 --format arrow
+    python archive.py --before 2026-04-01 --dry-run   # 移すブロックの数を表示するだけ
+
+環境変数:
+    ARCHIVE_DIR   アーカイブの置き場所（デフォルト: instance/archive）
+"""
+import argparse
+import collections
+import datetime
+import glob
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from log_config import configure_logging, get_logger
+
+PART_PATTERN = re.compile(r'blocks-(\d+)-(\d+)\.(parquet|arrow)$')
+PARTITION_PATTERN = re.compile(r'task=([^/\\]+)[/\\]month=(\d{4}-\d{2})[/\\]')
+KEY_COLUMNS = ['id', 'session_id', 'study_id', 'created_at']  # ブロックを選ぶのに使う列
+
+# trials-* の列のメタデータ（読み込み時に元の型に戻す）
+INT_VALUES = b'int_values'  # 整数と小数が混じった float64 の列（整数だった値を int に戻す）
+JSON_VALUES = b'json_values'  # 型の混じった列などを JSON の文字列にした列
+MISSING_COLUMN = '_missing'  # 行ごとの、その試行の結果になかった項目の名前
+
+
+def month_of(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m')
+
+
+def partition(block):
+    """ブロックを置くディレクトリ (課題, 月)"""
+    return block['task'], month_of(block['created_at'])
+
+
+def _write(table, path, fmt):
+    """一時ファイルに書いてから置き換える（途中で止まっても半端なファイルを残さない）"""
+    import pyarrow as pa
+
+    tmp = path + '.tmp'
+    if fmt == 'arrow':
+        with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        import pyarrow.parquet as pq
+        pq.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, path)
+
+
+def write_part(root, task, month, blocks, fmt='parquet'):
+    """同じ (課題, 月) のブロックを blocks-* と trials-* に書き出し、blocks-* のパスを返す"""
+    import pyarrow as pa
+
+    directory = os.path.join(root, f'task={task}', f'month={month}')
+    os.makedirs(directory, exist_ok=True)
+    name = f"{blocks[0]['id']:08d}-{blocks[-1]['id']:08d}.{fmt}"
+
+    block_table = pa.table({
+        'id': pa.array([b['id'] for b in blocks], pa.int64()),
+        'session_id': pa.array([b['session_id'] for b in blocks], pa.string()),
+        'study_id': pa.array([b['study_id'] for b in blocks], pa.string()),
+        'task': pa.array([b['task'] for b in blocks], pa.string()),
+        'seed': pa.array([b['seed'] for b in blocks], pa.string()),
+        'trials': pa.array([b['trials'] for b in blocks], pa.binary()),
+        'created_at': pa.array([b['created_at'] for b in blocks], pa.float64()),
+    })
+    # 結果の項目はブロックによって欠けていることがあるので、すべての行の項目を列にする
+    rows = [{'block_id': b['id'], **result} for b in blocks for result in b['results']]
+    columns = dict.fromkeys(['block_id'] + [key for row in rows for key in row])
+    fields = [_trial_field(key, [row.get(key) for row in rows]) for key in columns]
+    arrays = [_trial_column(field, [row.get(field.name) for row in rows]) for field in fields]
+    fields.append(pa.field(MISSING_COLUMN, pa.list_(pa.string())))
+    arrays.append(pa.array([[key for key in columns if key not in row] or None for row in rows],
+                           pa.list_(pa.string())))
+    trial_table = pa.table(arrays, schema=pa.schema(fields))
+
+    # trials-* を先に書く（blocks-* があれば trials-* もそろっている）
+    _write(trial_table, os.path.join(directory, f'trials-{name}'), fmt)
+    path = os.path.join(directory, f'blocks-{name}')
+    _write(block_table, path, fmt)
+    return path
+
+
+def _value_kind(values):
+    """列の値（None を除く）の型: 'bool' / 'int' / 'float' / 'str' / 'strs'（文字列のリスト）/ 'json'"""
+    kinds = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            kinds.add('strs')
+        else:
+            kinds.add(type(value).__name__)
+    if kinds <= {'int'}:
+        return 'int'
+    if kinds <= {'int', 'float'}:
+        return 'float'
+    if len(kinds) == 1 and kinds <= {'bool', 'str', 'strs'}:
+        return kinds.pop()
+    return 'json'
+
+
+def _trial_field(name, values):
+    import pyarrow as pa
+
+    kind = _value_kind(values)
+    types = {'bool': pa.bool_(), 'int': pa.int64(), 'float': pa.float64(), 'str': pa.string(),
+             'strs': pa.list_(pa.string()), 'json': pa.string()}
+    metadata = None
+    if kind == 'float' and any(type(v) is int for v in values):
+        metadata = {INT_VALUES: b'1'}
+    elif kind == 'json':
+        metadata = {JSON_VALUES: b'1'}
+    return pa.field(name, types[kind], metadata=metadata)
+
+
+def _trial_column(field, values):
+    import pyarrow as pa
+
+    if field.metadata and JSON_VALUES in field.metadata:
+        values = [None if v is None else json.dumps(v, ensure_ascii=False) for v in values]
+    elif pa.types.is_floating(field.type):
+        values = [None if v is None else float(v) for v in values]
+    return pa.array(values, field.type)
+
+
+def _trial_rows(table):
+    """trials-* の表を結果の dict のリストに戻す（結果になかった項目は含めない）
+
+    MISSING_COLUMN のない古いアーカイブでは、値が null の項目をすべて除く。
+    """
+    converters = {}
+    for field in table.schema:
+        metadata = field.metadata or {}
+        if JSON_VALUES in metadata:
+            converters[field.name] = json.loads
+        elif INT_VALUES in metadata:
+            converters[field.name] = lambda v: int(v) if v.is_integer() else v
+    has_missing = MISSING_COLUMN in table.column_names
+    rows = []
+    for row in table.to_pylist():
+        missing = row.pop(MISSING_COLUMN, None) or ()
+        result = {}
+        for key, value in row.items():
+            if value is None:
+                if not has_missing or key in missing:
+                    continue
+                result[key] = None
+            else:
+                convert = converters.get(key)
+                result[key] = convert(value) if convert else value
+        rows.append(result)
+    return rows
+
+
+def archive_blocks(root, before, fmt='parquet', batch_size=500, dry_run=False):
+    """before（UNIX時刻）より前に保存したブロックをアーカイブに移し、課題ごとの件数を返す
+
+    batch_size 件ずつ書き出して DB から消すので、DB 全体をメモリに載せない。
+    """
+    import storage
+
+    counts = collections.Counter()
+    if dry_run:
+        for block in storage.iter_live_blocks(before=before, batch_size=batch_size):
+            counts[block['task']] += 1
+        return counts
+    while True:
+        # 書き出したブロックは DB から消すので、毎回先頭から batch_size 件を読む
+        batch = list(itertools.islice(storage.iter_live_blocks(before=before, batch_size=batch_size), batch_size))
+        if not batch:
+            break
+        groups = collections.defaultdict(list)
+        for block in batch:
+            groups[partition(block)].append(block)
+        for (task, month), blocks in groups.items():
+            write_part(root, task, month, blocks, fmt)
+            counts[task] += len(blocks)
+        storage.delete_blocks([block['id'] for block in batch])
+    storage.purge_responses(before)
+    return counts
+
+
+def _read_table(path, columns=None):
+    import pyarrow as pa
+
+    if path.endswith('.arrow'):
+        with pa.ipc.open_file(pa.memory_map(path)) as reader:
+            table = reader.read_all()
+        return table.select(columns) if columns else table
+    import pyarrow.parquet as pq
+    return pq.read_table(path, columns=columns, memory_map=True)
+
+
+class ArchiveReader:
+    """アーカイブしたブロックを storage と同じ形の dict で返す"""
+
+    def __init__(self, root):
+        self.root = root
+        self._parts = None
+        self._stamp = None
+
+    def parts(self):
+        """(最初のID, 最後のID, blocks-* のパス, trials-* のパス, 課題, 月) を ID 順に返す
+
+        ディレクトリの更新を検知して一覧を作り直す（アーカイブを追加しても再起動は要らない）。
+        """
+        paths = glob.glob(os.path.join(self.root, 'task=*', 'month=*', 'blocks-*'))
+        stamp = (len(paths), max((os.path.getmtime(p) for p in paths), default=0))
+        if self._parts is None or stamp != self._stamp:
+            parts = []
+            for path in paths:
+                match = PART_PATTERN.search(os.path.basename(path))
+                keys = PARTITION_PATTERN.search(path)
+                if match and keys:
+                    trials = os.path.join(os.path.dirname(path), 'trials-' + os.path.basename(path)[len('blocks-'):])
+                    parts.append((int(match.group(1)), int(match.group(2)), path, trials,
+                                  keys.group(1), keys.group(2)))
+            self._parts = sorted(parts)
+            self._stamp = stamp
+        return self._parts
+
+    def _blocks(self, part, mask=None):
+        """part のブロックのうち mask（KEY_COLUMNS の表から pyarrow の真偽値の配列を返す関数）に
+        当てはまるものを ID 順に返す（当てはまるものがなければ残りの列も trials-* も読まない）"""
+        import pyarrow.compute as pc
+
+        block_path, trial_path = part[2], part[3]
+        if mask is not None:
+            keys = _read_table(block_path, KEY_COLUMNS)
+            ids = keys.filter(mask(keys))['id']
+            if len(ids) == 0:
+                return []
+            table = _read_table(block_path)
+            table = table.filter(pc.is_in(table['id'], ids))
+        else:
+            table = _read_table(block_path)
+        if table.num_rows == 0:
+            return []
+        trials = _read_table(trial_path)
+        trials = trials.filter(pc.is_in(trials['block_id'], table['id']))
+        results = collections.defaultdict(list)
+        for row in _trial_rows(trials):
+            results[row.pop('block_id')].append(row)
+        blocks = []
+        for row in table.to_pylist():
+            row['results'] = results.get(row['id'], [])
+            blocks.append(row)
+        return sorted(blocks, key=lambda b: b['id'])
+
+    def _in_task(self, part, task):
+        return task is None or part[4] == task
+
+    def _in_months(self, part, since, until):
+        """保存日時の範囲（UNIX時刻、None は制限なし）と part の月が重なるか"""
+        return ((since is None or part[5] >= month_of(since))
+                and (until is None or part[5] <= month_of(until)))
+
+    def iter_blocks(self, task=None, after_id=0):
+        import pyarrow.compute as pc
+
+        for part in self.parts():
+            if part[1] > after_id and self._in_task(part, task):
+                mask = (lambda t: pc.greater(t['id'], after_id)) if after_id else None
+                yield from self._blocks(part, mask)
+
+    def get_block(self, block_id):
+        import pyarrow.compute as pc
+
+        for part in self.parts():
+            if part[0] <= block_id <= part[1]:
+                blocks = self._blocks(part, lambda t: pc.equal(t['id'], block_id))
+                if blocks:
+                    return blocks[0]
+        return None
+
+    def blocks_by_sessions(self, session_ids, task=None, study_id=None, since=None, until=None):
+        """指定したセッションのブロック（課題・研究・保存日時 [since, until) で絞り込める）"""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        wanted = pa.array(list(session_ids), pa.string())
+
+        def mask(t):
+            selected = pc.is_in(t['session_id'], wanted)
+            if study_id is not None:
+                selected = pc.and_(selected, pc.equal(t['study_id'], study_id))
+            if since is not None:
+                selected = pc.and_(selected, pc.greater_equal(t['created_at'], since))
+            if until is not None:
+                selected = pc.and_(selected, pc.less(t['created_at'], until))
+            return selected
+
+        blocks = []
+        for part in self.parts():
+            if self._in_task(part, task) and self._in_months(part, since, until):
+                blocks.extend(self._blocks(part, mask))
+        return blocks
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def reader(root):
+    """root のアーカイブの ArchiveReader（プロセスごとに1つ）"""
+    with _readers_lock:
+        if root not in _readers:
+            _readers[root] = ArchiveReader(root)
+        return _readers[root]
+
+
+def _cutoff(args):
+    if args.before:
+        day = datetime.datetime.strptime(args.before, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+        return day.timestamp()
+    return time.time() - args.days * 86400
+
+
+def main(argv=None):
+    import storage
+
+    parser = argparse.ArgumentParser(description='古いブロックを列指向のファイルに移す')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--before', help='この日（YYYY-MM-DD、UTC）より前に保存したブロックを移す')
+    group.add_argument('--days', type=int, help='この日数より前に保存したブロックを移す')
+    parser.add_argument('--format', choices=('parquet', 'arrow'), default='parquet')
+    parser.add_argument('--output', default=storage.archive_dir(), help='アーカイブの置き場所')
+    parser.add_argument('--dry-run', action='store_true', help='移すブロックの数を表示するだけ')
+    args = parser.parse_args(argv)
+    configure_logging(sys.stderr)
+    logger = get_logger('main')
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        parser.error('pyarrow が必要です（pip install pyarrow）')
+    counts = archive_blocks(args.output, _cutoff(args), args.format, dry_run=args.dry_run)
+    logger.info("アーカイブが完了しました" if not args.dry_run else "アーカイブの対象を数えました",
+                extra={'fields': {'blocks': dict(counts), 'output': args.output}})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
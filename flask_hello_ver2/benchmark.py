@@ -0,0 +1,278 @@
+"""ルートと集計処理のベンチマーク
+
+main_app のルートを Flask のテストクライアントで呼び出し、次の値を測る:
+
+    start/<task>/<n>          試行数 n の試行リスト生成（/<task>/start）の所要時間
+    record/<task>/<k>         セッションに k 件の結果があるときの record_response の所要時間
+    results/<task>/<n>        n 試行の結果画面（/<task>/results）の描画時間
+    summarize/<task>/<n>      n 試行分の summarize_<task> の所要時間
+    cookie/<task>/<n>         n 試行の反応を記録した後のセッションクッキーの大きさ（バイト）
+    db/append_response        storage.append_response（反応1件の追記）の所要時間
+    db/append_responses/<n>   n 件をまとめて追記する storage.append_responses の所要時間
+    db/load_responses/<n>     n 件の反応の storage.load_responses の所要時間
+
+時間は1回あたりのミリ秒で、repeat 回測ったうちの最小値（他のプロセスの影響を受けにくい）。
+マシンの速さの違いや負荷の揺らぎを打ち消すため、一定の計算にかかる時間（calibration）も
+課題ごと（db/* は calibration/db）に測り、基準値との比較では時間の指標をこの値で割ってから比べる。
+calibration は課題の測定の前後に測って速いほうを使う（一時的な負荷で課題全体の比がずれないように）。
+
+使い方:
+    python benchmark.py                    # 測定して benchmark_baseline.json と比較する
+    python benchmark.py --save             # 測定結果を基準値として保存する
+    python benchmark.py --threshold 0.5    # 基準値より 50% 以上悪化したものを回帰とみなす
+
+基準値より悪化した指標があれば、その課題だけを RECHECKS 回まで測り直して指標ごとに速いほうを
+使う（一時的な負荷による外れ値を回帰とみなさないため）。それでも残る回帰があれば終了コード 1 を返す。
+基準値にない指標がある場合も、比較できないので終了コード 1 を返す（測定する指標や測定する処理を
+変えたら --save で基準値を取り直す）。
+基準値は実行するマシンに依存するため、比較に使うマシンで --save し直してから使うこと。
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+import warnings
+
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+os.environ.setdefault('WARMUP', '0')  # 測定と並行してウォームアップを走らせない
+os.environ.setdefault('DATABASE_PATH', os.path.join(tempfile.gettempdir(), 'cognitive_tasks_benchmark.db'))
+
+from log_config import configure_logging, get_logger
+
+configure_logging(sys.stderr)
+warnings.filterwarnings('ignore', message='.*cookie is too large')  # クッキーの大きさは別に測る
+
+import main_app
+import storage
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_THRESHOLD = 0.5  # 1ミリ秒前後の測定は揺らぎが大きいため余裕を持たせる
+RECHECKS = 3  # 悪化した指標を測り直す回数
+
+SIZES = (20, 100, 200)  # 開始フォームの上限（フランカーは 50×4 試行）に収まる範囲
+RESPONSES = {
+    'flanker': {'response': 'left', 'reaction_time': 450},
+    'gonogo': {'response': 'space', 'reaction_time': 350},
+    'stroop': {'response': '1', 'reaction_time': 650},
+    'nback': {'response': None, 'reaction_time': None},
+}
+
+
+def start_form(task, n):
+    """試行数がおよそ n になる開始フォーム"""
+    if task == 'flanker':
+        return {'trials_per_stimulus': max(n // len(main_app.STIMULI_FLANKER), 1)}
+    if task == 'gonogo':
+        return {'go_trials': n - n // 3, 'nogo_trials': n // 3}
+    if task == 'stroop':
+        return {'congruent_trials': n // 2, 'incongruent_trials': n - n // 2}
+    return {'total_trials': n}
+
+
+def _cookie_size(client):
+    cookie = client.get_cookie(main_app.app.config['SESSION_COOKIE_NAME'])
+    return len(cookie.value) if cookie else 0
+
+
+def _timed(func, repeat, min_sample=0.02):
+    """1回あたりの所要時間（ミリ秒）
+
+    1ミリ秒前後の処理は1回ずつだと揺らぎが大きいので、1サンプルが min_sample 秒以上になる
+    回数をまとめて実行し、repeat サンプルのうち最も速いものを使う。
+    """
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_sample:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - t0) / number)
+    return min(samples) * 1000
+
+
+def calibrate(repeat=5):
+    """マシンの速さの目安（一定の Python の計算にかかる時間）"""
+    return _timed(lambda: sorted(str(i * 7919 % 10007) for i in range(100000)), repeat)
+
+
+def run_block(task, n, record_at=()):
+    """n 試行を最後まで実施し、(クライアント, 位置 k ごとの record_response の所要時間) を返す"""
+    client = main_app.app.test_client()
+    client.post(f'/{task}/start', data=start_form(task, n))
+    timings = {}
+    k = 0
+    while client.get(f'/{task}/next_trial').get_json()['status'] == 'next':
+        t0 = time.perf_counter()
+        client.post(f'/{task}/record_response', json=RESPONSES[task])
+        if k in record_at:
+            timings[k] = (time.perf_counter() - t0) * 1000
+        k += 1
+    return client, timings
+
+
+def measure(tasks, sizes, repeat):
+    metrics = {}
+    for task in tasks:
+        before = calibrate()
+        client = main_app.app.test_client()
+        for n in sizes:
+            form = start_form(task, n)
+            metrics[f'start/{task}/{n}'] = _timed(lambda: client.post(f'/{task}/start', data=form), repeat)
+
+        positions = (0,) + tuple(size - 1 for size in sizes)
+        per_position = {k: [] for k in positions}
+        for _ in range(repeat):
+            _, timings = run_block(task, max(sizes), positions)
+            for k, value in timings.items():
+                per_position[k].append(value)
+        for k, values in per_position.items():
+            if values:
+                metrics[f'record/{task}/{k}'] = min(values)
+
+        for n in sizes:
+            client, _ = run_block(task, n)
+            metrics[f'cookie/{task}/{n}'] = _cookie_size(client)
+            metrics[f'results/{task}/{n}'] = _timed(lambda: client.get(f'/{task}/results'), repeat)
+            with client.session_transaction() as sess:
+                results = sess['results']
+            summarize = main_app.TASKS[task]['summarize']
+            params = main_app.studies.get(main_app.DEFAULT_STUDY_ID).params[task]
+            metrics[f'summarize/{task}/{n}'] = _timed(lambda: summarize(results, params), repeat)
+        metrics[f'calibration/{task}'] = min(before, calibrate())
+    return metrics
+
+
+def measure_storage(sizes, repeat):
+    """反応の追記と読み込み（DATABASE_PATH のコネクションプールを使う）"""
+    metrics = {}
+    before = calibrate()
+    result = {'trial': 1, **RESPONSES['stroop']}
+    token = uuid.uuid4().hex
+    seq = itertools.count()
+    metrics['db/append_response'] = _timed(lambda: storage.append_response(token, next(seq), result), repeat)
+    for n in sizes:
+        rows = [(i, result) for i in range(n)]
+        metrics[f'db/append_responses/{n}'] = _timed(
+            lambda: storage.append_responses(uuid.uuid4().hex, rows), repeat)
+        token = uuid.uuid4().hex
+        storage.append_responses(token, rows)
+        metrics[f'db/load_responses/{n}'] = _timed(lambda: storage.load_responses(token), repeat)
+    metrics['calibration/db'] = min(before, calibrate())
+    return metrics
+
+
+def _group(name):
+    """指標の補正に使う calibration の区分（課題名か db）"""
+    kind, group = name.split('/')[:2]
+    return 'db' if kind == 'db' else group
+
+
+def _relative(metrics, baseline):
+    """時間の指標の、マシンの速さの違いを課題ごとに補正した基準値との比"""
+    ratios = {}
+    for name, value in metrics.items():
+        base = baseline.get(name)
+        kind = name.split('/')[0]
+        if kind == 'calibration' or not base:
+            continue
+        if kind == 'cookie':
+            ratios[name] = value / base
+            continue
+        calibration = f'calibration/{_group(name)}'
+        scale = baseline[calibration] / metrics[calibration] if baseline.get(calibration) else 1.0
+        ratios[name] = value * scale / base
+    return ratios
+
+
+def missing(metrics, baseline):
+    """基準値にない指標の名前（基準値が空なら比較しないので空）"""
+    if not baseline:
+        return []
+    return [name for name in metrics if name not in baseline]
+
+
+def compare(metrics, baseline, threshold):
+    """基準値より threshold の割合以上悪化した指標を (名前, 基準値との比) で返す"""
+    return [(name, ratio) for name, ratio in _relative(metrics, baseline).items() if ratio > 1 + threshold]
+
+
+def recheck(metrics, baseline, threshold, sizes, repeat):
+    """悪化した指標のある課題（db/* はストレージ）だけ測り直し、指標ごとに速いほうを残す
+
+    一時的な負荷がかかると、その間の測定はまとめて遅くなる。本当の回帰なら測り直しても遅いままなので、
+    測り直した値を最初の測定の calibration に換算して比べ、速いほうを使えば外れ値だけを除ける。
+    """
+    groups = tuple(dict.fromkeys(_group(name) for name, _ in compare(metrics, baseline, threshold)))
+    tasks = tuple(group for group in groups if group != 'db')
+    again = measure(tasks, sizes, repeat) if tasks else {}
+    if 'db' in groups:
+        again.update(measure_storage(sizes, repeat))
+    merged = dict(metrics)
+    for name, value in again.items():
+        if name.split('/')[0] in ('calibration', 'cookie'):
+            continue
+        calibration = f'calibration/{_group(name)}'
+        merged[name] = min(merged[name], value * metrics[calibration] / again[calibration])
+    return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ルートと集計処理のベンチマーク')
+    parser.add_argument('--task', action='append', choices=tuple(main_app.TASKS), help='対象の課題（複数指定可）')
+    parser.add_argument('--sizes', type=lambda s: tuple(int(x) for x in s.split(',')), default=SIZES,
+                        help='試行数（カンマ区切り、デフォルト: 20,100,200）')
+    parser.add_argument('--repeat', type=int, default=5, help='測定の繰り返し回数')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='基準値のファイル')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='回帰とみなす悪化の割合')
+    parser.add_argument('--save', action='store_true', help='測定結果を基準値として保存する')
+    args = parser.parse_args(argv)
+    logger = get_logger('main')
+
+    main_app.app.config['PERSIST_BLOCKS'] = False
+    metrics = measure(args.task or tuple(main_app.TASKS), args.sizes, args.repeat)
+    metrics.update(measure_storage(args.sizes, args.repeat))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    if not args.save:
+        for _ in range(RECHECKS):
+            if not compare(metrics, baseline, args.threshold):
+                break
+            metrics = recheck(metrics, baseline, args.threshold, args.sizes, args.repeat)
+    ratios = _relative(metrics, baseline)
+    for name, value in metrics.items():
+        change = f'{(ratios[name] - 1) * 100:+7.1f}%' if name in ratios else ''
+        print(f'{name:<28} {value:12.3f} {change}')
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({name: round(value, 3) for name, value in metrics.items()}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        logger.info("基準値を保存しました", extra={'fields': {'path': args.baseline}})
+        return 0
+
+    regressions = compare(metrics, baseline, args.threshold)
+    for name, ratio in regressions:
+        logger.warning("性能が悪化しました: %s（基準値の %.2f 倍）", name, ratio)
+    unknown = missing(metrics, baseline)
+    if unknown:
+        logger.warning("基準値にない指標があります（--save で取り直してください）: %s", ', '.join(unknown))
+    return 1 if regressions or unknown else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,9 +4,12 @@ import time
 from datetime import datetime
 import json
 
+from log_config import get_logger
+
 app = Flask(__name__)
 app.secret_key = "gonogo_task_secret_key"
 app.config['SESSION_TYPE'] = 'filesystem'
+logger = get_logger('gonogo')
 
 # Go/NoGo刺激の種類
 # Go刺激：反応が必要（緑色の○）
@@ -31,7 +34,7 @@ def index():
     session['current_trial'] = 0
     session['results'] = []
     session['start_time'] = None
-    print("セッション初期化完了")  # デバッグ用
+    logger.debug("セッション初期化完了")
     return render_template('gonogoindex.html', template='index')
 
 @app.route('/start', methods=['POST'])
@@ -39,7 +42,7 @@ def start():
     # 試行回数を設定（デフォルト：Go刺激20回、NoGo刺激10回、計30試行）
     go_trials = int(request.form.get('go_trials', 20))
     nogo_trials = int(request.form.get('nogo_trials', 10))
-    print(f"開始: Go刺激 {go_trials} 回、NoGo刺激 {nogo_trials} 回")  # デバッグ用
+    logger.debug("開始: Go刺激 %d 回、NoGo刺激 %d 回", go_trials, nogo_trials)
     
     # 各刺激をランダムに配置した試行リストを作成
     trials = []
@@ -51,7 +54,7 @@ def start():
         trials.append({'type': 'nogo', 'stimulus': STIMULI['nogo']})
     
     random.shuffle(trials)
-    print(f"試行リスト作成完了: {len(trials)} 試行")  # デバッグ用
+    logger.debug("試行リスト作成完了: %d 試行", len(trials))
     
     # セッションに試行リストを保存
     session['trials'] = trials
@@ -69,11 +72,11 @@ def next_trial():
     trials = session.get('trials', [])
     current_trial = session.get('current_trial', 0)
     
-    print(f"次の試行: {current_trial + 1}/{len(trials)}")  # デバッグ用
+    logger.debug("次の試行: %d/%d", current_trial + 1, len(trials))
     
     # すべての試行が終了した場合
     if current_trial >= len(trials):
-        print("すべての試行完了")  # デバッグ用
+        logger.debug("すべての試行完了")
         return jsonify({
             'status': 'completed'
         })
@@ -82,7 +85,7 @@ def next_trial():
     trial_data = trials[current_trial]
     session['current_trial'] = current_trial + 1
     
-    print(f"刺激: {trial_data['stimulus']} ({trial_data['type']})")  # デバッグ用
+    logger.debug("刺激: %s (%s)", trial_data['stimulus'], trial_data['type'])
     
     return jsonify({
         'status': 'next',
@@ -100,17 +103,17 @@ def next_trial():
 def record_response():
     try:
         data = request.get_json()
-        print(f"受信したデータ: {data}")  # デバッグ用
+        logger.debug("受信したデータ", extra={'fields': {'data': data}})
         
         # 前の試行のインデックス
         trial_idx = session.get('current_trial', 0) - 1
         if trial_idx < 0:
-            print("試行が開始されていません")  # デバッグ用
+            logger.warning("試行が開始されていません")
             return jsonify({'status': 'error', 'message': '試行が開始されていません'})
         
         trials = session.get('trials', [])
         if not trials or trial_idx >= len(trials):
-            print(f"試行インデックスエラー: {trial_idx}, 試行数: {len(trials) if trials else 0}")
+            logger.warning("試行インデックスエラー: %d, 試行数: %d", trial_idx, len(trials) if trials else 0)
             return jsonify({'status': 'error', 'message': '試行インデックスエラー'})
             
         trial_data = trials[trial_idx]
@@ -141,7 +144,7 @@ def record_response():
             'error_type': error_type
         }
         
-        print(f"記録する結果: {result}")  # デバッグ用
+        logger.debug("記録する結果", extra={'fields': {'result': result}})
         
         # セッションから結果リストを取得（なければ新規作成）
         if 'results' not in session:
@@ -153,9 +156,7 @@ def record_response():
         
         return jsonify({'status': 'success', 'recorded': True})
     except Exception as e:
-        print(f"エラー発生: {str(e)}")
-        import traceback
-        traceback.print_exc()  # より詳細なエラー情報
+        logger.exception("エラー発生: %s", e)
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/results')
@@ -164,10 +165,10 @@ def show_results():
         results = session.get('results', [])
         
         if not results:
-            print("結果がありません")
+            logger.info("結果がありません")
             return render_template('gonogoindex.html', error='結果がありません', template='results')
         
-        print(f"結果件数: {len(results)}")
+        logger.debug("結果件数: %d", len(results))
         
         # 集計データを準備
         total_trials = len(results)
@@ -202,7 +203,7 @@ def show_results():
             'nogo_false_alarms': nogo_false_alarms
         }
         
-        print(f"サマリー: {summary}")
+        logger.info("サマリー", extra={'fields': {'summary': summary}})
         
         # 試行ごとのデータ
         trial_data = []
@@ -219,9 +220,7 @@ def show_results():
         
         return render_template('gonogoindex.html', summary=summary, trial_data=trial_data, template='results')
     except Exception as e:
-        print(f"結果表示エラー: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("結果表示エラー: %s", e)
         return render_template('gonogoindex.html', error=f'エラーが発生しました: {str(e)}', template='results')
 
 if __name__ == '__main__':
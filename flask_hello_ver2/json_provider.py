@@ -0,0 +1,37 @@
+"""orjson による JSON レスポンスの書き出し
+
+orjson がインストールされていれば、jsonify() と JSON を返すルートのレスポンスを
+orjson で書き出す（試行データを含む結果APIのレスポンスで特に効く）。
+インストールされていなければ Flask 標準の書き出しのまま動く。
+
+セッションクッキーの書き出しのように引数付きで dumps() が呼ばれる場合は、
+出力の形式を変えないよう標準の実装を使う。
+"""
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # 文字列以外のキー（整数など）も標準の実装と同じく文字列にして書き出す
+    option = 0 if orjson is None else orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.option), mimetype=self.mimetype)
+
+
+def init_json(app):
+    """orjson があれば app の JSON の書き出しを置き換える"""
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+    return app.json
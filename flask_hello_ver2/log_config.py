@@ -0,0 +1,142 @@
+"""構造化（JSON）ログの設定
+
+リクエスト処理中は QueueHandler でキューに積むだけにし、実際の書き出しは
+QueueListener のバックグラウンドスレッドで行う。
+
+環境変数:
+    LOG_LEVEL               全体のログレベル（デフォルト: INFO）
+    LOG_LEVEL_<TASK>        課題ごとのログレベル（例: LOG_LEVEL_STROOP=DEBUG）
+    LOG_SAMPLE_RATES        ルート（エンドポイント名）ごとのサンプリング率
+                            （例: "stroop_record_response=0.1,nback_next_trial=0.05"）
+    LOG_SAMPLE_DEFAULT      サンプリング率の既定値（デフォルト: 1.0）
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+from flask import has_request_context, request
+
+LOGGER_NAME = 'cognitive_task'
+TASKS = ('main', 'flanker', 'gonogo', 'stroop', 'nback')
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行のJSONに整形する"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        route = getattr(record, 'route', None)
+        if route:
+            payload['route'] = route
+        fields = getattr(record, 'fields', None)
+        if fields:
+            payload.update(fields)
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            payload['exc'] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """例外の情報を exc_text に残したままキューに積む
+
+    標準の QueueHandler.prepare はメッセージにトレースバックを連結して exc_info を消すため、
+    JsonFormatter の exc の項目が出なくなる。ここではメッセージだけを確定させ、
+    トレースバックは文字列にして exc_text に入れる（フレームへの参照はキューに残さない）。
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RouteSamplingFilter(logging.Filter):
+    """ルートごとのサンプリング率で WARNING 未満のレコードを間引く
+
+    キューに積む前（リクエストスレッド側）で判定するため、
+    間引かれたレコードは整形も書き出しもされない。
+    """
+
+    def __init__(self, rates=None, default_rate=1.0):
+        super().__init__()
+        self.rates = rates or {}
+        self.default_rate = default_rate
+
+    def filter(self, record):
+        if not hasattr(record, 'route'):
+            record.route = request.endpoint if has_request_context() else None
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.route, self.default_rate)
+        return rate >= 1.0 or random.random() < rate
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        route, rate = item.split('=', 1)
+        try:
+            rates[route.strip()] = float(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+def configure_logging(stream=None):
+    """ログ出力を設定する（複数回呼ばれても一度だけ設定する）"""
+    global _listener
+    base = logging.getLogger(LOGGER_NAME)
+    if _listener is not None:
+        return base
+
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(RouteSamplingFilter(
+        _parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES')),
+        float(os.environ.get('LOG_SAMPLE_DEFAULT', 1.0)),
+    ))
+
+    base.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    base.addHandler(queue_handler)
+    base.propagate = False
+    for task in TASKS:
+        level = os.environ.get(f'LOG_LEVEL_{task.upper()}')
+        if level:
+            logging.getLogger(f'{LOGGER_NAME}.{task}').setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return base
+
+
+def get_logger(task):
+    """課題ごとのロガーを返す"""
+    configure_logging()
+    return logging.getLogger(f'{LOGGER_NAME}.{task}')
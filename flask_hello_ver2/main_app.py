@@ -1,18 +1,414 @@
-from flask import Flask, render_template, request, jsonify, session
-import random
 import time
+IMPORT_STARTED = time.perf_counter()  # 起動時間の計測用（flask の import から数える）
+
+from flask import Flask, Response, abort, redirect, render_template, request, jsonify, session, url_for
+import random
 from datetime import datetime
 import json
+import os
+import hmac
+import uuid
+
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import norms
+import pubsub
+import quality
+import storage
+import summary_cache
+from session_store import init_sessions
+from json_provider import init_json
+from log_config import get_logger
+from profiling import init_profiling
+from quality import QUALITY_DEFAULTS, quality_fields
+from ratelimit import Limit, RateLimiter
+from rt_stats import RT_DEFAULTS, rt_fields
+from studies import DEFAULT_STUDY_ID, StudyRegistry
+from trial_codec import flanker_codec, gonogo_codec, nback_codec, stroop_codec
+from validation import ValidationError, compile_schema, parse_form, parse_json
+from warmup import Warmup, compile_templates
 
 app = Flask(__name__)
-app.secret_key = "main_task_secret_key"
+# ワーカーを複数立てる場合はすべて同じ SECRET_KEY にする
+app.secret_key = os.environ.get('SECRET_KEY', "main_task_secret_key")
 app.config['SESSION_TYPE'] = 'filesystem'
+# これを超えるボディは読み込まない。通常のルートは validation.py でさらに 1KB に絞っており、
+# 64KB はバッテリーの1ブロック分の反応（MAX_BATTERY_BLOCK_BYTES = 48KB）を受け取るための上限
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024
+app.config['PERSIST_BLOCKS'] = True  # False にすると反応の追記と終了したブロックを保存しない（replay.py で使用）
+
+# テンプレートのコンパイル結果を保存し、次の起動では読み込むだけにする（warmup.py）
+TEMPLATE_CACHE_DIR = os.path.join(app.instance_path, 'template_cache')
+try:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+except OSError:
+    get_logger('main').warning("テンプレートのキャッシュを作れません: %s", TEMPLATE_CACHE_DIR)
+
+MAX_REACTION_TIME = 10000  # 記録を受け付ける反応時間の上限（ミリ秒）
+
+@app.errorhandler(ValidationError)
+def handle_validation_error(e):
+    return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.errorhandler(413)
+def handle_payload_too_large(e):
+    return jsonify({'status': 'error', 'message': 'リクエストが大きすぎます'}), 413
+
+# SESSION_BACKEND を指定すればセッションの中身をサーバー側の共有ストアに置く（session_store.py）
+init_sessions(app)
+
+# orjson がインストールされていれば JSON のレスポンスを orjson で書き出す
+init_json(app)
+
+# リバースプロキシ（Renderなど）の背後では X-Forwarded-For から接続元IPを取る
+if os.environ.get('TRUST_PROXY_HOPS'):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ['TRUST_PROXY_HOPS']))
+
+# PROFILE_MODE=cprofile / sampling でリクエストのプロファイルを取る（デフォルトは無効）
+init_profiling(app)
+
+limiter = RateLimiter(app)
+
+# static/vendor/（vendor_assets.py で生成）のうち、各ページの先頭で preload するファイル
+def load_preload_assets():
+    path = os.path.join(app.static_folder, 'vendor', 'manifest.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['preload']
+    except (OSError, ValueError, KeyError):
+        get_logger('main').warning("static/vendor/manifest.json を読み込めませんでした（vendor_assets.py を実行してください）")
+        return []
+
+PRELOAD_ASSETS = load_preload_assets()
+
+@app.context_processor
+def inject_preload_assets():
+    return {'preload_assets': PRELOAD_ASSETS}
+
+# 結果画面の集計のキャッシュ（(セッションID, 課題) ごと。results_changed() で無効にする）
+summaries = summary_cache.from_env()
+
+# 結果画面で比べる基準値の表（norms.py で作る。ファイルが更新されれば読み直す）
+norm_tables = norms.NormRegistry(norms.norms_path())
+
+# ===== 研究ごとの設定 =====
+# 課題ごとのパラメータの既定値（各課題のセクションで登録し、studies/ の研究設定で上書きする）
+TASK_DEFAULTS = {}
+studies = StudyRegistry(os.path.join(app.root_path, 'studies'), TASK_DEFAULTS)
+
+def current_study():
+    """セッションで選択されている研究の設定"""
+    return studies.get(session.get('study', DEFAULT_STUDY_ID)) or studies.get(DEFAULT_STUDY_ID)
+
+def select_study():
+    """?study= で研究が指定されていればセッションに保存する"""
+    study_id = request.args.get('study')
+    if study_id is not None:
+        if studies.get(study_id) is None:
+            abort(404)
+        session['study'] = study_id
+    return current_study()
+
+def task_params(task):
+    return current_study().params[task]
+
+def with_defaults(form, params):
+    """フォームで指定されなかった値を研究設定の値で埋める"""
+    return {key: params[key] if value is None else value for key, value in form.items()}
+
+def new_seed(task):
+    """試行リスト生成用のシード
+
+    研究にシードがあれば課題ごとに固定の値（全参加者で同じ試行順）、
+    なければ毎回新しい値を返す。replay.py で保存済みのセッションを再現するときは
+    セッションに置かれたシードを1回だけ使う（セッションは署名付きなので、
+    この値はサーバー側からしか設定できない）。
+    """
+    replay_seed = session.pop('replay_seed', None)
+    if replay_seed is not None:
+        return replay_seed
+    study_seed = current_study().seed
+    return f'{study_seed}:{task}' if study_seed is not None else random.getrandbits(32)
+
+def session_rng(task):
+    """試行リスト生成用の乱数生成器（使ったシードはセッションに残す）"""
+    seed = session['seed'] = new_seed(task)
+    return random.Random(seed)
+
+def session_id():
+    """セッションを識別するID（なければ発行する）"""
+    sid = session.get('sid')
+    if sid is None:
+        sid = session['sid'] = uuid.uuid4().hex
+    return sid
+
+def persist_block(task):
+    """すべての試行が終わったブロックを一度だけ保存する"""
+    if not app.config['PERSIST_BLOCKS']:
+        return
+    if session.get('block_id') is not None or not session.get('results'):
+        return
+    try:
+        session['block_id'] = storage.save_block(
+            session_id(), current_study().study_id, task,
+            session.get('seed'), session.get('trials', b''), session['results'])
+    except Exception as e:
+        get_logger(task).exception("ブロックの保存に失敗しました: %s", e)
+
+TRIAL_PAGE_SCHEMA = compile_schema({
+    'cursor': ('int', 0, 100000, 0),
+    'limit': ('int', 1, 200, 100),
+})
+
+def trial_page(results, trial_row):
+    """結果表の cursor 番目の試行から limit 件を返す
+
+    結果は追記されるだけなので、試行の添字をそのままカーソルに使う。
+    表示用の dict にするのは返す範囲の試行だけ。
+    """
+    args = TRIAL_PAGE_SCHEMA(request.args)
+    cursor, limit = args['cursor'], args['limit']
+    page = results[cursor:cursor + limit]
+    end = cursor + len(page)
+    return jsonify({
+        'status': 'success',
+        'trials': [trial_row(r) for r in page],
+        'total': len(results),
+        'next_cursor': end if end < len(results) else None,
+    })
+
+def results_changed(task):
+    """session['results'] を書き換えたら呼ぶ（結果の版を進め、キャッシュ済みの集計を捨てる）"""
+    session['results_task'] = task
+    session['results_version'] = session.get('results_version', 0) + 1
+    summaries.invalidate((session_id(), task))
+
+def cached_summary(task, results):
+    """結果の集計（同じ版の結果の集計はキャッシュから返す）"""
+    study = current_study()
+    return summaries.get_or_compute(
+        (session_id(), task), (session.get('results_version', 0), study.study_id, study.version),
+        lambda: TASKS[task]['summarize'](results, study.params[task])[0])
+
+def norm_rows(task, summary):
+    """要約の指標の、研究の基準集団（norm_group）の中でのパーセンタイル"""
+    spec = TASKS[task]
+    return norm_tables.table().percentiles(current_study().norm_group, task, summary, spec['norm_metrics'],
+                                           spec['norm_requires'])
+
+# ===== 反応の記録 =====
+# 試行ごとに「ブロックのトークン:試行の添字」の試行IDを発行し、反応は試行IDで記録する。
+# クライアントが前の試行の反応の送信を待たずに次の試行を取得しても、反応は正しい試行に付く。
+# 反応は DB の response_log にも追記する（主キーで重複を防ぐのでロックは要らない）。
+# 並行したリクエストがクッキーを上書きし合ってセッションから結果が落ちても、
+# sync_results() で response_log から取り戻せる。
+TRIAL_ID_PATTERN = r'[0-9a-f]{32}:[0-9]{1,6}'
+
+def new_block_token():
+    session['block_token'] = uuid.uuid4().hex
+
+def trial_id(trial_idx):
+    return f"{session['block_token']}:{trial_idx}"
+
+PRERENDER_AHEAD = 3  # next_trial で先に知らせる刺激の数（クライアントが空白の間に組み立てる）
+
+def upcoming_stimuli(codec, trials, trial_idx, describe):
+    """trial_idx の次から PRERENDER_AHEAD 試行分の刺激（クライアントの事前描画用）"""
+    end = min(trial_idx + 1 + PRERENDER_AHEAD, len(trials))
+    return [describe(codec.trial(trials, i)) for i in range(trial_idx + 1, end)]
+
+def response_trial_index(data):
+    """反応が属する試行の添字（提示していない試行や別のブロックの試行なら None）
+
+    試行IDがなければ、直前に提示した試行の反応とみなす。
+    """
+    current_trial = session.get('current_trial', 0)
+    if data.get('trial_id') is None:
+        return current_trial - 1
+    token, seq = data['trial_id'].split(':')
+    trial_idx = int(seq)
+    if token != session.get('block_token') or trial_idx >= current_trial:
+        return None
+    return trial_idx
+
+def record_result(task, trial_idx, result):
+    """試行の結果を記録する（記録済みの試行なら False を返す）
+
+    response_log に同じ試行の結果が先に記録されていた場合（同じ反応の再送や、
+    巻き戻ったクッキーからの送信）は、送られた結果ではなく記録済みの結果をセッションに入れる。
+    """
+    results = session.get('results', [])
+    if any(r['trial'] == result['trial'] for r in results):
+        return False
+    # データの質の旗は記録時に付ける（response_log と保存するブロックにも残る）
+    params = task_params(task)
+    previous = session.get('quality') or quality.new_state()
+    state = dict(previous)
+    flags = quality.check(state, result, params)
+    if flags:
+        result['flags'] = flags
+    recorded = True
+    if app.config['PERSIST_BLOCKS'] and session.get('block_token'):
+        try:
+            if not storage.append_response(session['block_token'], trial_idx, result):
+                logged = storage.load_response(session['block_token'], trial_idx)
+                if logged is not None:
+                    result, recorded = logged, False
+                    state = dict(previous)
+                    quality.check(state, result, params)
+        except Exception as e:
+            get_logger(task).exception("反応の追記に失敗しました: %s", e)
+    session['quality'] = state
+    results.append(result)
+    if len(results) > 1 and results[-2]['trial'] > result['trial']:
+        results.sort(key=lambda r: r['trial'])
+    session['results'] = results
+    results_changed(task)
+    return recorded
+
+def sync_results(task):
+    """response_log にあってセッションにない結果を取り込み、結果の一覧を返す
+
+    保存済みのブロックはそのときに取り込み済みなので読まない。それ以外も件数だけを先に数え、
+    セッションの結果より多いとき（結果が落ちていたとき）だけ response_log を読む。
+    """
+    results = session.get('results', [])
+    token = session.get('block_token')
+    if (not app.config['PERSIST_BLOCKS'] or token is None or session.get('results_task') != task
+            or session.get('block_id') is not None):
+        return results
+    try:
+        if storage.count_responses(token) <= len(results):
+            return results
+        logged = storage.load_responses(token)
+    except Exception as e:
+        get_logger(task).exception("反応の読み込みに失敗しました: %s", e)
+        return results
+    by_trial = {r['trial']: r for r in results}
+    for result in logged:
+        by_trial.setdefault(result['trial'], result)
+    results = [by_trial[trial] for trial in sorted(by_trial)]
+    session['results'] = results
+    results_changed(task)
+    return results
+
+def reset_task_session(task):
+    session['trials'] = b''
+    session['block_token'] = None
+    session['current_trial'] = 0
+    session['results'] = []
+    session['quality'] = None
+    session['start_time'] = None
+    results_changed(task)
+
+@app.before_request
+def upgrade_legacy_trials():
+    """試行リストを dict のリストで持っていた以前のセッションを、課題のコードの bytes に詰め直す
+
+    課題のルートで初めて読むときに変換し、その課題の試行として詰められなければ課題の状態を消す。
+    以前のセッションにはブロックのトークンもないので、ここで発行する（試行IDに使う）。
+    """
+    trials = session.get('trials')
+    if not isinstance(trials, list):
+        return
+    task = (request.view_args or {}).get('task') or (request.endpoint or '').split('_', 1)[0]
+    if task not in TASKS:
+        return
+    try:
+        session['trials'] = TASKS[task]['codec'].encode(trials)
+        if session.get('block_token') is None:
+            new_block_token()
+    except (KeyError, TypeError, ValueError) as e:
+        get_logger(task).warning("以前の形式の試行リストを変換できないため課題の状態を消しました: %s", e)
+        reset_task_session(task)
+
+# ===== 参加者ID =====
+# 参加者IDがあるときは課題の途中経過を (参加者ID, 研究ID, 課題) の主キーで保存し、
+# ページを再読み込みしたりブラウザを閉じたりしても途中の試行から再開できるようにする。
+PARTICIPANT_SCHEMA = compile_schema({
+    'participant_id': ('pattern', r'[A-Za-z0-9_-]{1,64}'),
+})
+
+def enter_participant(participant_id):
+    session['participant_id'] = participant_id
+    storage.register_participant(participant_id)
+    get_logger('main').info("参加者IDを設定しました", extra={'fields': {'participant_id': participant_id}})
+
+def save_participant_state(task):
+    """参加者IDがあれば現在の途中経過を保存する（課題の開始時と終了時）
+
+    反応は record_result が response_log に追記するので、ここでは結果を書かずに
+    ブロックのトークンだけを保存する（反応のたびに結果の一覧全体を書き直さない）。
+    """
+    participant_id = session.get('participant_id')
+    if participant_id is None:
+        return
+    persisted = app.config['PERSIST_BLOCKS'] and session.get('block_token')
+    try:
+        storage.save_state(
+            participant_id, current_study().study_id, task, session.get('trials', b''),
+            session.get('current_trial', 0), [] if persisted else session.get('results', []),
+            session.get('seed'), session.get('block_id'), session.get('block_token') if persisted else None)
+    except Exception as e:
+        get_logger(task).exception("途中経過の保存に失敗しました: %s", e)
+
+def restore_participant_state(task):
+    """未完了の途中経過があればセッションに戻し、再開位置を返す（なければ None）
+
+    最後に提示した試行の反応が記録されていない場合に備え、
+    記録済みの反応数の位置（次に反応を記録すべき試行）から再開する。
+    """
+    participant_id = session.get('participant_id')
+    if participant_id is None:
+        return None
+    state = storage.load_state(participant_id, current_study().study_id, task)
+    if state is None or state['block_id'] is not None:
+        # 保存済みのブロックは完了している（response_log はアーカイブの際に消えていることがある）
+        return None
+    token = state.get('block_token')
+    results = storage.load_responses(token) if token else state['results']
+    if len(results) >= len(state['trials']):
+        return None
+    session['trials'] = state['trials']
+    session['current_trial'] = len(results)
+    session['results'] = results
+    session['quality'] = quality.flag_results(results, task_params(task))
+    if token:
+        # 同じトークンの response_log に続きを追記する
+        session['block_token'] = token
+    else:
+        new_block_token()
+        if app.config['PERSIST_BLOCKS']:
+            # 結果を participant_state に持っていた途中経過は、新しいトークンで response_log に入れておく
+            try:
+                storage.append_responses(session['block_token'], [(r['trial'] - 1, r) for r in results])
+            except Exception as e:
+                get_logger(task).exception("反応の追記に失敗しました: %s", e)
+    results_changed(task)
+    session['seed'] = state['seed']
+    session['block_id'] = state['block_id']
+    return {'current_trial': session['current_trial'], 'total_trials': len(state['trials'])}
 
 # ===== メイン画面 =====
 @app.route('/')
 def index():
     """課題選択画面"""
-    return render_template('task_selection.html')
+    study = select_study()
+    return render_template('task_selection.html', study=study, participant_id=session.get('participant_id'))
+
+@app.route('/p/<participant_id>')
+def participant_link(participant_id):
+    """参加者ごとのURL（/p/<参加者ID>?study=...）から開始する"""
+    enter_participant(PARTICIPANT_SCHEMA({'participant_id': participant_id})['participant_id'])
+    return redirect(url_for('index', study=request.args.get('study')))
+
+@app.route('/participant', methods=['POST'])
+def participant_form():
+    """課題選択画面のフォームから参加者IDを設定する"""
+    enter_participant(parse_form(PARTICIPANT_SCHEMA)['participant_id'])
+    return redirect(url_for('index'))
 
 # ===== Flanker課題 =====
 # フランカー刺激の種類
@@ -23,6 +419,7 @@ STIMULI_FLANKER = [
     ">><>>"   # 不一致条件
 ]
 
+logger_flanker = get_logger('flanker')
 STIMULUS_DURATION_FLANKER = 300  # 0.3秒
 BLANK_DURATION_FLANKER = 1500    # 1.5秒
 LEFT_KEY = 'c'  # 左方向の反応キー
@@ -35,259 +432,371 @@ STIMULUS_DISPLAY = {
     "<<><<": "&lt;&lt;&gt;&lt;&lt;"
 }
 
+FLANKER_CODEC = flanker_codec(STIMULI_FLANKER)
+
+TASK_DEFAULTS['flanker'] = {
+    'stimulus_duration': STIMULUS_DURATION_FLANKER,
+    'blank_duration': BLANK_DURATION_FLANKER,
+    'left_key': LEFT_KEY,
+    'right_key': RIGHT_KEY,
+    'trials_per_stimulus': 5,
+    **RT_DEFAULTS,
+    **QUALITY_DEFAULTS,
+}
+
+FLANKER_START_SCHEMA = compile_schema({
+    'trials_per_stimulus': ('int', 1, 50, None),
+})
+FLANKER_RESPONSE_SCHEMA = compile_schema({
+    'response': ('choice', ('left', 'right')),
+    'reaction_time': ('number', 0, MAX_REACTION_TIME),
+    'trial_id': ('pattern', TRIAL_ID_PATTERN, False),
+})
+
+def generate_flanker_trials(rng, params):
+    trials = []
+    for stimulus in STIMULI_FLANKER:
+        for _ in range(params['trials_per_stimulus']):
+            trials.append(stimulus)
+    rng.shuffle(trials)
+    return trials
+
+def score_flanker(stimulus, trial_idx, data, params):
+    correct_response = 'left' if stimulus[2] == '<' else 'right'
+    is_correct = data.get('response') == correct_response
+    trial_type = 'congruent' if stimulus[0] == stimulus[2] else 'incongruent'
+    result = {
+        'trial': trial_idx + 1,
+        'stimulus': stimulus,
+        'response': data.get('response'),
+        'reaction_time': data.get('reaction_time'),
+        'is_correct': is_correct,
+        'trial_type': trial_type
+    }
+    return result
+
+def flanker_trial_row(r):
+    """結果の1試行を結果表の1行（dict）にする"""
+    return {
+        'trial': r.get('trial', 0),
+        'stimulus': r.get('stimulus', ''),
+        'response': r.get('response'),
+        'reaction_time': round(r.get('reaction_time'), 2) if r.get('reaction_time') is not None else None,
+        'is_correct': r.get('is_correct', False),
+        'trial_type': r.get('trial_type', ''),
+        'flags': r.get('flags', [])
+    }
+
+def summarize_flanker(results, params):
+    total_trials = len(results)
+    correct_trials = sum(1 for r in results if r.get('is_correct', False))
+    accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
+    congruent_results = [r for r in results if r.get('trial_type') == 'congruent']
+    incongruent_results = [r for r in results if r.get('trial_type') == 'incongruent']
+    congruent_correct = sum(1 for r in congruent_results if r.get('is_correct', False))
+    congruent_accuracy = congruent_correct / len(congruent_results) * 100 if congruent_results else 0
+    congruent_rts = [r['reaction_time'] for r in congruent_results if r.get('reaction_time') is not None and r.get('is_correct', False)]
+    congruent_rt, congruent_kept = rt_fields('congruent', congruent_rts, params)
+    incongruent_correct = sum(1 for r in incongruent_results if r.get('is_correct', False))
+    incongruent_accuracy = incongruent_correct / len(incongruent_results) * 100 if incongruent_results else 0
+    incongruent_rts = [r['reaction_time'] for r in incongruent_results if r.get('reaction_time') is not None and r.get('is_correct', False)]
+    incongruent_rt, incongruent_kept = rt_fields('incongruent', incongruent_rts, params)
+    correct_rts = congruent_kept + incongruent_kept
+    avg_rt = sum(correct_rts) / len(correct_rts) if correct_rts else 0
+    interference_effect = incongruent_rt['incongruent_avg_rt'] - congruent_rt['congruent_avg_rt']
+    interference_effect_median = incongruent_rt['incongruent_median_rt'] - congruent_rt['congruent_median_rt']
+    summary = {
+        'total_trials': total_trials,
+        'accuracy': round(accuracy, 2),
+        'avg_rt': round(avg_rt, 2),
+        'rt_count': len(correct_rts),
+        'congruent_accuracy': round(congruent_accuracy, 2),
+        **congruent_rt,
+        'incongruent_accuracy': round(incongruent_accuracy, 2),
+        **incongruent_rt,
+        'interference_effect': round(interference_effect, 2),
+        'interference_effect_median': round(interference_effect_median, 2),
+        **quality_fields(results, params),
+    }
+    trial_data = [flanker_trial_row(r) for r in results]
+    return summary, trial_data
+
 @app.route('/flanker')
 def flanker_index():
-    session['trials'] = []
-    session['current_trial'] = 0
-    session['results'] = []
-    session['start_time'] = None
-    return render_template('flankerindex.html', template='index')
+    select_study()
+    reset_task_session('flanker')
+    resume = restore_participant_state('flanker')
+    return render_template('flankerindex.html', template='index', params=task_params('flanker'), resume=resume)
 
 @app.route('/flanker/start', methods=['POST'])
 def flanker_start():
-    trials_per_stimulus = int(request.form.get('trials_per_stimulus', 5))
-    trials = []
-    for stimulus in STIMULI_FLANKER:
-        for _ in range(trials_per_stimulus):
-            trials.append(stimulus)
-    random.shuffle(trials)
-    session['trials'] = trials
+    params = with_defaults(parse_form(FLANKER_START_SCHEMA), task_params('flanker'))
+    trials = generate_flanker_trials(session_rng('flanker'), params)
+    session['trials'] = FLANKER_CODEC.encode(trials)
     session['current_trial'] = 0
     session['results'] = []
+    session['quality'] = None
+    new_block_token()
+    results_changed('flanker')
+    session['block_id'] = None
     session['start_time'] = time.time()
+    save_participant_state('flanker')
     return jsonify({'status': 'success', 'total_trials': len(trials)})
 
 @app.route('/flanker/next_trial')
 def flanker_next_trial():
-    trials = session.get('trials', [])
+    trials = session.get('trials', b'')
     current_trial = session.get('current_trial', 0)
     if current_trial >= len(trials):
+        sync_results('flanker')
+        persist_block('flanker')
+        save_participant_state('flanker')
         return jsonify({'status': 'completed'})
-    stimulus = trials[current_trial]
+    stimulus = FLANKER_CODEC.trial(trials, current_trial)
     session['current_trial'] = current_trial + 1
+    params = task_params('flanker')
     return jsonify({
         'status': 'next',
         'stimulus': stimulus,
         'stimulus_display': STIMULUS_DISPLAY.get(stimulus, stimulus),
+        'upcoming': upcoming_stimuli(FLANKER_CODEC, trials, current_trial, lambda s: {'stimulus': s}),
+        'trial_id': trial_id(current_trial),
+        'seq': current_trial,
         'trial_number': current_trial + 1,
         'total_trials': len(trials),
-        'stimulus_duration': STIMULUS_DURATION_FLANKER,
-        'blank_duration': BLANK_DURATION_FLANKER,
-        'left_key': LEFT_KEY,
-        'right_key': RIGHT_KEY
+        'stimulus_duration': params['stimulus_duration'],
+        'blank_duration': params['blank_duration'],
+        'left_key': params['left_key'],
+        'right_key': params['right_key']
     })
 
 @app.route('/flanker/record_response', methods=['POST'])
 def flanker_record_response():
+    data = parse_json(FLANKER_RESPONSE_SCHEMA)
     try:
-        data = request.get_json()
-        trial_idx = session.get('current_trial', 0) - 1
+        trial_idx = response_trial_index(data)
+        if trial_idx is None:
+            return jsonify({'status': 'error', 'message': '試行IDが不正です'})
         if trial_idx < 0:
             return jsonify({'status': 'error', 'message': '試行が開始されていません'})
-        trials = session.get('trials', [])
+        trials = session.get('trials', b'')
         if not trials or trial_idx >= len(trials):
             return jsonify({'status': 'error', 'message': '試行インデックスエラー'})
-        stimulus = trials[trial_idx]
-        correct_response = 'left' if stimulus[2] == '<' else 'right'
-        is_correct = data.get('response') == correct_response
-        trial_type = 'congruent' if stimulus[0] == stimulus[2] else 'incongruent'
-        result = {
-            'trial': trial_idx + 1,
-            'stimulus': stimulus,
-            'response': data.get('response'),
-            'reaction_time': data.get('reaction_time'),
-            'is_correct': is_correct,
-            'trial_type': trial_type
-        }
-        if 'results' not in session:
-            session['results'] = []
-        results = session.get('results', [])
-        results.append(result)
-        session['results'] = results
-        return jsonify({'status': 'success', 'recorded': True})
+        stimulus = FLANKER_CODEC.trial(trials, trial_idx)
+        result = score_flanker(stimulus, trial_idx, data, task_params('flanker'))
+        recorded = record_result('flanker', trial_idx, result)
+        logger_flanker.debug("記録する結果", extra={'fields': {'result': result, 'recorded': recorded}})
+        return jsonify({'status': 'success', 'recorded': recorded})
     except Exception as e:
+        logger_flanker.exception("反応記録エラー: %s", e)
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/flanker/results')
 def flanker_results():
     try:
-        results = session.get('results', [])
+        results = sync_results('flanker')
         if not results:
             return render_template('flankerindex.html', error='結果がありません', template='results')
-        total_trials = len(results)
-        correct_trials = sum(1 for r in results if r.get('is_correct', False))
-        accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
-        correct_rts = [r.get('reaction_time', 0) for r in results if r.get('is_correct', False)]
-        avg_rt = sum(correct_rts) / len(correct_rts) if correct_rts else 0
-        congruent_results = [r for r in results if r.get('trial_type') == 'congruent']
-        incongruent_results = [r for r in results if r.get('trial_type') == 'incongruent']
-        congruent_correct = sum(1 for r in congruent_results if r.get('is_correct', False))
-        congruent_accuracy = congruent_correct / len(congruent_results) * 100 if congruent_results else 0
-        congruent_rts = [r.get('reaction_time', 0) for r in congruent_results if r.get('is_correct', False)]
-        congruent_avg_rt = sum(congruent_rts) / len(congruent_rts) if congruent_rts else 0
-        incongruent_correct = sum(1 for r in incongruent_results if r.get('is_correct', False))
-        incongruent_accuracy = incongruent_correct / len(incongruent_results) * 100 if incongruent_results else 0
-        incongruent_rts = [r.get('reaction_time', 0) for r in incongruent_results if r.get('is_correct', False)]
-        incongruent_avg_rt = sum(incongruent_rts) / len(incongruent_rts) if incongruent_rts else 0
-        interference_effect = incongruent_avg_rt - congruent_avg_rt
-        summary = {
-            'total_trials': total_trials,
-            'accuracy': round(accuracy, 2),
-            'avg_rt': round(avg_rt, 2),
-            'congruent_accuracy': round(congruent_accuracy, 2),
-            'congruent_avg_rt': round(congruent_avg_rt, 2),
-            'incongruent_accuracy': round(incongruent_accuracy, 2),
-            'incongruent_avg_rt': round(incongruent_avg_rt, 2),
-            'interference_effect': round(interference_effect, 2)
-        }
-        trial_data = []
-        for r in results:
-            trial_data.append({
-                'trial': r.get('trial', 0),
-                'stimulus': r.get('stimulus', ''),
-                'response': r.get('response'),
-                'reaction_time': round(r.get('reaction_time', 0), 2),
-                'is_correct': r.get('is_correct', False),
-                'trial_type': r.get('trial_type', '')
-            })
-        return render_template('flankerindex.html', summary=summary, trial_data=trial_data, template='results')
+        summary = cached_summary('flanker', results)
+        return render_template('flankerindex.html', summary=summary, norms=norm_rows('flanker', summary),
+                               total_trials=len(results), template='results')
     except Exception as e:
+        logger_flanker.exception("結果表示エラー: %s", e)
         return render_template('flankerindex.html', error=f'エラーが発生しました: {str(e)}', template='results')
 
+@app.route('/flanker/results/trials')
+def flanker_results_trials():
+    return trial_page(sync_results('flanker'), flanker_trial_row)
+
 # ===== Go/NoGo課題 =====
+logger_gonogo = get_logger('gonogo')
 STIMULI_GONOGO = {'go': 'go', 'nogo': 'nogo'}
 STIMULUS_DURATION_GONOGO = 500
 ISI_DURATION_GONOGO = 1500
 RESPONSE_KEY_GONOGO = 'space'
 
+GONOGO_CODEC = gonogo_codec(STIMULI_GONOGO)
+
+TASK_DEFAULTS['gonogo'] = {
+    'stimulus_duration': STIMULUS_DURATION_GONOGO,
+    'isi_duration': ISI_DURATION_GONOGO,
+    'go_trials': 20,
+    'nogo_trials': 10,
+    **RT_DEFAULTS,
+    **QUALITY_DEFAULTS,
+    'quality_same_key_run': None,  # 反応キーが1つなので、同じキーの連続は見ない
+}
+
+GONOGO_START_SCHEMA = compile_schema({
+    'go_trials': ('int', 0, 200, None),
+    'nogo_trials': ('int', 0, 200, None),
+})
+GONOGO_RESPONSE_SCHEMA = compile_schema({
+    'response': ('choice', (RESPONSE_KEY_GONOGO,)),
+    'reaction_time': ('number', 0, MAX_REACTION_TIME),
+    'trial_id': ('pattern', TRIAL_ID_PATTERN, False),
+})
+
+def generate_gonogo_trials(rng, params):
+    trials = []
+    for _ in range(params['go_trials']):
+        trials.append({'type': 'go', 'stimulus': STIMULI_GONOGO['go']})
+    for _ in range(params['nogo_trials']):
+        trials.append({'type': 'nogo', 'stimulus': STIMULI_GONOGO['nogo']})
+    rng.shuffle(trials)
+    return trials
+
+def score_gonogo(trial_data, trial_idx, data, params):
+    trial_type = trial_data['type']
+    has_response = data.get('response') is not None
+    if trial_type == 'go':
+        is_correct = has_response
+        error_type = 'miss' if not has_response else None
+    else:
+        is_correct = not has_response
+        error_type = 'false_alarm' if has_response else None
+    result = {
+        'trial': trial_idx + 1,
+        'stimulus': trial_data['stimulus'],
+        'trial_type': trial_type,
+        'response': data.get('response'),
+        'reaction_time': data.get('reaction_time'),
+        'is_correct': is_correct,
+        'error_type': error_type
+    }
+    return result
+
+def gonogo_trial_row(r):
+    """結果の1試行を結果表の1行（dict）にする"""
+    return {
+        'trial': r.get('trial', 0),
+        'stimulus': r.get('stimulus', ''),
+        'trial_type': r.get('trial_type', ''),
+        'response': r.get('response'),
+        'reaction_time': round(r.get('reaction_time', 0), 2) if r.get('reaction_time') else None,
+        'is_correct': r.get('is_correct', False),
+        'error_type': r.get('error_type', ''),
+        'flags': r.get('flags', [])
+    }
+
+def summarize_gonogo(results, params):
+    total_trials = len(results)
+    correct_trials = sum(1 for r in results if r.get('is_correct', False))
+    accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
+    go_results = [r for r in results if r.get('trial_type') == 'go']
+    go_total = len(go_results)
+    go_correct = sum(1 for r in go_results if r.get('is_correct', False))
+    go_accuracy = go_correct / go_total * 100 if go_total > 0 else 0
+    go_rts = [r['reaction_time'] for r in go_results if r.get('reaction_time') is not None]
+    go_rt, _ = rt_fields('go', go_rts, params)
+    go_misses = sum(1 for r in go_results if r.get('error_type') == 'miss')
+    nogo_results = [r for r in results if r.get('trial_type') == 'nogo']
+    nogo_total = len(nogo_results)
+    nogo_correct = sum(1 for r in nogo_results if r.get('is_correct', False))
+    nogo_accuracy = nogo_correct / nogo_total * 100 if nogo_total > 0 else 0
+    nogo_false_alarms = sum(1 for r in nogo_results if r.get('error_type') == 'false_alarm')
+    summary = {
+        'total_trials': total_trials,
+        'accuracy': round(accuracy, 2),
+        'go_total': go_total,
+        'go_accuracy': round(go_accuracy, 2),
+        **go_rt,
+        'go_misses': go_misses,
+        'nogo_total': nogo_total,
+        'nogo_accuracy': round(nogo_accuracy, 2),
+        'nogo_false_alarms': nogo_false_alarms,
+        **quality_fields(results, params),
+    }
+    trial_data = [gonogo_trial_row(r) for r in results]
+    return summary, trial_data
+
 @app.route('/gonogo')
 def gonogo_index():
-    session['trials'] = []
-    session['current_trial'] = 0
-    session['results'] = []
-    session['start_time'] = None
-    return render_template('gonogoindex.html', template='index')
+    select_study()
+    reset_task_session('gonogo')
+    resume = restore_participant_state('gonogo')
+    return render_template('gonogoindex.html', template='index', params=task_params('gonogo'), resume=resume)
 
 @app.route('/gonogo/start', methods=['POST'])
 def gonogo_start():
-    go_trials = int(request.form.get('go_trials', 20))
-    nogo_trials = int(request.form.get('nogo_trials', 10))
-    trials = []
-    for _ in range(go_trials):
-        trials.append({'type': 'go', 'stimulus': STIMULI_GONOGO['go']})
-    for _ in range(nogo_trials):
-        trials.append({'type': 'nogo', 'stimulus': STIMULI_GONOGO['nogo']})
-    random.shuffle(trials)
-    session['trials'] = trials
+    params = with_defaults(parse_form(GONOGO_START_SCHEMA), task_params('gonogo'))
+    trials = generate_gonogo_trials(session_rng('gonogo'), params)
+    session['trials'] = GONOGO_CODEC.encode(trials)
     session['current_trial'] = 0
     session['results'] = []
+    session['quality'] = None
+    new_block_token()
+    results_changed('gonogo')
+    session['block_id'] = None
     session['start_time'] = time.time()
+    save_participant_state('gonogo')
     return jsonify({'status': 'success', 'total_trials': len(trials)})
 
 @app.route('/gonogo/next_trial')
 def gonogo_next_trial():
-    trials = session.get('trials', [])
+    trials = session.get('trials', b'')
     current_trial = session.get('current_trial', 0)
     if current_trial >= len(trials):
+        sync_results('gonogo')
+        persist_block('gonogo')
+        save_participant_state('gonogo')
         return jsonify({'status': 'completed'})
-    trial_data = trials[current_trial]
+    trial_data = GONOGO_CODEC.trial(trials, current_trial)
     session['current_trial'] = current_trial + 1
+    params = task_params('gonogo')
     return jsonify({
         'status': 'next',
         'stimulus': trial_data['stimulus'],
         'trial_type': trial_data['type'],
+        'upcoming': upcoming_stimuli(GONOGO_CODEC, trials, current_trial, lambda t: {'trial_type': t['type']}),
+        'trial_id': trial_id(current_trial),
+        'seq': current_trial,
         'trial_number': current_trial + 1,
         'total_trials': len(trials),
-        'stimulus_duration': STIMULUS_DURATION_GONOGO,
-        'isi_duration': ISI_DURATION_GONOGO,
-        'max_response_time': STIMULUS_DURATION_GONOGO + ISI_DURATION_GONOGO,
+        'stimulus_duration': params['stimulus_duration'],
+        'isi_duration': params['isi_duration'],
+        'max_response_time': params['stimulus_duration'] + params['isi_duration'],
         'response_key': RESPONSE_KEY_GONOGO
     })
 
 @app.route('/gonogo/record_response', methods=['POST'])
 def gonogo_record_response():
+    data = parse_json(GONOGO_RESPONSE_SCHEMA)
     try:
-        data = request.get_json()
-        trial_idx = session.get('current_trial', 0) - 1
+        trial_idx = response_trial_index(data)
+        if trial_idx is None:
+            return jsonify({'status': 'error', 'message': '試行IDが不正です'})
         if trial_idx < 0:
             return jsonify({'status': 'error', 'message': '試行が開始されていません'})
-        trials = session.get('trials', [])
+        trials = session.get('trials', b'')
         if not trials or trial_idx >= len(trials):
             return jsonify({'status': 'error', 'message': '試行インデックスエラー'})
-        trial_data = trials[trial_idx]
-        trial_type = trial_data['type']
-        has_response = data.get('response') is not None
-        if trial_type == 'go':
-            is_correct = has_response
-            error_type = 'miss' if not has_response else None
-        else:
-            is_correct = not has_response
-            error_type = 'false_alarm' if has_response else None
-        result = {
-            'trial': trial_idx + 1,
-            'stimulus': trial_data['stimulus'],
-            'trial_type': trial_type,
-            'response': data.get('response'),
-            'reaction_time': data.get('reaction_time'),
-            'is_correct': is_correct,
-            'error_type': error_type
-        }
-        if 'results' not in session:
-            session['results'] = []
-        results = session.get('results', [])
-        results.append(result)
-        session['results'] = results
-        return jsonify({'status': 'success', 'recorded': True})
+        trial_data = GONOGO_CODEC.trial(trials, trial_idx)
+        result = score_gonogo(trial_data, trial_idx, data, task_params('gonogo'))
+        recorded = record_result('gonogo', trial_idx, result)
+        logger_gonogo.debug("記録する結果", extra={'fields': {'result': result, 'recorded': recorded}})
+        return jsonify({'status': 'success', 'recorded': recorded})
     except Exception as e:
+        logger_gonogo.exception("反応記録エラー: %s", e)
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/gonogo/results')
 def gonogo_results():
     try:
-        results = session.get('results', [])
+        results = sync_results('gonogo')
         if not results:
             return render_template('gonogoindex.html', error='結果がありません', template='results')
-        total_trials = len(results)
-        correct_trials = sum(1 for r in results if r.get('is_correct', False))
-        accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
-        go_results = [r for r in results if r.get('trial_type') == 'go']
-        go_total = len(go_results)
-        go_correct = sum(1 for r in go_results if r.get('is_correct', False))
-        go_accuracy = go_correct / go_total * 100 if go_total > 0 else 0
-        go_rts = [r.get('reaction_time', 0) for r in go_results if r.get('reaction_time') is not None]
-        go_avg_rt = sum(go_rts) / len(go_rts) if go_rts else 0
-        go_misses = sum(1 for r in go_results if r.get('error_type') == 'miss')
-        nogo_results = [r for r in results if r.get('trial_type') == 'nogo']
-        nogo_total = len(nogo_results)
-        nogo_correct = sum(1 for r in nogo_results if r.get('is_correct', False))
-        nogo_accuracy = nogo_correct / nogo_total * 100 if nogo_total > 0 else 0
-        nogo_false_alarms = sum(1 for r in nogo_results if r.get('error_type') == 'false_alarm')
-        summary = {
-            'total_trials': total_trials,
-            'accuracy': round(accuracy, 2),
-            'go_total': go_total,
-            'go_accuracy': round(go_accuracy, 2),
-            'go_avg_rt': round(go_avg_rt, 2),
-            'go_misses': go_misses,
-            'nogo_total': nogo_total,
-            'nogo_accuracy': round(nogo_accuracy, 2),
-            'nogo_false_alarms': nogo_false_alarms
-        }
-        trial_data = []
-        for r in results:
-            trial_data.append({
-                'trial': r.get('trial', 0),
-                'stimulus': r.get('stimulus', ''),
-                'trial_type': r.get('trial_type', ''),
-                'response': r.get('response'),
-                'reaction_time': round(r.get('reaction_time', 0), 2) if r.get('reaction_time') else None,
-                'is_correct': r.get('is_correct', False),
-                'error_type': r.get('error_type', '')
-            })
-        return render_template('gonogoindex.html', summary=summary, trial_data=trial_data, template='results')
+        summary = cached_summary('gonogo', results)
+        return render_template('gonogoindex.html', summary=summary, norms=norm_rows('gonogo', summary),
+                               total_trials=len(results), template='results')
     except Exception as e:
+        logger_gonogo.exception("結果表示エラー: %s", e)
         return render_template('gonogoindex.html', error=f'エラーが発生しました: {str(e)}', template='results')
 
+@app.route('/gonogo/results/trials')
+def gonogo_results_trials():
+    return trial_page(sync_results('gonogo'), gonogo_trial_row)
+
 # ===== Stroop課題 =====
 COLORS_STROOP = {
     'red': {'name': 'あか', 'color': '#dc3545'},
@@ -295,164 +804,226 @@ COLORS_STROOP = {
     'yellow': {'name': 'きいろ', 'color': '#ffc107'},
     'green': {'name': 'みどり', 'color': '#28a745'}
 }
+logger_stroop = get_logger('stroop')
 STIMULUS_DURATION_STROOP = 500
 ISI_DURATION_STROOP = 1500
 RESPONSE_KEYS_STROOP = {
     'red': '1', 'blue': '2', 'yellow': '3', 'green': '4'
 }
 
-@app.route('/stroop')
-def stroop_index():
-    session['trials'] = []
-    session['current_trial'] = 0
-    session['results'] = []
-    session['start_time'] = None
-    return render_template('stroopindex.html', template='index')
+STROOP_KEY_CHOICES = ('1', '2', '3', '4', '5')  # テンプレートが受け付ける反応キー
 
-@app.route('/stroop/start', methods=['POST'])
-def stroop_start():
-    congruent_trials = int(request.form.get('congruent_trials', 20))
-    incongruent_trials = int(request.form.get('incongruent_trials', 20))
+STROOP_CODEC = stroop_codec(COLORS_STROOP)
+
+TASK_DEFAULTS['stroop'] = {
+    'stimulus_duration': STIMULUS_DURATION_STROOP,
+    'isi_duration': ISI_DURATION_STROOP,
+    'response_keys': RESPONSE_KEYS_STROOP,
+    'congruent_trials': 20,
+    'incongruent_trials': 20,
+    **RT_DEFAULTS,
+    **QUALITY_DEFAULTS,
+}
+
+STROOP_START_SCHEMA = compile_schema({
+    'congruent_trials': ('int', 0, 200, None),
+    'incongruent_trials': ('int', 0, 200, None),
+})
+STROOP_RESPONSE_SCHEMA = compile_schema({
+    'response': ('choice', STROOP_KEY_CHOICES),
+    'reaction_time': ('number', 0, MAX_REACTION_TIME),
+    'trial_id': ('pattern', TRIAL_ID_PATTERN, False),
+})
+
+def generate_stroop_trials(rng, params):
     trials = []
     color_list = list(COLORS_STROOP.keys())
-    for _ in range(congruent_trials):
-        color = random.choice(color_list)
+    for _ in range(params['congruent_trials']):
+        color = rng.choice(color_list)
         trials.append({
             'type': 'congruent',
             'text': COLORS_STROOP[color]['name'],
             'text_color': color,
             'display_color': color
         })
-    for _ in range(incongruent_trials):
-        text_color = random.choice(color_list)
+    for _ in range(params['incongruent_trials']):
+        text_color = rng.choice(color_list)
         display_color_options = [c for c in color_list if c != text_color]
-        display_color = random.choice(display_color_options)
+        display_color = rng.choice(display_color_options)
         trials.append({
             'type': 'incongruent',
             'text': COLORS_STROOP[text_color]['name'],
             'text_color': text_color,
             'display_color': display_color
         })
-    random.shuffle(trials)
-    session['trials'] = trials
+    rng.shuffle(trials)
+    return trials
+
+def score_stroop(trial_data, trial_idx, data, params):
+    display_color = trial_data.get('display_color', trial_data['text_color'])
+    correct_key = params['response_keys'][display_color]
+    has_response = data.get('response') is not None
+    response_key = data.get('response')
+    is_correct = (response_key == correct_key) if has_response else False
+    result = {
+        'trial': trial_idx + 1,
+        'text': trial_data['text'],
+        'text_color': trial_data['text_color'],
+        'display_color': display_color,
+        'trial_type': trial_data['type'],
+        'response': response_key,
+        'correct_key': correct_key,
+        'reaction_time': data.get('reaction_time'),
+        'is_correct': is_correct
+    }
+    return result
+
+def stroop_trial_row(r):
+    """結果の1試行を結果表の1行（dict）にする"""
+    return {
+        'trial': r.get('trial', 0),
+        'text': r.get('text', ''),
+        'text_color': r.get('text_color', ''),
+        'display_color': r.get('display_color', ''),
+        'trial_type': r.get('trial_type', ''),
+        'response': r.get('response'),
+        'correct_key': r.get('correct_key', ''),
+        'reaction_time': round(r.get('reaction_time', 0), 2) if r.get('reaction_time') else None,
+        'is_correct': r.get('is_correct', False),
+        'flags': r.get('flags', [])
+    }
+
+def summarize_stroop(results, params):
+    total_trials = len(results)
+    correct_trials = sum(1 for r in results if r.get('is_correct', False))
+    accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
+    congruent_results = [r for r in results if r.get('trial_type') == 'congruent']
+    incongruent_results = [r for r in results if r.get('trial_type') == 'incongruent']
+    congruent_total = len(congruent_results)
+    congruent_correct = sum(1 for r in congruent_results if r.get('is_correct', False))
+    congruent_accuracy = congruent_correct / congruent_total * 100 if congruent_total > 0 else 0
+    congruent_rts = [r['reaction_time'] for r in congruent_results if r.get('reaction_time') is not None and r.get('is_correct', False)]
+    congruent_rt, _ = rt_fields('congruent', congruent_rts, params)
+    incongruent_total = len(incongruent_results)
+    incongruent_correct = sum(1 for r in incongruent_results if r.get('is_correct', False))
+    incongruent_accuracy = incongruent_correct / incongruent_total * 100 if incongruent_total > 0 else 0
+    incongruent_rts = [r['reaction_time'] for r in incongruent_results if r.get('reaction_time') is not None and r.get('is_correct', False)]
+    incongruent_rt, _ = rt_fields('incongruent', incongruent_rts, params)
+    stroop_effect = incongruent_rt['incongruent_avg_rt'] - congruent_rt['congruent_avg_rt']
+    stroop_effect_median = incongruent_rt['incongruent_median_rt'] - congruent_rt['congruent_median_rt']
+    summary = {
+        'total_trials': total_trials,
+        'accuracy': round(accuracy, 2),
+        'congruent_total': congruent_total,
+        'congruent_accuracy': round(congruent_accuracy, 2),
+        **congruent_rt,
+        'incongruent_total': incongruent_total,
+        'incongruent_accuracy': round(incongruent_accuracy, 2),
+        **incongruent_rt,
+        'stroop_effect': round(stroop_effect, 2),
+        'stroop_effect_median': round(stroop_effect_median, 2),
+        **quality_fields(results, params),
+    }
+    trial_data = [stroop_trial_row(r) for r in results]
+    return summary, trial_data
+
+@app.route('/stroop')
+def stroop_index():
+    select_study()
+    reset_task_session('stroop')
+    resume = restore_participant_state('stroop')
+    return render_template('stroopindex.html', template='index', params=task_params('stroop'), resume=resume, colors=COLORS_STROOP)
+
+@app.route('/stroop/start', methods=['POST'])
+def stroop_start():
+    params = with_defaults(parse_form(STROOP_START_SCHEMA), task_params('stroop'))
+    trials = generate_stroop_trials(session_rng('stroop'), params)
+    session['trials'] = STROOP_CODEC.encode(trials)
     session['current_trial'] = 0
     session['results'] = []
+    session['quality'] = None
+    new_block_token()
+    results_changed('stroop')
+    session['block_id'] = None
     session['start_time'] = time.time()
+    save_participant_state('stroop')
     return jsonify({'status': 'success', 'total_trials': len(trials)})
 
+def stroop_color_code(trial_data):
+    """刺激の文字を表示する色のカラーコード"""
+    if trial_data['type'] == 'congruent':
+        return COLORS_STROOP[trial_data['text_color']]['color']
+    return COLORS_STROOP[trial_data['display_color']]['color']
+
 @app.route('/stroop/next_trial')
 def stroop_next_trial():
-    trials = session.get('trials', [])
+    trials = session.get('trials', b'')
     current_trial = session.get('current_trial', 0)
     if current_trial >= len(trials):
+        sync_results('stroop')
+        persist_block('stroop')
+        save_participant_state('stroop')
         return jsonify({'status': 'completed'})
-    trial_data = trials[current_trial]
+    trial_data = STROOP_CODEC.trial(trials, current_trial)
     session['current_trial'] = current_trial + 1
-    if trial_data['type'] == 'congruent':
-        display_color_code = COLORS_STROOP[trial_data['text_color']]['color']
-    else:
-        display_color_code = COLORS_STROOP[trial_data['display_color']]['color']
+    params = task_params('stroop')
     return jsonify({
         'status': 'next',
         'text': trial_data['text'],
         'text_color': trial_data['text_color'],
         'display_color': trial_data.get('display_color', trial_data['text_color']),
-        'display_color_code': display_color_code,
+        'display_color_code': stroop_color_code(trial_data),
+        'upcoming': upcoming_stimuli(STROOP_CODEC, trials, current_trial, lambda t: {
+            'text': t['text'], 'display_color_code': stroop_color_code(t)}),
         'trial_type': trial_data['type'],
+        'trial_id': trial_id(current_trial),
+        'seq': current_trial,
         'trial_number': current_trial + 1,
         'total_trials': len(trials),
-        'stimulus_duration': STIMULUS_DURATION_STROOP,
-        'isi_duration': ISI_DURATION_STROOP,
-        'max_response_time': STIMULUS_DURATION_STROOP + ISI_DURATION_STROOP,
-        'response_keys': RESPONSE_KEYS_STROOP
+        'stimulus_duration': params['stimulus_duration'],
+        'isi_duration': params['isi_duration'],
+        'max_response_time': params['stimulus_duration'] + params['isi_duration'],
+        'response_keys': params['response_keys']
     })
 
 @app.route('/stroop/record_response', methods=['POST'])
 def stroop_record_response():
+    data = parse_json(STROOP_RESPONSE_SCHEMA)
     try:
-        data = request.get_json()
-        trial_idx = session.get('current_trial', 0) - 1
+        trial_idx = response_trial_index(data)
+        if trial_idx is None:
+            return jsonify({'status': 'error', 'message': '試行IDが不正です'})
         if trial_idx < 0:
             return jsonify({'status': 'error', 'message': '試行が開始されていません'})
-        trials = session.get('trials', [])
+        trials = session.get('trials', b'')
         if not trials or trial_idx >= len(trials):
             return jsonify({'status': 'error', 'message': '試行インデックスエラー'})
-        trial_data = trials[trial_idx]
-        display_color = trial_data.get('display_color', trial_data['text_color'])
-        correct_key = RESPONSE_KEYS_STROOP[display_color]
-        has_response = data.get('response') is not None
-        response_key = data.get('response')
-        is_correct = (response_key == correct_key) if has_response else False
-        result = {
-            'trial': trial_idx + 1,
-            'text': trial_data['text'],
-            'text_color': trial_data['text_color'],
-            'display_color': display_color,
-            'trial_type': trial_data['type'],
-            'response': response_key,
-            'correct_key': correct_key,
-            'reaction_time': data.get('reaction_time'),
-            'is_correct': is_correct
-        }
-        if 'results' not in session:
-            session['results'] = []
-        results = session.get('results', [])
-        results.append(result)
-        session['results'] = results
-        return jsonify({'status': 'success', 'recorded': True})
+        trial_data = STROOP_CODEC.trial(trials, trial_idx)
+        result = score_stroop(trial_data, trial_idx, data, task_params('stroop'))
+        recorded = record_result('stroop', trial_idx, result)
+        logger_stroop.debug("記録する結果", extra={'fields': {'result': result, 'recorded': recorded}})
+        return jsonify({'status': 'success', 'recorded': recorded})
     except Exception as e:
+        logger_stroop.exception("反応記録エラー: %s", e)
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/stroop/results')
 def stroop_results():
     try:
-        results = session.get('results', [])
+        results = sync_results('stroop')
         if not results:
             return render_template('stroopindex.html', error='結果がありません', template='results')
-        total_trials = len(results)
-        correct_trials = sum(1 for r in results if r.get('is_correct', False))
-        accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
-        congruent_results = [r for r in results if r.get('trial_type') == 'congruent']
-        incongruent_results = [r for r in results if r.get('trial_type') == 'incongruent']
-        congruent_total = len(congruent_results)
-        congruent_correct = sum(1 for r in congruent_results if r.get('is_correct', False))
-        congruent_accuracy = congruent_correct / congruent_total * 100 if congruent_total > 0 else 0
-        congruent_rts = [r.get('reaction_time', 0) for r in congruent_results if r.get('reaction_time') is not None and r.get('is_correct', False)]
-        congruent_avg_rt = sum(congruent_rts) / len(congruent_rts) if congruent_rts else 0
-        incongruent_total = len(incongruent_results)
-        incongruent_correct = sum(1 for r in incongruent_results if r.get('is_correct', False))
-        incongruent_accuracy = incongruent_correct / incongruent_total * 100 if incongruent_total > 0 else 0
-        incongruent_rts = [r.get('reaction_time', 0) for r in incongruent_results if r.get('reaction_time') is not None and r.get('is_correct', False)]
-        incongruent_avg_rt = sum(incongruent_rts) / len(incongruent_rts) if incongruent_rts else 0
-        stroop_effect = incongruent_avg_rt - congruent_avg_rt
-        summary = {
-            'total_trials': total_trials,
-            'accuracy': round(accuracy, 2),
-            'congruent_total': congruent_total,
-            'congruent_accuracy': round(congruent_accuracy, 2),
-            'congruent_avg_rt': round(congruent_avg_rt, 2),
-            'incongruent_total': incongruent_total,
-            'incongruent_accuracy': round(incongruent_accuracy, 2),
-            'incongruent_avg_rt': round(incongruent_avg_rt, 2),
-            'stroop_effect': round(stroop_effect, 2)
-        }
-        trial_data = []
-        for r in results:
-            trial_data.append({
-                'trial': r.get('trial', 0),
-                'text': r.get('text', ''),
-                'text_color': r.get('text_color', ''),
-                'display_color': r.get('display_color', ''),
-                'trial_type': r.get('trial_type', ''),
-                'response': r.get('response'),
-                'correct_key': r.get('correct_key', ''),
-                'reaction_time': round(r.get('reaction_time', 0), 2) if r.get('reaction_time') else None,
-                'is_correct': r.get('is_correct', False)
-            })
-        return render_template('stroopindex.html', summary=summary, trial_data=trial_data, template='results')
+        summary = cached_summary('stroop', results)
+        return render_template('stroopindex.html', summary=summary, norms=norm_rows('stroop', summary),
+                               total_trials=len(results), template='results')
     except Exception as e:
+        logger_stroop.exception("結果表示エラー: %s", e)
         return render_template('stroopindex.html', error=f'エラーが発生しました: {str(e)}', template='results')
 
+@app.route('/stroop/results/trials')
+def stroop_results_trials():
+    return trial_page(sync_results('stroop'), stroop_trial_row)
+
 # ===== N-back課題 =====
 POSITIONS_NBACK = [
     {'id': 1, 'name': '左上', 'grid': 'grid-1'},
@@ -465,28 +1036,40 @@ POSITIONS_NBACK = [
     {'id': 8, 'name': '下', 'grid': 'grid-8'},
     {'id': 9, 'name': '右下', 'grid': 'grid-9'}
 ]
+logger_nback = get_logger('nback')
 STIMULUS_DURATION_NBACK = 500
 ISI_DURATION_NBACK = 2500
 RESPONSE_KEY_NBACK = 'space'
 
-@app.route('/nback')
-def nback_index():
-    session['trials'] = []
-    session['current_trial'] = 0
-    session['results'] = []
-    session['start_time'] = None
-    return render_template('nbackindex.html', template='index')
+NBACK_CODEC = nback_codec(POSITIONS_NBACK)
 
-@app.route('/nback/start', methods=['POST'])
-def nback_start():
-    total_trials = int(request.form.get('total_trials', 30))
+TASK_DEFAULTS['nback'] = {
+    'stimulus_duration': STIMULUS_DURATION_NBACK,
+    'isi_duration': ISI_DURATION_NBACK,
+    'total_trials': 30,
+    **RT_DEFAULTS,
+    **QUALITY_DEFAULTS,
+    'quality_same_key_run': None,  # 反応キーが1つなので、同じキーの連続は見ない
+}
+
+NBACK_START_SCHEMA = compile_schema({
+    'total_trials': ('int', 2, 500, None),
+})
+NBACK_RESPONSE_SCHEMA = compile_schema({
+    'response': ('choice', (RESPONSE_KEY_NBACK,)),
+    'reaction_time': ('number', 0, MAX_REACTION_TIME),
+    'trial_id': ('pattern', TRIAL_ID_PATTERN, False),
+})
+
+def generate_nback_trials(rng, params):
+    total_trials = params['total_trials']
     trials = []
     nback_trials = int(total_trials * 0.3)
     previous_position = None
     nback_count = 0
     for i in range(total_trials):
         if i == 0:
-            position = random.choice(POSITIONS_NBACK)
+            position = rng.choice(POSITIONS_NBACK)
             trials.append({
                 'trial_number': i + 1,
                 'position': position,
@@ -494,7 +1077,7 @@ def nback_start():
             })
             previous_position = position
         else:
-            if nback_count < nback_trials and random.random() < 0.4:
+            if nback_count < nback_trials and rng.random() < 0.4:
                 position = previous_position
                 trials.append({
                     'trial_number': i + 1,
@@ -504,126 +1087,484 @@ def nback_start():
                 nback_count += 1
             else:
                 available_positions = [p for p in POSITIONS_NBACK if p['id'] != previous_position['id']]
-                position = random.choice(available_positions)
+                position = rng.choice(available_positions)
                 trials.append({
                     'trial_number': i + 1,
                     'position': position,
                     'is_nback': False
                 })
             previous_position = position
-    session['trials'] = trials
+    return trials
+
+def score_nback(trial_data, trial_idx, data, params):
+    is_nback = trial_data['is_nback']
+    has_response = data.get('response') is not None
+    if is_nback:
+        is_correct = has_response
+        error_type = 'miss' if not has_response else None
+    else:
+        is_correct = not has_response
+        error_type = 'false_alarm' if has_response else None
+    result = {
+        'trial': trial_data['trial_number'],
+        'position': trial_data['position']['name'],
+        'position_id': trial_data['position']['id'],
+        'is_nback': is_nback,
+        'response': data.get('response'),
+        'reaction_time': data.get('reaction_time'),
+        'is_correct': is_correct,
+        'error_type': error_type
+    }
+    return result
+
+def nback_trial_row(r):
+    """結果の1試行を結果表の1行（dict）にする"""
+    return {
+        'trial': r.get('trial', 0),
+        'position': r.get('position', ''),
+        'is_nback': r.get('is_nback', False),
+        'response': r.get('response'),
+        'reaction_time': round(r.get('reaction_time', 0), 2) if r.get('reaction_time') else None,
+        'is_correct': r.get('is_correct', False),
+        'error_type': r.get('error_type', ''),
+        'flags': r.get('flags', [])
+    }
+
+def summarize_nback(results, params):
+    total_trials = len(results)
+    correct_trials = sum(1 for r in results if r.get('is_correct', False))
+    accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
+    nback_results_list = [r for r in results if r.get('is_nback', False)]
+    non_nback_results = [r for r in results if not r.get('is_nback', False)]
+    nback_total = len(nback_results_list)
+    nback_correct = sum(1 for r in nback_results_list if r.get('is_correct', False))
+    nback_accuracy = nback_correct / nback_total * 100 if nback_total > 0 else 0
+    nback_rts = [r['reaction_time'] for r in nback_results_list if r.get('reaction_time') is not None and r.get('is_correct', False)]
+    nback_rt, _ = rt_fields('nback', nback_rts, params)
+    nback_misses = sum(1 for r in nback_results_list if r.get('error_type') == 'miss')
+    non_nback_total = len(non_nback_results)
+    non_nback_correct = sum(1 for r in non_nback_results if r.get('is_correct', False))
+    non_nback_accuracy = non_nback_correct / non_nback_total * 100 if non_nback_total > 0 else 0
+    non_nback_false_alarms = sum(1 for r in non_nback_results if r.get('error_type') == 'false_alarm')
+    summary = {
+        'total_trials': total_trials,
+        'accuracy': round(accuracy, 2),
+        'nback_total': nback_total,
+        'nback_accuracy': round(nback_accuracy, 2),
+        **nback_rt,
+        'nback_misses': nback_misses,
+        'non_nback_total': non_nback_total,
+        'non_nback_accuracy': round(non_nback_accuracy, 2),
+        'non_nback_false_alarms': non_nback_false_alarms,
+        **quality_fields(results, params),
+    }
+    trial_data = [nback_trial_row(r) for r in results]
+    return summary, trial_data
+
+@app.route('/nback')
+def nback_index():
+    select_study()
+    reset_task_session('nback')
+    resume = restore_participant_state('nback')
+    return render_template('nbackindex.html', template='index', params=task_params('nback'), resume=resume)
+
+@app.route('/nback/start', methods=['POST'])
+def nback_start():
+    params = with_defaults(parse_form(NBACK_START_SCHEMA), task_params('nback'))
+    trials = generate_nback_trials(session_rng('nback'), params)
+    session['trials'] = NBACK_CODEC.encode(trials)
     session['current_trial'] = 0
     session['results'] = []
+    session['quality'] = None
+    new_block_token()
+    results_changed('nback')
+    session['block_id'] = None
     session['start_time'] = time.time()
+    save_participant_state('nback')
     return jsonify({'status': 'success', 'total_trials': len(trials)})
 
 @app.route('/nback/next_trial')
 def nback_next_trial():
-    trials = session.get('trials', [])
+    trials = session.get('trials', b'')
     current_trial = session.get('current_trial', 0)
     if current_trial >= len(trials):
+        sync_results('nback')
+        persist_block('nback')
+        save_participant_state('nback')
         return jsonify({'status': 'completed'})
-    trial_data = trials[current_trial]
+    trial_data = NBACK_CODEC.trial(trials, current_trial)
     session['current_trial'] = current_trial + 1
+    params = task_params('nback')
     return jsonify({
         'status': 'next',
         'position': trial_data['position'],
         'is_nback': trial_data['is_nback'],
+        'trial_id': trial_id(current_trial),
+        'seq': current_trial,
         'trial_number': trial_data['trial_number'],
         'total_trials': len(trials),
-        'stimulus_duration': STIMULUS_DURATION_NBACK,
-        'isi_duration': ISI_DURATION_NBACK,
-        'max_response_time': STIMULUS_DURATION_NBACK + ISI_DURATION_NBACK,
+        'stimulus_duration': params['stimulus_duration'],
+        'isi_duration': params['isi_duration'],
+        'max_response_time': params['stimulus_duration'] + params['isi_duration'],
         'response_key': RESPONSE_KEY_NBACK
     })
 
 @app.route('/nback/record_response', methods=['POST'])
 def nback_record_response():
+    data = parse_json(NBACK_RESPONSE_SCHEMA)
     try:
-        data = request.get_json()
-        trial_idx = session.get('current_trial', 0) - 1
+        trial_idx = response_trial_index(data)
+        if trial_idx is None:
+            return jsonify({'status': 'error', 'message': '試行IDが不正です'})
         if trial_idx < 0:
             return jsonify({'status': 'error', 'message': '試行が開始されていません'})
-        trials = session.get('trials', [])
+        trials = session.get('trials', b'')
         if not trials or trial_idx >= len(trials):
             return jsonify({'status': 'error', 'message': '試行インデックスエラー'})
-        trial_data = trials[trial_idx]
-        is_nback = trial_data['is_nback']
-        has_response = data.get('response') is not None
-        if is_nback:
-            is_correct = has_response
-            error_type = 'miss' if not has_response else None
-        else:
-            is_correct = not has_response
-            error_type = 'false_alarm' if has_response else None
-        result = {
-            'trial': trial_data['trial_number'],
-            'position': trial_data['position']['name'],
-            'position_id': trial_data['position']['id'],
-            'is_nback': is_nback,
-            'response': data.get('response'),
-            'reaction_time': data.get('reaction_time'),
-            'is_correct': is_correct,
-            'error_type': error_type
-        }
-        if 'results' not in session:
-            session['results'] = []
-        results = session.get('results', [])
-        results.append(result)
-        session['results'] = results
-        return jsonify({'status': 'success', 'recorded': True})
+        trial_data = NBACK_CODEC.trial(trials, trial_idx)
+        result = score_nback(trial_data, trial_idx, data, task_params('nback'))
+        recorded = record_result('nback', trial_idx, result)
+        logger_nback.debug("記録する結果", extra={'fields': {'result': result, 'recorded': recorded}})
+        return jsonify({'status': 'success', 'recorded': recorded})
     except Exception as e:
+        logger_nback.exception("反応記録エラー: %s", e)
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/nback/results')
 def nback_results():
     try:
-        results = session.get('results', [])
+        results = sync_results('nback')
         if not results:
             return render_template('nbackindex.html', error='結果がありません', template='results')
-        total_trials = len(results)
-        correct_trials = sum(1 for r in results if r.get('is_correct', False))
-        accuracy = correct_trials / total_trials * 100 if total_trials > 0 else 0
-        nback_results_list = [r for r in results if r.get('is_nback', False)]
-        non_nback_results = [r for r in results if not r.get('is_nback', False)]
-        nback_total = len(nback_results_list)
-        nback_correct = sum(1 for r in nback_results_list if r.get('is_correct', False))
-        nback_accuracy = nback_correct / nback_total * 100 if nback_total > 0 else 0
-        nback_rts = [r.get('reaction_time', 0) for r in nback_results_list if r.get('reaction_time') is not None and r.get('is_correct', False)]
-        nback_avg_rt = sum(nback_rts) / len(nback_rts) if nback_rts else 0
-        nback_misses = sum(1 for r in nback_results_list if r.get('error_type') == 'miss')
-        non_nback_total = len(non_nback_results)
-        non_nback_correct = sum(1 for r in non_nback_results if r.get('is_correct', False))
-        non_nback_accuracy = non_nback_correct / non_nback_total * 100 if non_nback_total > 0 else 0
-        non_nback_false_alarms = sum(1 for r in non_nback_results if r.get('error_type') == 'false_alarm')
-        summary = {
-            'total_trials': total_trials,
-            'accuracy': round(accuracy, 2),
-            'nback_total': nback_total,
-            'nback_accuracy': round(nback_accuracy, 2),
-            'nback_avg_rt': round(nback_avg_rt, 2),
-            'nback_misses': nback_misses,
-            'non_nback_total': non_nback_total,
-            'non_nback_accuracy': round(non_nback_accuracy, 2),
-            'non_nback_false_alarms': non_nback_false_alarms
-        }
-        trial_data = []
-        for r in results:
-            trial_data.append({
-                'trial': r.get('trial', 0),
-                'position': r.get('position', ''),
-                'is_nback': r.get('is_nback', False),
-                'response': r.get('response'),
-                'reaction_time': round(r.get('reaction_time', 0), 2) if r.get('reaction_time') else None,
-                'is_correct': r.get('is_correct', False),
-                'error_type': r.get('error_type', '')
-            })
-        return render_template('nbackindex.html', summary=summary, trial_data=trial_data, template='results')
+        summary = cached_summary('nback', results)
+        return render_template('nbackindex.html', summary=summary, norms=norm_rows('nback', summary),
+                               total_trials=len(results), template='results')
     except Exception as e:
+        logger_nback.exception("結果表示エラー: %s", e)
         return render_template('nbackindex.html', error=f'エラーが発生しました: {str(e)}', template='results')
 
+@app.route('/nback/results/trials')
+def nback_results_trials():
+    return trial_page(sync_results('nback'), nback_trial_row)
+
+# ===== バッテリー（複数課題の連続実施） =====
+TASK_NAMES = {
+    'flanker': 'フランカー課題',
+    'gonogo': 'Go/NoGo課題',
+    'stroop': 'ストループ課題',
+    'nback': 'N-back課題',
+}
+TASKS = {
+    'flanker': {'codec': FLANKER_CODEC, 'generate': generate_flanker_trials, 'score': score_flanker,
+                'summarize': summarize_flanker, 'response_schema': FLANKER_RESPONSE_SCHEMA,
+                'trial_row': flanker_trial_row,
+                'norm_metrics': {'accuracy': '全体の正確率', 'avg_rt': '平均反応時間',
+                                 'interference_effect': '干渉効果'},
+                'norm_requires': {'avg_rt': ('rt_count',),
+                                  'interference_effect': ('congruent_rt_count', 'incongruent_rt_count')}},
+    'gonogo': {'codec': GONOGO_CODEC, 'generate': generate_gonogo_trials, 'score': score_gonogo,
+               'summarize': summarize_gonogo, 'response_schema': GONOGO_RESPONSE_SCHEMA,
+               'trial_row': gonogo_trial_row,
+               'norm_metrics': {'accuracy': '全体の正確率', 'go_avg_rt': 'Go試行の平均反応時間',
+                                'nogo_accuracy': 'NoGo試行の正確率'},
+               'norm_requires': {'go_avg_rt': ('go_rt_count',)}},
+    'stroop': {'codec': STROOP_CODEC, 'generate': generate_stroop_trials, 'score': score_stroop,
+               'summarize': summarize_stroop, 'response_schema': STROOP_RESPONSE_SCHEMA,
+               'trial_row': stroop_trial_row,
+               'norm_metrics': {'accuracy': '全体の正確率', 'incongruent_avg_rt': '不一致条件の平均反応時間',
+                                'stroop_effect': 'ストループ効果'},
+               'norm_requires': {'incongruent_avg_rt': ('incongruent_rt_count',),
+                                 'stroop_effect': ('congruent_rt_count', 'incongruent_rt_count')}},
+    'nback': {'codec': NBACK_CODEC, 'generate': generate_nback_trials, 'score': score_nback,
+              'summarize': summarize_nback, 'response_schema': NBACK_RESPONSE_SCHEMA,
+              'trial_row': nback_trial_row,
+              'norm_metrics': {'accuracy': '全体の正確率', 'nback_accuracy': 'N-back試行の正確率',
+                               'nback_avg_rt': 'N-back試行の平均反応時間'},
+              'norm_requires': {'nback_avg_rt': ('nback_rt_count',)}},
+}
+
+MAX_BATTERY_BLOCK_BYTES = 48 * 1024
+BATTERY_BLOCK_SCHEMA = compile_schema({
+    'block': ('int', 0, len(TASKS) - 1, None),
+    'responses': ('list', 500),
+})
+
+@app.route('/battery')
+def battery_index():
+    study = select_study()
+    session.pop('battery', None)
+    return render_template('battery.html', template='index', study=study, task_names=TASK_NAMES)
+
+@app.route('/battery/start', methods=['POST'])
+def battery_start():
+    """研究で設定された全課題の試行リストを一度に生成する"""
+    study = current_study()
+    blocks = []
+    schedule = []
+    for index, task in enumerate(study.tasks):
+        spec = TASKS[task]
+        params = study.params[task]
+        seed = new_seed(task)
+        trials = spec['codec'].encode(spec['generate'](random.Random(seed), params))
+        blocks.append({'task': task, 'seed': seed, 'trials': trials, 'block_id': None})
+        schedule.append({
+            'block': index,
+            'task': task,
+            'name': TASK_NAMES[task],
+            'params': params,
+            'trials': spec['codec'].decode(trials),
+        })
+    session['battery'] = {'blocks': blocks, 'summaries': {}}
+    session_id()
+    return jsonify({
+        'status': 'success',
+        'blocks': schedule,
+        'stroop_colors': {name: color['color'] for name, color in COLORS_STROOP.items()},
+    })
+
+@app.route('/battery/record_block', methods=['POST'])
+def battery_record_block():
+    """1ブロック分の反応をまとめて採点・保存する"""
+    data = parse_json(BATTERY_BLOCK_SCHEMA, max_bytes=MAX_BATTERY_BLOCK_BYTES)
+    battery = session.get('battery')
+    index = data['block']
+    if not battery or index is None or index >= len(battery['blocks']):
+        return jsonify({'status': 'error', 'message': 'ブロックが見つかりません'}), 400
+    block = battery['blocks'][index]
+    if block['block_id'] is not None:
+        # 再送された場合は保存済みの結果を返す
+        return jsonify({'status': 'success', 'block_id': block['block_id'],
+                        'summary': battery['summaries'].get(str(index))})
+    task = block['task']
+    spec = TASKS[task]
+    trials = block['trials']
+    responses = data['responses']
+    if len(responses) != len(trials):
+        return jsonify({'status': 'error', 'message': '反応の数が試行数と一致しません'}), 400
+    params = task_params(task)
+    results = [
+        spec['score'](spec['codec'].trial(trials, i), i, spec['response_schema'](response), params)
+        for i, response in enumerate(responses)
+    ]
+    quality.flag_results(results, params)
+    try:
+        block['block_id'] = storage.save_block(
+            session_id(), current_study().study_id, task, block['seed'], trials, results)
+    except Exception as e:
+        get_logger(task).exception("ブロックの保存に失敗しました: %s", e)
+        return jsonify({'status': 'error', 'message': '結果を保存できませんでした'}), 500
+    summary, _ = spec['summarize'](results, params)
+    battery['summaries'][str(index)] = summary
+    session['battery'] = battery
+    return jsonify({'status': 'success', 'block_id': block['block_id'], 'summary': summary})
+
+@app.route('/battery/results')
+def battery_results():
+    battery = session.get('battery')
+    if not battery or not battery['summaries']:
+        return render_template('battery.html', error='結果がありません', template='results')
+    blocks = []
+    for index, block in enumerate(battery['blocks']):
+        blocks.append({
+            'task': block['task'],
+            'name': TASK_NAMES[block['task']],
+            'block_id': block['block_id'],
+            'summary': battery['summaries'].get(str(index)),
+        })
+    return render_template('battery.html', blocks=blocks, template='results')
+
+# ===== 結果API =====
+# 結果画面と同じ集計と試行データを JSON で返す（外部のツールや LMS 連携用）
+RESULTS_API_TOKEN = os.environ.get('RESULTS_API_TOKEN')
+MAX_BULK_SESSIONS = 100
+BULK_RESULTS_SCHEMA = compile_schema({
+    'sessions': ('list', MAX_BULK_SESSIONS),
+    'task': ('choice', tuple(TASKS)),
+    'study': ('pattern', r'[A-Za-z0-9_-]{1,64}', False),
+    'since': ('number', 0, 1e11),  # 保存日時の範囲（UNIX時刻）。アーカイブを読む月を絞る
+    'until': ('number', 0, 1e11),
+})
+SESSION_ID_SCHEMA = compile_schema({
+    'session': ('pattern', r'[0-9a-f]{32}'),
+})
+
+def check_api_token():
+    """Authorization: Bearer <RESULTS_API_TOKEN> でなければエラーのレスポンスを返す"""
+    if RESULTS_API_TOKEN is None:
+        abort(404)
+    auth = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth.encode(), f'Bearer {RESULTS_API_TOKEN}'.encode()):
+        return jsonify({'status': 'error', 'message': '認証が必要です'}), 401
+    return None
+
+def stored_block_results(block):
+    """保存済みブロックの集計と試行データ（集計は保存時の研究設定で行い、キャッシュする）"""
+    task = block['task']
+    spec = TASKS[task]
+    study = studies.get(block['study_id']) or studies.get(DEFAULT_STUDY_ID)
+    results = block['results']
+    summary = summaries.get_or_compute(
+        ('block', block['id']), (0, study.study_id, study.version),
+        lambda: spec['summarize'](results, study.params[task])[0])
+    return {
+        'block_id': block['id'],
+        'task': task,
+        'study_id': block['study_id'],
+        'created_at': block['created_at'],
+        'summary': summary,
+        'total_trials': len(results),
+        'trials': [spec['trial_row'](r) for r in results],
+    }
+
+@app.route('/api/<task>/results')
+def api_task_results(task):
+    """現在のセッションの結果を JSON で返す"""
+    if task not in TASKS:
+        abort(404)
+    results = sync_results(task)
+    if not results or session.get('results_task') != task:
+        return jsonify({'status': 'error', 'message': '結果がありません'}), 404
+    return jsonify({
+        'status': 'success',
+        'task': task,
+        'study_id': current_study().study_id,
+        'session_id': session_id(),
+        'block_id': session.get('block_id'),
+        'completed': len(results) >= len(session.get('trials', b'')),
+        'summary': cached_summary(task, results),
+        'total_trials': len(results),
+        'trials': [TASKS[task]['trial_row'](r) for r in results],
+    })
+
+@app.route('/api/results', methods=['POST'])
+def api_bulk_results():
+    """複数セッションの保存済みブロックの結果をまとめて返す
+
+    RESULTS_API_TOKEN を設定したときだけ有効で、Authorization: Bearer <トークン> が必要。
+    """
+    denied = check_api_token()
+    if denied is not None:
+        return denied
+    data = parse_json(BULK_RESULTS_SCHEMA, max_bytes=8 * 1024)
+    session_ids = [SESSION_ID_SCHEMA({'session': sid})['session'] for sid in data['sessions']]
+    blocks = {sid: [] for sid in session_ids}
+    for block in storage.get_blocks_by_sessions(session_ids, data['task'], data['study'],
+                                                data['since'], data['until']):
+        blocks[block['session_id']].append(stored_block_results(block))
+    return jsonify({'status': 'success', 'sessions': blocks})
+
+@app.route('/api/db_stats')
+def api_db_stats():
+    """このワーカーのデータベースのコネクションプールの統計（RESULTS_API_TOKEN が必要）"""
+    denied = check_api_token()
+    if denied is not None:
+        return denied
+    return jsonify({'status': 'success', 'pid': os.getpid(), 'pool': storage.pool_stats()})
+
+# ===== 監督者画面 =====
+# 課題の開始・試行の提示・反応の記録のたびに参加者の進行状況を pubsub で配信し、
+# /admin/live で Server-Sent Events として受け取る（配信時に DB は読まない）。
+# ADMIN_TOKEN を設定したときだけ有効で、/admin/live?token=<トークン> で開くとセッションに記録される。
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+STALL_SECONDS = 30  # 実施中でこれより長く更新がなければ監督者画面で目立たせる
+progress = pubsub.broker_from_env()
+PROGRESS_ENDPOINTS = {
+    f'{task}_{action}': task
+    for task in ('flanker', 'gonogo', 'stroop', 'nback')
+    for action in ('start', 'next_trial', 'record_response')
+}
+
+@app.after_request
+def publish_progress(response):
+    task = PROGRESS_ENDPOINTS.get(request.endpoint)
+    if task is None or response.status_code != 200 or not session.get('trials'):
+        return response
+    results = session.get('results', [])
+    sid = session_id()
+    try:
+        progress.publish(f'{sid}:{task}', {
+            'key': f'{sid}:{task}',
+            'participant': session.get('participant_id') or sid[:8],
+            'study_id': current_study().study_id,
+            'task': task,
+            'current_trial': session.get('current_trial', 0),
+            'total_trials': len(session['trials']),
+            'answered': len(results),
+            'correct': sum(1 for r in results if r.get('is_correct', False)),
+            'flagged': (session.get('quality') or {}).get('flagged', 0),
+            'updated_at': time.time(),
+        })
+    except Exception as e:
+        get_logger(task).exception("進行状況の配信に失敗しました: %s", e)
+    return response
+
+def is_admin():
+    return ADMIN_TOKEN is not None and session.get('admin') is True
+
+@app.route('/admin/live')
+def admin_live():
+    if ADMIN_TOKEN is None:
+        abort(404)
+    token = request.args.get('token')
+    if token is not None:
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return 'トークンが正しくありません', 401
+        session['admin'] = True
+        return redirect(url_for('admin_live'))  # トークンをURLに残さない
+    if not is_admin():
+        return '/admin/live?token=<ADMIN_TOKEN> で開いてください', 401
+    return render_template('admin_live.html', task_names=TASK_NAMES, stall_seconds=STALL_SECONDS)
+
+@app.route('/admin/live/events')
+def admin_live_events():
+    if not is_admin():
+        abort(404 if ADMIN_TOKEN is None else 401)
+    return Response(pubsub.event_stream(progress), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ===== レート制限 =====
+# 同じIPから複数の端末が接続する実験室を想定し、IP単位は緩く、セッション単位は厳しくする
+START_LIMITS = {'per_ip': Limit(rate=2, burst=30), 'per_session': Limit(rate=0.2, burst=3)}
+TRIAL_LIMITS = {'per_ip': Limit(rate=50, burst=200), 'per_session': Limit(rate=5, burst=20)}
+for task in ('flanker', 'gonogo', 'stroop', 'nback'):
+    limiter.limit(f'{task}_start', **START_LIMITS)
+    limiter.limit(f'{task}_next_trial', **TRIAL_LIMITS)
+    limiter.limit(f'{task}_record_response', **TRIAL_LIMITS)
+    limiter.limit(f'{task}_results_trials', **TRIAL_LIMITS)
+limiter.limit('api_task_results', **TRIAL_LIMITS)
+limiter.limit('api_bulk_results', **START_LIMITS)
+limiter.limit('api_db_stats', **START_LIMITS)
+limiter.limit('battery_start', **START_LIMITS)
+limiter.limit('battery_record_block', **START_LIMITS)
+
+# ===== 起動とヘルスチェック =====
+# 起動直後の最初のリクエストが遅くならないよう、テンプレートのコンパイル・研究設定の読み込み・
+# DB の接続をバックグラウンドで済ませる。/healthz はプロセスが動いていれば 200、
+# /readyz はウォームアップが終わるまで 503（Render の healthCheckPath に指定する）。
+warmup = Warmup()
+warmup.add('templates', lambda: compile_templates(app))
+warmup.add('studies', lambda: studies.get(DEFAULT_STUDY_ID))
+warmup.add('database', storage.pool_stats)
+warmup.add('norms', norm_tables.table)
+
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    status = warmup.status()
+    return jsonify({'status': 'ready' if status['ready'] else 'starting', **status}), 200 if status['ready'] else 503
+
+get_logger('main').info("起動しました", extra={'fields': {
+    'import_ms': round((time.perf_counter() - IMPORT_STARTED) * 1000, 1), 'pid': os.getpid()}})
+if os.environ.get('WARMUP', '1') != '0':
+    warmup.start()
+else:
+    # ウォームアップを止めても /readyz（Render のヘルスチェック）は通す
+    warmup.skip()
+
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5006))
     app.run(debug=False, host='0.0.0.0', port=port)
 
@@ -4,9 +4,12 @@ import time
 from datetime import datetime
 import json
 
+from log_config import get_logger
+
 app = Flask(__name__)
 app.secret_key = "nback_task_secret_key"
 app.config['SESSION_TYPE'] = 'filesystem'
+logger = get_logger('nback')
 
 # 1-back課題の刺激（位置や文字など）
 # 今回は位置（9つの位置）を使った1-back課題を作成
@@ -37,14 +40,14 @@ def index():
     session['current_trial'] = 0
     session['results'] = []
     session['start_time'] = None
-    print("セッション初期化完了")  # デバッグ用
+    logger.debug("セッション初期化完了")
     return render_template('nbackindex.html', template='index')
 
 @app.route('/start', methods=['POST'])
 def start():
     # 試行回数を設定（デフォルト：30試行、そのうち約30%が1-back一致）
     total_trials = int(request.form.get('total_trials', 30))
-    print(f"開始: 総試行数 {total_trials} 回")  # デバッグ用
+    logger.debug("開始: 総試行数 %d 回", total_trials)
     
     # 試行リストを作成
     trials = []
@@ -89,7 +92,7 @@ def start():
                 })
             previous_position = position
     
-    print(f"試行リスト作成完了: {len(trials)} 試行（1-back一致: {nback_count}回）")  # デバッグ用
+    logger.debug("試行リスト作成完了: %d 試行（1-back一致: %d回）", len(trials), nback_count)
     
     # セッションに試行リストを保存
     session['trials'] = trials
@@ -107,11 +110,11 @@ def next_trial():
     trials = session.get('trials', [])
     current_trial = session.get('current_trial', 0)
     
-    print(f"次の試行: {current_trial + 1}/{len(trials)}")  # デバッグ用
+    logger.debug("次の試行: %d/%d", current_trial + 1, len(trials))
     
     # すべての試行が終了した場合
     if current_trial >= len(trials):
-        print("すべての試行完了")  # デバッグ用
+        logger.debug("すべての試行完了")
         return jsonify({
             'status': 'completed'
         })
@@ -120,7 +123,7 @@ def next_trial():
     trial_data = trials[current_trial]
     session['current_trial'] = current_trial + 1
     
-    print(f"刺激: 位置 {trial_data['position']['name']} (1-back一致: {trial_data['is_nback']})")  # デバッグ用
+    logger.debug("刺激: 位置 %s (1-back一致: %s)", trial_data['position']['name'], trial_data['is_nback'])
     
     return jsonify({
         'status': 'next',
@@ -138,17 +141,17 @@ def next_trial():
 def record_response():
     try:
         data = request.get_json()
-        print(f"受信したデータ: {data}")  # デバッグ用
+        logger.debug("受信したデータ", extra={'fields': {'data': data}})
         
         # 前の試行のインデックス
         trial_idx = session.get('current_trial', 0) - 1
         if trial_idx < 0:
-            print("試行が開始されていません")  # デバッグ用
+            logger.warning("試行が開始されていません")
             return jsonify({'status': 'error', 'message': '試行が開始されていません'})
         
         trials = session.get('trials', [])
         if not trials or trial_idx >= len(trials):
-            print(f"試行インデックスエラー: {trial_idx}, 試行数: {len(trials) if trials else 0}")
+            logger.warning("試行インデックスエラー: %d, 試行数: %d", trial_idx, len(trials) if trials else 0)
             return jsonify({'status': 'error', 'message': '試行インデックスエラー'})
             
         trial_data = trials[trial_idx]
@@ -179,7 +182,7 @@ def record_response():
             'error_type': error_type
         }
         
-        print(f"記録する結果: {result}")  # デバッグ用
+        logger.debug("記録する結果", extra={'fields': {'result': result}})
         
         # セッションから結果リストを取得（なければ新規作成）
         if 'results' not in session:
@@ -191,9 +194,7 @@ def record_response():
         
         return jsonify({'status': 'success', 'recorded': True})
     except Exception as e:
-        print(f"エラー発生: {str(e)}")
-        import traceback
-        traceback.print_exc()  # より詳細なエラー情報
+        logger.exception("エラー発生: %s", e)
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/results')
@@ -202,10 +203,10 @@ def show_results():
         results = session.get('results', [])
         
         if not results:
-            print("結果がありません")
+            logger.info("結果がありません")
             return render_template('nbackindex.html', error='結果がありません', template='results')
         
-        print(f"結果件数: {len(results)}")
+        logger.debug("結果件数: %d", len(results))
         
         # 集計データを準備
         total_trials = len(results)
@@ -242,7 +243,7 @@ def show_results():
             'non_nback_false_alarms': non_nback_false_alarms
         }
         
-        print(f"サマリー: {summary}")
+        logger.info("サマリー", extra={'fields': {'summary': summary}})
         
         # 試行ごとのデータ
         trial_data = []
@@ -259,9 +260,7 @@ def show_results():
         
         return render_template('nbackindex.html', summary=summary, trial_data=trial_data, template='results')
     except Exception as e:
-        print(f"結果表示エラー: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("結果表示エラー: %s", e)
         return render_template('nbackindex.html', error=f'エラーが発生しました: {str(e)}', template='results')
 
 if __name__ == '__main__':
@@ -0,0 +1,273 @@
+"""結果の基準値（ノルム）の表とパーセンタイルの参照
+
+保存済みのブロックの要約から、(基準集団, 課題, 指標) ごとに値の分布を作り、
+NORMS_PATH（デフォルト: instance/norms.json）に保存する。基準集団は研究設定の
+norm_group（省略時は研究ID）で、すべての研究をまとめた集団 ALL_GROUPS も作る。
+データの質に問題のあるブロック（quality_warning）は含めない。指標の元になる反応時間がない
+ブロック（正解の試行がなく平均反応時間が 0 になったものなど）は、その指標だけ含めない
+（課題ごとに norm_requires で、指標と、0 でないことが必要な件数の項目を対応づける）。
+
+分布は値の昇順の配列と、それぞれの値の件数の配列で持つ。件数が MAX_POINTS を
+超えたら隣り合う値を件数の等しい区間にまとめて（区間の平均値とその件数）、
+大きさを MAX_POINTS で頭打ちにする（パーセンタイルの誤差は 100 / MAX_POINTS 程度）。
+結果画面では累積件数の配列を二分探索するだけなので、基準の人数によらず速い。
+
+表には最後に処理したブロックIDを記録し、次の実行ではそれより後のブロックだけを
+分布に足す（差分の更新）。採点規則や研究設定を変えた場合は --full で作り直す。
+アプリは NORMS_PATH の更新を reload_interval 秒ごとに確認して読み直す（再起動は不要）。
+
+使い方:
+    python norms.py                  # 前回から増えたブロックを足す（cron などで定期的に実行する）
+    python norms.py --full           # すべてのブロックから作り直す
+    python norms.py --show stroop    # 課題の基準集団と件数を表示する
+
+環境変数:
+    NORMS_PATH   基準値の表の置き場所（デフォルト: instance/norms.json）
+"""
+import argparse
+import bisect
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+from log_config import configure_logging, get_logger
+
+ALL_GROUPS = '*'  # すべての研究をまとめた基準集団
+MAX_POINTS = 200  # 分布1つあたりの点の数の上限
+MIN_COUNT = 30  # これより件数の少ない基準集団は使わず ALL_GROUPS と比べる
+FLUSH_BLOCKS = 10000  # 作成中はこの数のブロックごとに値を分布に足す（メモリを抑える）
+
+
+def has_data(summary, metric, requires):
+    """要約の指標に値があるか（requires の件数の項目がどれも 0 なら値がないとみなす）"""
+    return summary.get(metric) is not None and all(summary.get(field) for field in requires.get(metric, ()))
+
+
+def norms_path():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'norms.json')
+    return os.environ.get('NORMS_PATH', default)
+
+
+class Distribution:
+    """値の分布（昇順の値と件数）"""
+
+    __slots__ = ('values', 'counts', 'cumulative')
+
+    def __init__(self, values=(), counts=()):
+        self.values = list(values)
+        self.counts = list(counts)
+        self._accumulate()
+
+    def _accumulate(self):
+        cumulative = [0]
+        for count in self.counts:
+            cumulative.append(cumulative[-1] + count)
+        self.cumulative = cumulative
+
+    @property
+    def total(self):
+        return self.cumulative[-1]
+
+    def add(self, values):
+        """値のリストを足す（点の数が MAX_POINTS を超えたらまとめる）"""
+        merged = collections.Counter(dict(zip(self.values, self.counts)))
+        merged.update(values)
+        points = sorted(merged.items())
+        if len(points) > MAX_POINTS:
+            points = _compress(points, self.total + len(values))
+        self.values = [value for value, _ in points]
+        self.counts = [count for _, count in points]
+        self._accumulate()
+
+    def percentile(self, value):
+        """value より小さい値の割合（同じ値は半分と数える、0〜100）"""
+        lo = bisect.bisect_left(self.values, value)
+        hi = bisect.bisect_right(self.values, value, lo)
+        below = self.cumulative[lo]
+        equal = self.cumulative[hi] - below
+        return 100 * (below + equal / 2) / self.total
+
+    def to_dict(self):
+        return {'values': self.values, 'counts': self.counts}
+
+
+def _compress(points, total):
+    """昇順の (値, 件数) を件数がほぼ等しい MAX_POINTS 個の区間の (平均値, 件数) にまとめる"""
+    size = total / MAX_POINTS
+    compressed = []
+    weighted = count = 0
+    for value, n in points:
+        weighted += value * n
+        count += n
+        if count >= size:
+            compressed.append((round(weighted / count, 3), count))
+            weighted = count = 0
+    if count:
+        compressed.append((round(weighted / count, 3), count))
+    return compressed
+
+
+class NormTable:
+    """(基準集団, 課題, 指標) ごとの分布"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.last_block_id = data.get('last_block_id', 0)
+        self.built_at = data.get('built_at')
+        self.distributions = {}
+        for group, tasks in data.get('norms', {}).items():
+            for task, metrics in tasks.items():
+                for metric, dist in metrics.items():
+                    self.distributions[group, task, metric] = Distribution(dist['values'], dist['counts'])
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path):
+        norms = {}
+        for (group, task, metric), dist in sorted(self.distributions.items()):
+            norms.setdefault(group, {}).setdefault(task, {})[metric] = dist.to_dict()
+        data = {'last_block_id': self.last_block_id, 'built_at': self.built_at, 'norms': norms}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def add(self, group, task, metric, values):
+        for key in ((group, task, metric), (ALL_GROUPS, task, metric)):
+            self.distributions.setdefault(key, Distribution()).add(values)
+
+    def distribution(self, group, task, metric, min_count=MIN_COUNT):
+        """group の分布（件数が min_count に満たなければ ALL_GROUPS の分布）と、使った基準集団"""
+        for key in (group, ALL_GROUPS):
+            dist = self.distributions.get((key, task, metric))
+            if dist is not None and dist.total >= min_count:
+                return key, dist
+        return None, None
+
+    def percentiles(self, group, task, summary, metrics, requires=None):
+        """要約の各指標（metrics は 指標 → 表示名）のパーセンタイルを結果画面の行にして返す"""
+        rows = []
+        for metric, label in metrics.items():
+            if not has_data(summary, metric, requires or {}):
+                continue
+            value = summary[metric]
+            used, dist = self.distribution(group, task, metric)
+            if dist is None:
+                continue
+            rows.append({'metric': metric, 'label': label, 'value': value, 'group': used,
+                         'percentile': round(dist.percentile(value), 1), 'count': dist.total})
+        return rows
+
+
+class NormRegistry:
+    """アプリから参照する基準値の表（ファイルの更新を確認して読み直す）"""
+
+    def __init__(self, path, reload_interval=60.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._table = NormTable()
+        self._mtime = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def table(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval:
+            self._maybe_reload(now)
+        return self._table
+
+    def _maybe_reload(self, now):
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                self._table = NormTable.load(self.path)
+                self._mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                get_logger('main').warning("基準値の表を読み込めませんでした: %s (%s)", self.path, e)
+                return
+            get_logger('main').info("基準値の表を読み込みました", extra={'fields': {
+                'last_block_id': self._table.last_block_id, 'distributions': len(self._table.distributions)}})
+
+
+def update(table, batch_size=500):
+    """table.last_block_id より後に保存したブロックの要約を table に足し、足したブロックの数を返す"""
+    import main_app
+    import storage
+
+    pending = collections.defaultdict(list)
+    params_cache = {}
+    count = 0
+
+    def flush():
+        # 分布ごとにまとめて足す（ブロックごとに並べ直さない）
+        for (group, task, metric), values in pending.items():
+            table.add(group, task, metric, values)
+        pending.clear()
+
+    for block in storage.iter_blocks(batch_size=batch_size, after_id=table.last_block_id):
+        spec = main_app.TASKS.get(block['task'])
+        table.last_block_id = max(table.last_block_id, block['id'])
+        if spec is None or not block['results']:
+            continue
+        key = (block['study_id'], block['task'])
+        if key not in params_cache:
+            study = main_app.studies.get(block['study_id'])
+            params = (study or main_app.studies.get(main_app.DEFAULT_STUDY_ID)).params[block['task']]
+            params_cache[key] = (study.norm_group if study else block['study_id'], params)
+        group, params = params_cache[key]
+        summary, _ = spec['summarize'](block['results'], params)
+        if summary.get('quality_warning'):
+            continue
+        for metric in spec['norm_metrics']:
+            if has_data(summary, metric, spec['norm_requires']):
+                pending[group, block['task'], metric].append(summary[metric])
+        count += 1
+        if count % FLUSH_BLOCKS == 0:
+            flush()
+    flush()
+    table.built_at = time.time()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='保存済みのブロックから基準値の表を作る')
+    parser.add_argument('--full', action='store_true', help='差分ではなくすべてのブロックから作り直す')
+    parser.add_argument('--output', default=norms_path(), help='基準値の表の置き場所')
+    parser.add_argument('--show', metavar='TASK', help='課題の基準集団と件数を表示するだけ')
+    args = parser.parse_args(argv)
+    configure_logging(sys.stderr)
+    os.environ.setdefault('WARMUP', '0')  # main_app のウォームアップは要らない
+
+    table = NormTable() if args.full else NormTable.load(args.output)
+    if args.show:
+        for (group, task, metric), dist in sorted(table.distributions.items()):
+            if task == args.show:
+                print(f'{group}\t{metric}\t{dist.total}')
+        return 0
+    count = update(table)
+    table.save(args.output)
+    get_logger('main').info("基準値の表を更新しました", extra={'fields': {
+        'blocks': count, 'last_block_id': table.last_block_id, 'output': args.output}})
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
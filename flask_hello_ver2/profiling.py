@@ -0,0 +1,208 @@
+"""リクエスト単位のプロファイリング
+
+遅いワーカーで時間がセッションの読み書き・結果表のテンプレート描画・試行生成の
+どこに使われているかを調べるためのフック。セッションの読み書きも含めるため、
+Flask のリクエスト処理全体（wsgi_app）を包む。
+
+2つのモードがある:
+
+    cprofile  X-Profile ヘッダーの値が PROFILE_TOKEN と一致するリクエスト、または PROFILE_SAMPLE_RATE の割合の
+              リクエストを cProfile で計測し、<PROFILE_DIR>/<エンドポイント>/<時刻>-<pid>.prof
+              に書き出す（pstats 形式。snakeviz や flameprof でフレームグラフにできる）
+    sampling  バックグラウンドのスレッドが PROFILE_INTERVAL 秒ごとに処理中のリクエストの
+              スタックを記録し、<PROFILE_DIR>/<エンドポイント>.<pid>.folded に
+              collapsed stack 形式（flamegraph.pl / speedscope でそのまま読める）で書き出す
+
+無効のとき（デフォルト）は wsgi_app を包まないので、オーバーヘッドはない。
+
+環境変数:
+    PROFILE_MODE          off（デフォルト） / cprofile / sampling
+    PROFILE_DIR           出力先（デフォルト: instance/profiles）
+    PROFILE_SAMPLE_RATE   cprofile モードでヘッダーなしに計測するリクエストの割合（デフォルト: 0）
+    PROFILE_TOKEN         cprofile モードで必須。X-Profile ヘッダーの値がこれと一致するときだけ計測する
+                          （公開しているサーバーで誰でも計測とファイルの書き出しをさせないため）
+    PROFILE_INTERVAL      sampling モードのサンプリング間隔（秒、デフォルト: 0.005）
+    PROFILE_FLUSH_INTERVAL  sampling モードでファイルに書き出す間隔（秒、デフォルト: 10）
+"""
+import atexit
+import collections
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+
+from flask import request
+
+from log_config import get_logger
+
+ENDPOINT_KEY = 'profiling.endpoint'
+HEADER = 'HTTP_X_PROFILE'
+
+logger = get_logger('main')
+
+
+def _default_dir():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'profiles')
+
+
+def _endpoint(environ):
+    return environ.get(ENDPOINT_KEY) or 'unmatched'
+
+
+class CProfileMiddleware:
+    """指定されたリクエストだけを cProfile で計測する"""
+
+    def __init__(self, wsgi_app, directory, token, sample_rate=0.0):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token.encode()
+
+    def _wanted(self, environ):
+        header = environ.get(HEADER)
+        if header is not None:
+            # compare_digest は ASCII 以外を含む str を比べられないので bytes にして比べる
+            return hmac.compare_digest(header.encode(), self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self._wanted(environ):
+            return self.wsgi_app(environ, start_response)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            # 本文の生成も計測に含めるため、ここで読み切る
+            response = self.wsgi_app(environ, start_response)
+            try:
+                body = list(response)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        finally:
+            profiler.disable()
+        elapsed = (time.perf_counter() - started) * 1000
+        self._dump(profiler, _endpoint(environ), elapsed)
+        return body
+
+    def _dump(self, profiler, endpoint, elapsed):
+        directory = os.path.join(self.directory, endpoint)
+        path = os.path.join(directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{time.time_ns() % 10**6:06d}-{os.getpid()}.prof')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError as e:
+            logger.warning("プロファイルを書き出せませんでした: %s", e)
+            return
+        logger.info("プロファイルを書き出しました",
+                    extra={'fields': {'endpoint': endpoint, 'elapsed_ms': round(elapsed, 2), 'path': path}})
+
+
+class SamplingProfiler:
+    """処理中のリクエストのスタックを一定間隔で記録する
+
+    リクエストを処理しているスレッドの ID を登録しておき、
+    バックグラウンドのスレッドが sys._current_frames() からそのスレッドのスタックだけを読む。
+    リクエスト側の処理は辞書への登録と削除、終了時の集計の合算だけ。
+    """
+
+    def __init__(self, wsgi_app, directory, interval=0.005, flush_interval=10.0):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self._active = {}
+        self._stacks = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def __call__(self, environ, start_response):
+        ident = threading.get_ident()
+        counts = collections.Counter()
+        # スタックはこのフレームより内側だけを記録する（サーバー側のフレームは省く）
+        self._active[ident] = (sys._getframe(), counts)
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            self._active.pop(ident, None)
+            # エンドポイントはセッションの読み込み後に決まるので、リクエストの終了時に振り分ける
+            if counts:
+                with self._lock:
+                    self._stacks[_endpoint(environ)].update(counts)
+
+    @staticmethod
+    def _stack(frame, outer):
+        names = []
+        while frame is not None and frame is not outer:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def sample(self):
+        frames = sys._current_frames()
+        for ident, (outer, counts) in list(self._active.items()):
+            frame = frames.get(ident)
+            if frame is not None:
+                counts[self._stack(frame, outer)] += 1
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            time.sleep(self.interval)
+            if self._active:
+                self.sample()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+
+    def flush(self):
+        """これまでの集計をエンドポイントごとのファイルに書き出す（上書き）"""
+        with self._lock:
+            snapshot = {endpoint: dict(stacks) for endpoint, stacks in self._stacks.items()}
+        if not snapshot:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for endpoint, stacks in snapshot.items():
+                path = os.path.join(self.directory, f'{endpoint}.{os.getpid()}.folded')
+                with open(path, 'w', encoding='utf-8') as f:
+                    for stack, count in stacks.items():
+                        f.write(f'{stack} {count}\n')
+        except OSError as e:
+            logger.warning("プロファイルを書き出せませんでした: %s", e)
+
+
+def init_profiling(app):
+    """環境変数の設定に応じて app.wsgi_app を包む（無効なら何もしない）"""
+    mode = os.environ.get('PROFILE_MODE', 'off')
+    if mode == 'off':
+        return None
+    directory = os.environ.get('PROFILE_DIR') or _default_dir()
+
+    @app.before_request
+    def _record_endpoint():
+        request.environ[ENDPOINT_KEY] = request.endpoint
+
+    if mode == 'cprofile':
+        token = os.environ.get('PROFILE_TOKEN')
+        if not token:
+            raise ValueError('PROFILE_MODE=cprofile には PROFILE_TOKEN が必要です')
+        middleware = CProfileMiddleware(
+            app.wsgi_app, directory, token,
+            sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)))
+    elif mode == 'sampling':
+        middleware = SamplingProfiler(
+            app.wsgi_app, directory,
+            interval=float(os.environ.get('PROFILE_INTERVAL', 0.005)),
+            flush_interval=float(os.environ.get('PROFILE_FLUSH_INTERVAL', 10)))
+    else:
+        raise ValueError(f'PROFILE_MODE が不正です: {mode}')
+    app.wsgi_app = middleware
+    logger.info("プロファイリングを有効にしました", extra={'fields': {'mode': mode, 'dir': directory}})
+    return middleware
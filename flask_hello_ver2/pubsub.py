@@ -0,0 +1,147 @@
+"""参加者の進行状況の配信（監督者画面の Server-Sent Events 用）
+
+参加者のリクエストは publish() で進行状況を渡すだけで、DB への問い合わせはしない。
+Broker は参加者ごとの最新の状態（スナップショット）と購読者の一覧を持ち、
+購読者ごとに「まだ送っていない参加者 → 最新の状態」の dict を溜める。
+購読者は FLUSH_INTERVAL 秒ごとに溜まった分をまとめて受け取るので、同じ参加者の
+更新が続いても最後の状態だけが送られ、参加者が数百人いても購読者ごとの
+メモリと送信量は参加者数で頭打ちになる。
+
+状態はプロセスごとに持つ。ワーカーが複数ある場合は PUBSUB_BACKEND=redis://... で
+Redis の pub/sub を経由させると、どのワーカーの監督者画面にも全員の状態が届く。
+
+環境変数:
+    PUBSUB_BACKEND   memory（デフォルト）または redis:// から始まるURL
+"""
+import json
+import os
+import threading
+import time
+
+FLUSH_INTERVAL = 0.5  # 購読者にまとめて送る間隔（秒）
+HEARTBEAT_INTERVAL = 15  # 更新がなくても接続を保つためにコメントを送る間隔（秒）
+MAX_STREAM_SECONDS = 300  # 1本の接続を開いておく上限（秒）。過ぎたら閉じ、ブラウザが再接続する
+RECONNECT_MS = 1000  # 閉じた後にブラウザが再接続するまでの時間（SSE の retry）
+IDLE_SECONDS = 3 * 3600  # これより長く更新のない参加者はスナップショットから消す
+
+
+class Subscription:
+    def __init__(self, broker):
+        self.broker = broker
+        self.pending = {}
+        self.cond = threading.Condition()
+
+    def push(self, key, state):
+        with self.cond:
+            self.pending[key] = state
+            self.cond.notify()
+
+    def take(self, timeout):
+        """更新を待ち、溜まっていた状態を返す（timeout 秒の間になければ空の dict）"""
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """プロセス内のファンアウト"""
+
+    def __init__(self):
+        self._states = {}
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last_prune = time.time()
+
+    def publish(self, key, state):
+        self._apply(key, state)
+
+    def _apply(self, key, state):
+        with self._lock:
+            self._states[key] = state
+            subscribers = list(self._subscribers)
+            if state['updated_at'] - self._last_prune > 60:
+                self._prune(state['updated_at'])
+        for subscriber in subscribers:
+            subscriber.push(key, state)
+
+    def _prune(self, now):
+        self._last_prune = now
+        for key in [k for k, s in self._states.items() if now - s['updated_at'] > IDLE_SECONDS]:
+            del self._states[key]
+
+    def subscribe(self):
+        """購読を始め、(購読, 現在のスナップショット) を返す"""
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscribers.add(subscription)
+            snapshot = list(self._states.values())
+        return subscription, snapshot
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stats(self):
+        with self._lock:
+            return {'participants': len(self._states), 'subscribers': len(self._subscribers)}
+
+
+class RedisBroker(Broker):
+    """Redis の pub/sub を経由して全ワーカーの Broker に配る"""
+
+    def __init__(self, url, channel='cognitive_task:progress'):
+        import redis
+        super().__init__()
+        self.channel = channel
+        self._client = redis.Redis.from_url(url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{channel: self._on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def publish(self, key, state):
+        self._client.publish(self.channel, json.dumps([key, state], ensure_ascii=False))
+
+    def _on_message(self, message):
+        key, state = json.loads(message['data'])
+        self._apply(key, state)
+
+
+def broker_from_env():
+    url = os.environ.get('PUBSUB_BACKEND', 'memory')
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBroker(url)
+    return Broker()
+
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+def event_stream(broker, heartbeat=HEARTBEAT_INTERVAL, max_seconds=MAX_STREAM_SECONDS):
+    """スナップショットを送ってから、更新を FLUSH_INTERVAL 秒ごとにまとめて送る
+
+    接続は max_seconds 秒で閉じる（ワーカーのスレッドを監督者画面が使い続けないようにする）。
+    EventSource は自動で再接続し、スナップショットを受け取り直すので表示は途切れない。
+    """
+    subscription, snapshot = broker.subscribe()
+    try:
+        yield f'retry: {RECONNECT_MS}\n\n'
+        yield sse_event('snapshot', snapshot)
+        deadline = time.monotonic() + max_seconds
+        last_sent = time.monotonic()
+        while (remaining := deadline - time.monotonic()) > 0:
+            pending = subscription.take(min(heartbeat, remaining))
+            if pending:
+                yield sse_event('progress', list(pending.values()))
+                last_sent = time.monotonic()
+                time.sleep(FLUSH_INTERVAL)
+            elif time.monotonic() - last_sent >= heartbeat:
+                yield ': heartbeat\n\n'
+                last_sent = time.monotonic()
+    finally:
+        subscription.close()
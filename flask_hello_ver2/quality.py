@@ -0,0 +1,94 @@
+"""試行ごとのデータの質のチェック
+
+反応を記録するたびに（record_result）結果1件を見て、次の旗（flags）を結果に付ける:
+
+    anticipatory   反応時間が quality_anticipatory_rt より速い（刺激を見る前の予測反応）
+    same_key_run   同じキーの反応が quality_same_key_run 回以上続いている
+    miss_run       反応のない誤りが quality_miss_run 回以上続いている。反応しないのが正解の試行
+                   （NoGo・N-back の非ターゲット）は数えず連続も切らないので、まったく反応しない
+                   参加者ではその間の試行すべてに付く（連続を切るのは反応があったときだけ）
+
+直前までの状態は「最後のキーとその連続回数」「反応のない誤りの連続回数」だけなので、
+セッションに置く状態の大きさは試行数によらない。旗は記録時に結果に書き込まれ、
+response_log と保存するブロックにもそのまま残るので、後から全試行を走査し直す必要はない。
+集計（summarize_<task>）では quality_fields() で旗の数を数え、旗の付いた試行の割合が
+quality_flag_limit を超えたブロックに quality_warning を付ける。
+
+設定は課題パラメータ（研究設定で上書き可）として渡す。None の項目はチェックしない。
+"""
+
+QUALITY_DEFAULTS = {
+    'quality_anticipatory_rt': 150,
+    'quality_same_key_run': 8,
+    'quality_miss_run': 5,
+    'quality_flag_limit': 0.2,
+}
+
+FLAGS = ('anticipatory', 'same_key_run', 'miss_run')
+
+
+def new_state():
+    return {'key': None, 'key_run': 0, 'miss_run': 0, 'flagged': 0}
+
+
+def check(state, result, params):
+    """結果1件の旗のリストを返し、state を更新する"""
+    flags = []
+    rt = result.get('reaction_time')
+    response = result.get('response')
+
+    limit = params.get('quality_anticipatory_rt')
+    if limit is not None and rt is not None and rt < limit:
+        flags.append('anticipatory')
+
+    if response is None:
+        state['key'], state['key_run'] = None, 0
+    elif response == state['key']:
+        state['key_run'] += 1
+    else:
+        state['key'], state['key_run'] = response, 1
+    limit = params.get('quality_same_key_run')
+    if limit is not None and state['key_run'] >= limit:
+        flags.append('same_key_run')
+
+    if response is not None:
+        state['miss_run'] = 0
+    elif not result.get('is_correct', False):
+        state['miss_run'] += 1
+    limit = params.get('quality_miss_run')
+    if limit is not None and state['miss_run'] >= limit:
+        flags.append('miss_run')
+
+    if flags:
+        state['flagged'] += 1
+    return flags
+
+
+def flag_results(results, params, state=None):
+    """結果のリストに順に旗を付け（付け直し）、最後の状態を返す（バッテリーや途中経過の再開用）"""
+    state = state or new_state()
+    for result in results:
+        flags = check(state, result, params)
+        if flags:
+            result['flags'] = flags
+        else:
+            result.pop('flags', None)
+    return state
+
+
+def quality_fields(results, params):
+    """集計に加える、旗ごとの試行数と要注意かどうか"""
+    counts = dict.fromkeys(FLAGS, 0)
+    flagged = 0
+    for result in results:
+        flags = result.get('flags')
+        if flags:
+            flagged += 1
+            for flag in flags:
+                counts[flag] += 1
+    limit = params.get('quality_flag_limit')
+    return {
+        'flagged_trials': flagged,
+        **{f'{flag}_trials': count for flag, count in counts.items()},
+        'quality_warning': bool(results) and limit is not None and flagged / len(results) > limit,
+    }
@@ -0,0 +1,161 @@
+"""トークンバケットによるレート制限
+
+エンドポイントごとに「IPアドレス単位」と「セッション単位」の上限を設定できる。
+既定のバックエンドはプロセス内メモリ（キーごとに残トークンと更新時刻を
+array に詰めて保持）で、複数ワーカーで上限を共有する場合は
+RATE_LIMIT_BACKEND=redis://host:6379/0 で Redis を使う。
+
+環境変数:
+    RATE_LIMIT_ENABLED   0 を指定すると無効化（デフォルト: 1）
+    RATE_LIMIT_BACKEND   memory（デフォルト）または redis:// から始まるURL
+"""
+import math
+import os
+import threading
+import time
+import uuid
+from array import array
+from collections import namedtuple
+
+from flask import jsonify, request, session
+
+# rate: 1秒あたりに補充されるトークン数、burst: バケットの容量
+Limit = namedtuple('Limit', ['rate', 'burst'])
+
+
+class MemoryBackend:
+    """プロセス内メモリのトークンバケット
+
+    キーごとの状態は dict ではなく array('d') の連続領域に
+    [残トークン, 最終更新時刻] の順で格納し、dict はキーから位置への対応だけを持つ。
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._index = {}
+        self._state = array('d')
+        self._lock = threading.Lock()
+
+    def consume(self, key, limit, now):
+        """トークンを1つ消費する。(許可したか, 再試行までの秒数) を返す"""
+        with self._lock:
+            pos = self._index.get(key)
+            if pos is None:
+                if len(self._index) >= self.max_keys:
+                    self._evict_idle(now)
+                pos = len(self._state)
+                self._index[key] = pos
+                self._state.extend((limit.burst, now))
+            state = self._state
+            tokens = min(limit.burst, state[pos] + (now - state[pos + 1]) * limit.rate)
+            state[pos + 1] = now
+            if tokens >= 1:
+                state[pos] = tokens - 1
+                return True, 0
+            state[pos] = tokens
+            return False, (1 - tokens) / limit.rate
+
+    def _evict_idle(self, now, idle_seconds=300):
+        """一定時間使われていないキーを捨てて領域を詰め直す"""
+        state = self._state
+        kept = {k: p for k, p in self._index.items() if now - state[p + 1] < idle_seconds}
+        if len(kept) >= self.max_keys:
+            kept = {}
+        new_state = array('d')
+        new_index = {}
+        for key, pos in kept.items():
+            new_index[key] = len(new_state)
+            new_state.extend((state[pos], state[pos + 1]))
+        self._index = new_index
+        self._state = new_state
+
+
+_REDIS_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """Redis上のトークンバケット（複数ワーカー・複数ホストで上限を共有する）"""
+
+    def __init__(self, url, prefix='rl:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_REDIS_SCRIPT)
+        self.prefix = prefix
+
+    def consume(self, key, limit, now):
+        allowed, tokens = self._script(keys=[self.prefix + key], args=[limit.rate, limit.burst, now])
+        if allowed:
+            return True, 0
+        return False, (1 - float(tokens)) / limit.rate
+
+
+def backend_from_env():
+    url = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    return MemoryBackend()
+
+
+class RateLimiter:
+    """before_request でエンドポイントごとの上限を確認する"""
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        self.rules = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if os.environ.get('RATE_LIMIT_ENABLED', '1') == '0':
+            return
+        if self.backend is None:
+            self.backend = backend_from_env()
+        app.before_request(self._check)
+
+    def limit(self, endpoint, per_ip=None, per_session=None):
+        """エンドポイントに上限を設定する"""
+        self.rules[endpoint] = (per_ip, per_session)
+
+    def _check(self):
+        rule = self.rules.get(request.endpoint)
+        if rule is None:
+            return None
+        per_ip, per_session = rule
+        now = time.time()
+        if per_ip is not None:
+            key = f'ip:{request.endpoint}:{request.remote_addr}'
+            allowed, retry_after = self.backend.consume(key, per_ip, now)
+            if not allowed:
+                return self._reject(retry_after)
+        if per_session is not None:
+            sid = session.get('sid')
+            if sid is None:
+                sid = session['sid'] = uuid.uuid4().hex
+            key = f'sid:{request.endpoint}:{sid}'
+            allowed, retry_after = self.backend.consume(key, per_session, now)
+            if not allowed:
+                return self._reject(retry_after)
+        return None
+
+    @staticmethod
+    def _reject(retry_after):
+        response = jsonify({'status': 'error', 'message': 'リクエストが多すぎます。しばらく待ってから再試行してください'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
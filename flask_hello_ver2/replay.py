@@ -0,0 +1,144 @@
+"""保存済みセッションの再生（回帰テスト用）
+
+保存済みのブロックごとに、記録されたシードで試行リストを生成し直し、
+記録された反応（response / reaction_time）を main_app のルートへ Flask のテストクライアントで
+順に送って、試行リストと採点結果が保存時と一致するかを確かめる。
+ブラウザも待ち時間も使わないため、1ブロックあたり数ミリ秒で再生できる。
+
+再生中は main_app の PERSIST_BLOCKS を無効にし、再生した結果は保存しない。
+
+使い方:
+    python replay.py                       # 全ブロック
+    python replay.py --task stroop --limit 1000
+    python replay.py --block 12 --block 15 --verbose
+
+不一致があったブロックを JSON Lines で標準出力に書き、1件でもあれば終了コード 1 を返す。
+"""
+import argparse
+import json
+import os
+import sys
+
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')  # 再生はレート制限の対象外
+os.environ.setdefault('WARMUP', '0')  # 再生にはテンプレートの事前コンパイルなどは要らない
+
+import storage
+from log_config import configure_logging, get_logger
+
+configure_logging(sys.stderr)  # 標準出力は結果の出力に使う
+
+import main_app
+
+
+def _seed_value(seed):
+    """保存時の型に戻す（ランダムなシードは整数、研究のシードは '<seed>:<task>' の文字列）"""
+    if seed is not None and seed.isdigit():
+        return int(seed)
+    return seed
+
+
+def _count(trials, key, value):
+    return sum(1 for trial in trials if trial[key] == value)
+
+
+# 保存済みの試行リストから、開始時のフォームの値を復元する
+START_FORMS = {
+    'flanker': lambda trials: {'trials_per_stimulus': len(trials) // len(main_app.STIMULI_FLANKER)},
+    'gonogo': lambda trials: {'go_trials': _count(trials, 'type', 'go'),
+                              'nogo_trials': _count(trials, 'type', 'nogo')},
+    'stroop': lambda trials: {'congruent_trials': _count(trials, 'type', 'congruent'),
+                              'incongruent_trials': _count(trials, 'type', 'incongruent')},
+    'nback': lambda trials: {'total_trials': len(trials)},
+}
+
+
+def _diff_results(stored, replayed):
+    mismatches = []
+    # データの質の旗（flags）を付ける前に保存したブロックでは旗を比べない
+    skipped = set() if any('flags' in r for r in stored) else {'flags'}
+    for idx, (old, new) in enumerate(zip(stored, replayed)):
+        for key in sorted((set(old) | set(new)) - skipped):
+            if old.get(key) != new.get(key):
+                mismatches.append({'trial': idx + 1, 'field': key, 'stored': old.get(key), 'replayed': new.get(key)})
+    if len(stored) != len(replayed):
+        mismatches.append({'field': 'length', 'stored': len(stored), 'replayed': len(replayed)})
+    return mismatches
+
+
+def replay_block(block):
+    """1ブロックを再生し、不一致の一覧を含む dict を返す"""
+    task = block['task']
+    codec = main_app.TASKS[task]['codec']
+    client = main_app.app.test_client()
+    with client.session_transaction() as sess:
+        sess['study'] = block['study_id']
+        sess['replay_seed'] = _seed_value(block['seed'])
+
+    report = {'block_id': block['id'], 'task': task, 'ok': True, 'mismatches': []}
+    start = client.post(f'/{task}/start', data=START_FORMS[task](codec.decode(block['trials'])))
+    if start.status_code != 200 or start.get_json().get('status') != 'success':
+        report.update(ok=False, error=f'start: {start.get_data(as_text=True)[:200]}')
+        return report
+    with client.session_transaction() as sess:
+        if sess['trials'] != block['trials']:
+            report['mismatches'].append({'field': 'trials', 'stored': block['trials'].hex(),
+                                         'replayed': sess['trials'].hex()})
+
+    for idx, result in enumerate(block['results']):
+        step = client.get(f'/{task}/next_trial').get_json()
+        if step['status'] != 'next':
+            report.update(ok=False, error=f'trial {idx + 1}: {step}')
+            return report
+        recorded = client.post(f'/{task}/record_response', json={
+            'response': result.get('response'),
+            'reaction_time': result.get('reaction_time'),
+        })
+        if recorded.status_code != 200 or recorded.get_json().get('status') != 'success':
+            report.update(ok=False, error=f'trial {idx + 1}: {recorded.get_data(as_text=True)[:200]}')
+            return report
+
+    with client.session_transaction() as sess:
+        report['mismatches'].extend(_diff_results(block['results'], sess.get('results', [])))
+    report['ok'] = not report['mismatches']
+    return report
+
+
+def iter_target_blocks(task=None, study_id=None, block_ids=None):
+    if block_ids:
+        for block_id in block_ids:
+            block = storage.get_block(block_id)
+            if block is not None:
+                yield block
+        return
+    for block in storage.iter_blocks(task=task):
+        if study_id is None or block['study_id'] == study_id:
+            yield block
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='保存済みセッションを再生して結果を照合する')
+    parser.add_argument('--task', choices=tuple(main_app.TASKS))
+    parser.add_argument('--study', help='対象の研究ID')
+    parser.add_argument('--block', type=int, action='append', help='対象のブロックID（複数指定可）')
+    parser.add_argument('--limit', type=int, help='再生するブロック数の上限')
+    parser.add_argument('--verbose', action='store_true', help='一致したブロックも出力する')
+    args = parser.parse_args(argv)
+    logger = get_logger('main')
+
+    main_app.app.config['PERSIST_BLOCKS'] = False
+    total = failed = 0
+    for block in iter_target_blocks(args.task, args.study, args.block):
+        if args.limit is not None and total >= args.limit:
+            break
+        report = replay_block(block)
+        total += 1
+        if not report['ok']:
+            failed += 1
+        if not report['ok'] or args.verbose:
+            sys.stdout.write(json.dumps(report, ensure_ascii=False) + '\n')
+    logger.info("再生が完了しました", extra={'fields': {'blocks': total, 'failed': failed}})
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""保存済みブロックの一括再採点
+
+正誤は記録時に main_app の score_<task> で決まり、そのまま保存される。
+採点規則（反応キーの対応、score_<task> の実装など）や反応時間の除外基準を
+変更したときに、保存済みの生の反応（response / reaction_time）から
+すべての試行を採点し直して、ブロックごとの要約を出力する。
+
+ブロックは chunk_size 件ずつまとめてプロセスプールに渡し、ワーカーでは
+ブロックの試行コードをまとめて展開してから採点する。保存済みのデータは変更しない。
+
+使い方:
+    python rescore.py --task stroop --min-rt 150 --max-rt 2000 -o rescored.jsonl
+    python rescore.py --params '{"stroop": {"response_keys": {"red": "1", ...}}}'
+
+    --min-rt / --max-rt   この範囲外の反応は「反応なし」として採点する（ミリ秒）
+    --params              研究設定のパラメータを課題ごとに上書きする（JSON）
+    --trials              要約に加えて採点し直した試行データも出力する
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import quality
+import storage
+from log_config import configure_logging, get_logger
+
+_worker = {}
+
+
+def _init_worker(overrides, min_rt, max_rt):
+    """ワーカープロセスごとに一度だけ main_app を読み込む"""
+    configure_logging(sys.stderr)  # 標準出力は結果の出力に使う
+    os.environ['WARMUP'] = '0'  # ワーカーごとにウォームアップのスレッドを起動しない
+    import main_app
+    _worker.update(app=main_app, overrides=overrides, min_rt=min_rt, max_rt=max_rt)
+
+
+def _params_for(study_id, task):
+    main_app = _worker['app']
+    study = main_app.studies.get(study_id) or main_app.studies.get(main_app.DEFAULT_STUDY_ID)
+    params = dict(study.params[task])
+    params.update(_worker['overrides'].get(task, {}))
+    return params
+
+
+def _raw_response(result, min_rt, max_rt):
+    """保存済みの結果から生の反応を取り出し、反応時間の除外基準を適用する"""
+    response = result.get('response')
+    reaction_time = result.get('reaction_time')
+    if response is not None and reaction_time is not None and (
+            (min_rt is not None and reaction_time < min_rt) or (max_rt is not None and reaction_time > max_rt)):
+        return {'response': None, 'reaction_time': None}
+    return {'response': response, 'reaction_time': reaction_time}
+
+
+def rescore_chunk(blocks, include_trials=False):
+    """ブロックのリストを採点し直し、出力レコードのリストを返す"""
+    tasks = _worker['app'].TASKS
+    min_rt, max_rt = _worker['min_rt'], _worker['max_rt']
+    params_cache = {}
+    records = []
+    for block in blocks:
+        spec = tasks.get(block['task'])
+        if spec is None:
+            continue
+        key = (block['study_id'], block['task'])
+        params = params_cache.get(key)
+        if params is None:
+            params = params_cache[key] = _params_for(*key)
+        trials = spec['codec'].decode(block['trials'])
+        score = spec['score']
+        results = [
+            score(trials[i], i, _raw_response(result, min_rt, max_rt), params)
+            for i, result in enumerate(block['results'][:len(trials)])
+        ]
+        quality.flag_results(results, params)
+        summary, trial_data = spec['summarize'](results, params) if results else ({}, [])
+        record = {
+            'block_id': block['id'],
+            'session_id': block['session_id'],
+            'study_id': block['study_id'],
+            'task': block['task'],
+            'summary': summary,
+        }
+        if include_trials:
+            record['trials'] = trial_data
+        records.append(record)
+    return records
+
+
+def iter_chunks(task=None, study_id=None, chunk_size=200):
+    """保存済みブロックを chunk_size 件ずつのリストにして返す"""
+    chunk = []
+    for block in storage.iter_blocks(task=task, batch_size=max(chunk_size, 500)):
+        if study_id is not None and block['study_id'] != study_id:
+            continue
+        chunk.append({key: block[key] for key in ('id', 'session_id', 'study_id', 'task', 'trials', 'results')})
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rescore(task=None, study_id=None, overrides=None, min_rt=None, max_rt=None,
+            workers=None, chunk_size=200, include_trials=False):
+    """すべての対象ブロックを採点し直し、出力レコードを block_id 順に返す
+
+    プールに投入するチャンクは workers * 2 件までに抑え、
+    データベース全体をメモリに載せずに処理する。
+    """
+    overrides = overrides or {}
+    workers = workers or os.cpu_count() or 1
+    chunks = iter_chunks(task, study_id, chunk_size)
+    if workers == 1:
+        _init_worker(overrides, min_rt, max_rt)
+        for chunk in chunks:
+            yield from rescore_chunk(chunk, include_trials)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(overrides, min_rt, max_rt)) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(rescore_chunk, chunk, include_trials))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='保存済みブロックを採点し直す')
+    parser.add_argument('--task', choices=('flanker', 'gonogo', 'stroop', 'nback'))
+    parser.add_argument('--study', help='対象の研究ID')
+    parser.add_argument('--params', type=json.loads, default={}, help='課題ごとのパラメータの上書き（JSON）')
+    parser.add_argument('--min-rt', type=float, help='これより速い反応は反応なしとして扱う（ミリ秒）')
+    parser.add_argument('--max-rt', type=float, help='これより遅い反応は反応なしとして扱う（ミリ秒）')
+    parser.add_argument('--workers', type=int, help='ワーカープロセス数（デフォルト: CPU数）')
+    parser.add_argument('--chunk-size', type=int, default=200, help='1回にワーカーへ渡すブロック数')
+    parser.add_argument('--trials', action='store_true', help='試行データも出力する')
+    parser.add_argument('-o', '--output', help='出力先（JSON Lines、省略時は標準出力）')
+    args = parser.parse_args(argv)
+    configure_logging(sys.stderr)
+    logger = get_logger('main')
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    count = 0
+    try:
+        for record in rescore(args.task, args.study, args.params, args.min_rt, args.max_rt,
+                              args.workers, args.chunk_size, args.trials):
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info("再採点が完了しました", extra={'fields': {'blocks': count, 'task': args.task, 'study': args.study}})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""反応時間の外れ値処理と頑健な代表値
+
+条件ごとの反応時間のリストから、外れ値を除いたうえで平均・中央値・刈り込み平均・
+ex-Gaussian 分布のパラメータ（mu, sigma, tau）を求める。
+1条件あたり1回ソートし、あとは線形の走査で集計するだけなので、
+コホート全体を rescore.py で再集計する場合もブロックあたりの計算量は O(n log n)。
+
+外れ値処理の設定は課題パラメータ（研究設定で上書き可）として渡す:
+    rt_min          これより速い反応を除外する（ミリ秒、None で無効）
+    rt_max          これより遅い反応を除外する（ミリ秒、None で無効）
+    rt_sd_cutoff    条件ごとに 平均 ± k×SD の外側を除外する（None で無効）
+    rt_mad_cutoff   条件ごとに 中央値 ± k×MAD の外側を除外する（None で無効、MAD が 0 なら除外しない）
+    rt_trim         刈り込み平均で両端から除く割合（0〜0.5）
+"""
+import math
+
+RT_DEFAULTS = {
+    'rt_min': None,
+    'rt_max': None,
+    'rt_sd_cutoff': None,
+    'rt_mad_cutoff': None,
+    'rt_trim': 0.1,
+}
+
+MAD_SCALE = 1.4826  # 正規分布のもとで MAD を SD と比較できるようにする係数
+MIN_EXGAUSS_TRIALS = 10  # ex-Gaussian を当てはめる最小の試行数
+
+
+def _median(sorted_rts):
+    n = len(sorted_rts)
+    mid = n // 2
+    return sorted_rts[mid] if n % 2 else (sorted_rts[mid - 1] + sorted_rts[mid]) / 2
+
+
+def _mean_sd(rts):
+    n = len(rts)
+    mean = math.fsum(rts) / n
+    if n < 2:
+        return mean, 0.0
+    return mean, math.sqrt(math.fsum((x - mean) ** 2 for x in rts) / (n - 1))
+
+
+def exclude_outliers(rts, params):
+    """外れ値を除いた反応時間を昇順で返す"""
+    lo, hi = params.get('rt_min'), params.get('rt_max')
+    kept = sorted(x for x in rts if (lo is None or x >= lo) and (hi is None or x <= hi))
+    k = params.get('rt_sd_cutoff')
+    if k is not None and len(kept) > 2:
+        mean, sd = _mean_sd(kept)
+        kept = [x for x in kept if abs(x - mean) <= k * sd]
+    k = params.get('rt_mad_cutoff')
+    if k is not None and len(kept) > 2:
+        median = _median(kept)
+        mad = MAD_SCALE * _median(sorted(abs(x - median) for x in kept))
+        # 半数以上が同じ値（タイマーの分解能が粗い場合など）だと MAD が 0 になり、
+        # 中央値以外をすべて除いてしまうので、その場合は MAD による除外をしない
+        if mad > 0:
+            kept = [x for x in kept if abs(x - median) <= k * mad]
+    return kept
+
+
+def trimmed_mean(sorted_rts, proportion):
+    """両端から proportion ずつ除いた平均"""
+    n = len(sorted_rts)
+    cut = int(n * min(max(proportion or 0, 0), 0.5))
+    if n - 2 * cut <= 0:
+        return _median(sorted_rts)
+    return math.fsum(sorted_rts[cut:n - cut]) / (n - 2 * cut)
+
+
+def fit_exgauss(rts):
+    """ex-Gaussian 分布のパラメータ (mu, sigma, tau) をモーメント法で推定する
+
+    歪度が正でない場合は tau = 0（正規分布）とみなす。試行数が少ない場合や、
+    歪度が 2 以上でモーメント法の解がない場合（極端な外れ値が残っている場合など）は None。
+    """
+    n = len(rts)
+    if n < MIN_EXGAUSS_TRIALS:
+        return None
+    mean, sd = _mean_sd(rts)
+    if sd == 0:
+        return mean, 0.0, 0.0
+    skew = math.fsum((x - mean) ** 3 for x in rts) / n / sd ** 3
+    if skew >= 2:
+        return None
+    tau = sd * (skew / 2) ** (1 / 3) if skew > 0 else 0.0
+    return mean - tau, math.sqrt(sd ** 2 - tau ** 2), tau
+
+
+def rt_fields(prefix, rts, params):
+    """条件 prefix の反応時間を要約し、(summary に追加する dict, 外れ値を除いた反応時間) を返す
+
+    {prefix}_avg_rt は外れ値を除いた平均（外れ値処理を設定しなければ従来の平均と同じ）。
+    反応時間が残らなければ代表値は 0 になるので、0 と区別する場合は {prefix}_rt_count を見る。
+    """
+    kept = exclude_outliers(rts, params)
+    fields = {
+        f'{prefix}_avg_rt': 0,
+        f'{prefix}_median_rt': 0,
+        f'{prefix}_trimmed_rt': 0,
+        f'{prefix}_rt_excluded': len(rts) - len(kept),
+        f'{prefix}_rt_count': len(kept),
+        f'{prefix}_exg_mu': None,
+        f'{prefix}_exg_sigma': None,
+        f'{prefix}_exg_tau': None,
+    }
+    if not kept:
+        return fields, kept
+    fields[f'{prefix}_avg_rt'] = round(math.fsum(kept) / len(kept), 2)
+    fields[f'{prefix}_median_rt'] = round(_median(kept), 2)
+    fields[f'{prefix}_trimmed_rt'] = round(trimmed_mean(kept, params.get('rt_trim')), 2)
+    exgauss = fit_exgauss(kept)
+    if exgauss is not None:
+        fields[f'{prefix}_exg_mu'], fields[f'{prefix}_exg_sigma'], fields[f'{prefix}_exg_tau'] = (
+            round(value, 2) for value in exgauss)
+    return fields, kept
@@ -0,0 +1,154 @@
+"""複数ワーカーでの動作確認
+
+main_app を別々のプロセスで複数起動し（それぞれ別のポート）、各セッションの
+リクエストをワーカーに順番に振り分けて課題を最後まで実施する。
+どのワーカーに当たっても試行が続けられ、すべての反応が結果と保存されたブロックに
+残っていることを確かめる。ロードバランサーの背後でワーカーを増やしたときと同じ状況になる。
+
+セッションとブロックの保存先は環境変数で指定する（指定しなければ一時ディレクトリの SQLite）:
+
+    SESSION_BACKEND   sqlite:///パス または redis://...（cookie でも動く）
+    DATABASE_URL      postgresql://...（指定しなければ DATABASE_PATH の SQLite）
+
+使い方:
+    python scale_check.py                              # ワーカー4つ、セッション16
+    python scale_check.py --workers 8 --sessions 64 --task stroop
+
+問題があれば終了コード 1 を返す。
+"""
+import argparse
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+START_FORMS = {
+    'flanker': {'trials_per_stimulus': '3'},
+    'gonogo': {'go_trials': '8', 'nogo_trials': '4'},
+    'stroop': {'congruent_trials': '6', 'incongruent_trials': '6'},
+    'nback': {'total_trials': '12'},
+}
+RESPONSES = {'flanker': 'left', 'gonogo': 'space', 'stroop': '1', 'nback': None}
+
+
+def serve(conn):
+    """ワーカーのプロセス: 空いているポートで main_app を起動し、ポート番号を親に送る"""
+    import logging
+
+    from werkzeug.serving import make_server
+
+    from log_config import configure_logging
+    configure_logging(sys.stderr)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # リクエストごとのログは出さない
+    import main_app
+
+    server = make_server('127.0.0.1', 0, main_app.app, threaded=True)
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+class Client:
+    """クッキーを保持して、リクエストごとに次のワーカーへ送る"""
+
+    def __init__(self, ports):
+        self.ports = ports
+        self.count = 0
+        # クッキーはポートを区別しないので、すべてのワーカーで同じセッションになる
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, path, form=None, body=None):
+        port = self.ports[self.count % len(self.ports)]
+        self.count += 1
+        url = f'http://127.0.0.1:{port}{path}'
+        if form is not None:
+            req = urllib.request.Request(url, data=urllib.parse.urlencode(form).encode())
+        elif body is not None:
+            req = urllib.request.Request(url, data=json.dumps(body).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        else:
+            req = urllib.request.Request(url)
+        with self.opener.open(req, timeout=30) as response:
+            data = response.read()
+        return json.loads(data) if response.headers.get_content_type() == 'application/json' else data
+
+
+def run_session(ports, task):
+    """1セッション分の課題を実施し、問題があればその内容を返す"""
+    client = Client(ports)
+    client.request(f'/{task}')
+    started = client.request(f'/{task}/start', form=START_FORMS[task])
+    if started.get('status') != 'success':
+        return f'開始できません: {started}'
+    recorded = 0
+    while True:
+        trial = client.request(f'/{task}/next_trial')
+        if trial['status'] == 'completed':
+            break
+        result = client.request(f'/{task}/record_response', body={
+            'response': RESPONSES[task], 'reaction_time': 400 + recorded, 'trial_id': trial['trial_id']})
+        if result.get('status') != 'success':
+            return f'記録できません: {result}'
+        recorded += 1
+
+    results = client.request(f'/api/{task}/results')
+    if results['total_trials'] != recorded or not results['completed']:
+        return f"結果が {results['total_trials']}/{recorded} 試行しかありません"
+    import storage
+    block = storage.get_block(results['block_id']) if results['block_id'] else None
+    if block is None or len(block['results']) != recorded:
+        return f"ブロック {results['block_id']} が保存されていません"
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='複数ワーカーでの動作確認')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--sessions', type=int, default=16)
+    parser.add_argument('--task', choices=sorted(START_FORMS), default='flanker')
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='scale_check_')
+    os.environ.setdefault('SESSION_BACKEND', f"sqlite:///{os.path.join(tmp, 'sessions.db')}")
+    os.environ.setdefault('DATABASE_PATH', os.path.join(tmp, 'cognitive_tasks.db'))
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+    ctx = multiprocessing.get_context('spawn')
+    workers, ports = [], []
+    for _ in range(args.workers):
+        parent, child = ctx.Pipe()
+        process = ctx.Process(target=serve, args=(child,), daemon=True)
+        process.start()
+        workers.append(process)
+        ports.append(parent.recv())
+
+    errors = []
+    start = time.perf_counter()
+    try:
+        threads = []
+        for _ in range(args.sessions):
+            thread = threading.Thread(target=lambda: errors.append(run_session(ports, args.task)))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    finally:
+        for process in workers:
+            process.terminate()
+    elapsed = time.perf_counter() - start
+
+    failed = [e for e in errors if e is not None]
+    for error in failed:
+        print(error, file=sys.stderr)
+    print(f'{args.task}: ワーカー {args.workers}、セッション {args.sessions}（失敗 {len(failed)}）、{elapsed:.1f} 秒')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""サーバー側のセッションストア
+
+既定の Flask のセッションは署名付きクッキーに全体（試行リスト・結果）を入れるため、
+どのワーカーがリクエストを受けても動くが、クッキーが大きくなり、
+ワーカーを増やすとリクエストごとに同じデータを送り直すことになる。
+SESSION_BACKEND を指定すると、クッキーにはセッションIDだけを入れ、中身は
+共有のストアに置く。ワーカー自体は状態を持たないので、プロセスやホストを増やして
+ロードバランサーで振り分けられる。
+
+環境変数:
+    SESSION_BACKEND   cookie（デフォルト、従来どおりクッキーに保存）
+                      memory（プロセス内。ワーカー1つで試すとき用）
+                      sqlite:///パス（同じホストのワーカー間で共有する）
+                      redis://host:6379/0（複数ホストで共有する。redis パッケージが必要）
+
+同じセッションへのリクエストが別々のワーカーで同時に処理されると、後に保存した方が
+残る。反応の結果は storage の response_log にも追記しているので（sync_results）、
+記録した試行が失われることはない。
+"""
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+
+
+class MemoryStore:
+    """プロセス内の dict（ワーカー間では共有しない）"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def set(self, sid, data, ttl):
+        with self._lock:
+            self._data[sid] = (data, time.time() + ttl)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteStore:
+    """SQLite のファイル（同じホストの複数プロセスで共有する）"""
+
+    # set() をこの回数呼ぶごとに期限切れのセッションを消す
+    purge_interval = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         'sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL) WITHOUT ROWID')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute(
+            'SELECT data FROM sessions WHERE sid = ? AND expires >= ?', (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, data, ttl):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+                         (sid, data, now + ttl))
+            self._writes += 1
+            if self._writes % self.purge_interval == 0:
+                conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+
+    def delete(self, sid):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class RedisStore:
+    """Redis（複数ホストで共有する。接続はコネクションプールから使う）"""
+
+    def __init__(self, url, prefix='session:'):
+        import redis
+        self._client = redis.Redis(connection_pool=redis.ConnectionPool.from_url(url))
+        self.prefix = prefix
+
+    def get(self, sid):
+        data = self._client.get(self.prefix + sid)
+        return None if data is None else data.decode('utf-8')
+
+    def set(self, sid, data, ttl):
+        self._client.set(self.prefix + sid, data, ex=max(1, int(ttl)))
+
+    def delete(self, sid):
+        self._client.delete(self.prefix + sid)
+
+
+def store_from_url(url):
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisStore(url)
+    raise ValueError(f'SESSION_BACKEND が不正です: {url}')
+
+
+class StoreSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None, new=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = new
+
+
+class StoreSessionInterface(SessionInterface):
+    """クッキーにはセッションIDだけを入れ、中身は store に保存する"""
+
+    # 試行リストの bytes などをクッキーのセッションと同じ形式で書き出す
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                try:
+                    return StoreSession(self.serializer.loads(data), sid=sid)
+                except ValueError:
+                    pass
+        return StoreSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       httponly=self.get_cookie_httponly(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+
+        if session.modified:
+            ttl = app.permanent_session_lifetime.total_seconds()
+            self.store.set(session.sid, self.serializer.dumps(dict(session)), ttl)
+        if session.new or (session.modified and self.should_set_cookie(app, session)):
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app),
+                                partitioned=self.get_cookie_partitioned(app))
+
+
+def init_sessions(app):
+    """SESSION_BACKEND が指定されていれば app のセッションをサーバー側に置く"""
+    url = os.environ.get('SESSION_BACKEND', 'cookie')
+    if url != 'cookie':
+        app.session_interface = StoreSessionInterface(store_from_url(url))
+    return app.session_interface
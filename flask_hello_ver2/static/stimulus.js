@@ -0,0 +1,47 @@
+// 刺激の事前描画
+// 刺激の要素は提示の直前に作らず、注視点（+）や空白の間に画面外のコンテナで組み立てて
+// レイアウトまで済ませておく。提示時は requestAnimationFrame の中で差し替えるだけにして、
+// 刺激が1フレームで現れるようにする。next_trial の upcoming（次の数試行の刺激）も先に組み立てる。
+
+function showInFrame(apply, onShown) {
+    requestAnimationFrame(() => {
+        apply();
+        onShown();
+    });
+}
+
+function createStimulusCache(target, key, build) {
+    // 刺激を表示する要素の親と同じクラスにして、同じスタイルでレイアウトさせる
+    const holder = document.createElement('div');
+    holder.className = target.parentNode.className;
+    holder.setAttribute('aria-hidden', 'true');
+    Object.assign(holder.style, {
+        position: 'fixed', left: '-10000px', top: '0', visibility: 'hidden', pointerEvents: 'none',
+    });
+    document.body.appendChild(holder);
+    const nodes = new Map();
+
+    function prepare(stimulus) {
+        const k = key(stimulus);
+        let node = nodes.get(k);
+        if (!node) {
+            node = build(stimulus);
+            nodes.set(k, node);
+        }
+        if (node.parentNode !== target) holder.appendChild(node);
+        return node;
+    }
+
+    return {
+        // 刺激の要素を組み立ててレイアウトを済ませる
+        prebuild(stimuli) {
+            stimuli.forEach(prepare);
+            void holder.offsetHeight;
+        },
+        // 次のフレームで刺激を差し替え、差し替えた直後に onShown を呼ぶ
+        show(stimulus, onShown) {
+            const node = prepare(stimulus);
+            showInFrame(() => target.replaceChildren(node), onShown);
+        },
+    };
+}
@@ -0,0 +1,91 @@
+// 結果画面の試行データの表
+// /<task>/results/trials からページ単位で取得し、スクロール位置の前後の行だけを描画する。
+// 表全体の高さは上下の空行（spacer）で確保するので、スクロールバーは全試行分の長さになる。
+
+function trialCell(content) {
+    const td = document.createElement('td');
+    if (content instanceof Node) {
+        td.appendChild(content);
+    } else {
+        td.textContent = content;
+    }
+    return td;
+}
+
+function trialRow(cells, isCorrect) {
+    const tr = document.createElement('tr');
+    if (!isCorrect) tr.className = 'table-danger';
+    cells.forEach(content => tr.appendChild(trialCell(content)));
+    return tr;
+}
+
+function createTrialTable(container, url, renderRow, pageSize = 100) {
+    const tbody = container.querySelector('tbody');
+    const columns = container.querySelectorAll('thead th').length;
+    const overscan = 10;  // 見えている範囲の前後に余分に描画する行数
+    const trials = [];
+    let total = 0;
+    let nextCursor = 0;
+    let loading = false;
+    let rowHeight = 37;
+    let scheduled = false;
+
+    function spacer(height) {
+        const tr = document.createElement('tr');
+        tr.className = 'trial-table-spacer';
+        const td = document.createElement('td');
+        td.colSpan = columns;
+        td.style.height = `${height}px`;
+        tr.appendChild(td);
+        return tr;
+    }
+
+    function load() {
+        if (loading || nextCursor === null) return;
+        loading = true;
+        fetch(`${url}?cursor=${nextCursor}&limit=${pageSize}`)
+        .then(response => response.json())
+        .then(data => {
+            loading = false;
+            if (data.status !== 'success') {
+                console.error('試行データの取得エラー:', data);
+                return;
+            }
+            trials.push(...data.trials);
+            total = data.total;
+            nextCursor = data.next_cursor;
+            render();
+        })
+        .catch(error => {
+            loading = false;
+            console.error('試行データの取得エラー:', error);
+        });
+    }
+
+    function render() {
+        scheduled = false;
+        const visible = Math.ceil(container.clientHeight / rowHeight);
+        let first = Math.max(0, Math.floor(container.scrollTop / rowHeight) - overscan);
+        first -= first % 2;  // 縞模様（table-striped）の位置がずれないように偶数行から始める
+        const last = Math.min(trials.length, first + visible + overscan * 2);
+        const rows = [spacer(first * rowHeight)];
+        for (let i = first; i < last; i++) {
+            rows.push(renderRow(trials[i]));
+        }
+        rows.push(spacer(Math.max(0, total - Math.max(last, first)) * rowHeight));
+        tbody.replaceChildren(...rows);
+        if (last > first && rows[1].offsetHeight) {
+            rowHeight = rows[1].offsetHeight;
+        }
+        // 見えている範囲の先まで読み込めていなければ次のページを取得する
+        if (first + visible + overscan * 2 >= trials.length) load();
+    }
+
+    container.addEventListener('scroll', function() {
+        if (!scheduled) {
+            scheduled = true;
+            requestAnimationFrame(render);
+        }
+    });
+    load();
+}
@@ -0,0 +1,420 @@
+"""課題ブロックと参加者ごとの進行状況の保存（SQLite / PostgreSQL）
+
+1回の課題の実施（ブロック）ごとに、試行リスト（trial_codec で詰めた bytes）、
+使った乱数シード、反応データを1行として保存する。
+実施中のブロックの反応は、試行の添字（seq）ごとに response_log へ追記する
+（主キーが (ブロックのトークン, seq) なので、同じ試行の再送は無視される）。
+参加者IDがある場合は、課題の途中経過を (参加者ID, 研究ID, 課題) を主キーとする
+participant_state に保存し、ブラウザを閉じても途中から再開できるようにする。
+participant_state には試行リストとブロックのトークンだけを置き、反応は response_log から読む
+（反応のたびに結果の一覧全体を書き直さない）。
+
+保存先は環境変数 DATABASE_URL が postgresql:// で始まれば PostgreSQL
+（複数のホストのワーカーで共有する。psycopg と psycopg_pool が必要）、
+それ以外は DATABASE_PATH の SQLite（デフォルト: instance/cognitive_tasks.db）。
+SQL は方言ごとに STATEMENTS に名前を付けて持ち、各関数は名前で実行する。
+接続はプロセスごとのコネクションプール（db.py）から取り出す。
+
+古いブロックは archive.py で列指向のファイル（ARCHIVE_DIR）に移せる。
+get_block / iter_blocks / get_blocks_by_sessions は DB とアーカイブの両方から返す。
+"""
+import json
+import os
+import threading
+import time
+
+import db
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    seed TEXT,
+    trials BLOB NOT NULL,
+    results TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blocks_session ON blocks (session_id);
+CREATE TABLE IF NOT EXISTS participants (
+    participant_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS participant_state (
+    participant_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    trials BLOB NOT NULL,
+    current_trial INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    seed TEXT,
+    block_id INTEGER,
+    updated_at REAL NOT NULL,
+    block_token TEXT,
+    PRIMARY KEY (participant_id, study_id, task)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS response_log (
+    block_token TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (block_token, seq)
+) WITHOUT ROWID;
+"""
+
+_POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    id BIGSERIAL PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    seed TEXT,
+    trials BYTEA NOT NULL,
+    results TEXT NOT NULL,
+    created_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blocks_session ON blocks (session_id);
+CREATE TABLE IF NOT EXISTS participants (
+    participant_id TEXT PRIMARY KEY,
+    created_at DOUBLE PRECISION NOT NULL
+);
+CREATE TABLE IF NOT EXISTS participant_state (
+    participant_id TEXT NOT NULL,
+    study_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    trials BYTEA NOT NULL,
+    current_trial INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    seed TEXT,
+    block_id BIGINT,
+    updated_at DOUBLE PRECISION NOT NULL,
+    block_token TEXT,
+    PRIMARY KEY (participant_id, study_id, task)
+);
+ALTER TABLE participant_state ADD COLUMN IF NOT EXISTS block_token TEXT;
+CREATE TABLE IF NOT EXISTS response_log (
+    block_token TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    created_at DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (block_token, seq)
+);
+"""
+
+_BLOCK_COLUMNS = 'session_id, study_id, task, seed, trials, results, created_at'
+_STATE_COLUMNS = 'participant_id, study_id, task, trials, current_trial, results, seed, block_id, updated_at, block_token'
+
+STATEMENTS = {
+    'sqlite': {
+        'insert_block': f'INSERT INTO blocks ({_BLOCK_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        'get_block': 'SELECT * FROM blocks WHERE id = ?',
+        'iter_blocks': 'SELECT * FROM blocks WHERE id > ? ORDER BY id LIMIT ?',
+        'iter_task_blocks': 'SELECT * FROM blocks WHERE task = ? AND id > ? ORDER BY id LIMIT ?',
+        'iter_blocks_before': 'SELECT * FROM blocks WHERE created_at < ? AND id > ? ORDER BY id LIMIT ?',
+        'delete_blocks': 'DELETE FROM blocks WHERE id IN (SELECT value FROM json_each(?))',
+        # 完了していない参加者の途中経過が参照するトークンの反応は、再開に使うので残す
+        'purge_responses': ('DELETE FROM response_log WHERE created_at < ? AND block_token NOT IN'
+                            ' (SELECT block_token FROM participant_state'
+                            ' WHERE block_id IS NULL AND block_token IS NOT NULL)'),
+        # セッションIDの一覧は JSON の配列1つで渡す（件数によらず同じ文になる）
+        'blocks_by_sessions': ('SELECT * FROM blocks WHERE session_id IN (SELECT value FROM json_each(?))'
+                               ' AND (? IS NULL OR task = ?) AND (? IS NULL OR study_id = ?)'
+                               ' AND (? IS NULL OR created_at >= ?) AND (? IS NULL OR created_at < ?) ORDER BY id'),
+        'append_response': ('INSERT OR IGNORE INTO response_log (block_token, seq, result, created_at)'
+                            ' VALUES (?, ?, ?, ?)'),
+        'load_responses': 'SELECT result FROM response_log WHERE block_token = ? ORDER BY seq',
+        'load_response': 'SELECT result FROM response_log WHERE block_token = ? AND seq = ?',
+        'count_responses': 'SELECT COUNT(*) AS n FROM response_log WHERE block_token = ?',
+        'register_participant': 'INSERT OR IGNORE INTO participants (participant_id, created_at) VALUES (?, ?)',
+        'save_state': f'INSERT OR REPLACE INTO participant_state ({_STATE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'load_state': 'SELECT * FROM participant_state WHERE participant_id = ? AND study_id = ? AND task = ?',
+    },
+    'postgres': {
+        'insert_block': f'INSERT INTO blocks ({_BLOCK_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id',
+        'get_block': 'SELECT * FROM blocks WHERE id = %s',
+        'iter_blocks': 'SELECT * FROM blocks WHERE id > %s ORDER BY id LIMIT %s',
+        'iter_task_blocks': 'SELECT * FROM blocks WHERE task = %s AND id > %s ORDER BY id LIMIT %s',
+        'iter_blocks_before': 'SELECT * FROM blocks WHERE created_at < %s AND id > %s ORDER BY id LIMIT %s',
+        'delete_blocks': 'DELETE FROM blocks WHERE id IN (SELECT json_array_elements_text(%s::json)::bigint)',
+        'purge_responses': ('DELETE FROM response_log WHERE created_at < %s AND block_token NOT IN'
+                            ' (SELECT block_token FROM participant_state'
+                            ' WHERE block_id IS NULL AND block_token IS NOT NULL)'),
+        'blocks_by_sessions': ('SELECT * FROM blocks WHERE session_id IN'
+                               ' (SELECT json_array_elements_text(%s::json))'
+                               ' AND (%s::text IS NULL OR task = %s) AND (%s::text IS NULL OR study_id = %s)'
+                               ' AND (%s::float8 IS NULL OR created_at >= %s)'
+                               ' AND (%s::float8 IS NULL OR created_at < %s) ORDER BY id'),
+        'append_response': ('INSERT INTO response_log (block_token, seq, result, created_at)'
+                            ' VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING'),
+        'load_responses': 'SELECT result FROM response_log WHERE block_token = %s ORDER BY seq',
+        'load_response': 'SELECT result FROM response_log WHERE block_token = %s AND seq = %s',
+        'count_responses': 'SELECT COUNT(*) AS n FROM response_log WHERE block_token = %s',
+        'register_participant': ('INSERT INTO participants (participant_id, created_at) VALUES (%s, %s)'
+                                 ' ON CONFLICT DO NOTHING'),
+        'save_state': (f'INSERT INTO participant_state ({_STATE_COLUMNS})'
+                       ' VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+                       ' ON CONFLICT (participant_id, study_id, task) DO UPDATE SET'
+                       ' trials = EXCLUDED.trials, current_trial = EXCLUDED.current_trial,'
+                       ' results = EXCLUDED.results, seed = EXCLUDED.seed,'
+                       ' block_id = EXCLUDED.block_id, updated_at = EXCLUDED.updated_at,'
+                       ' block_token = EXCLUDED.block_token'),
+        'load_state': 'SELECT * FROM participant_state WHERE participant_id = %s AND study_id = %s AND task = %s',
+    },
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def database_path():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'cognitive_tasks.db')
+    return os.environ.get('DATABASE_PATH', default)
+
+
+class SQLiteBackend:
+    statements = STATEMENTS['sqlite']
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def execute(self, name, args):
+        """更新系の文を実行して変更した行数を返す"""
+        with self.pool.connection() as conn, conn:
+            return conn.execute(self.statements[name], args).rowcount
+
+    def executemany(self, name, rows):
+        with self.pool.connection() as conn, conn:
+            return conn.executemany(self.statements[name], rows).rowcount
+
+    def insert(self, name, args):
+        """INSERT を実行して追加した行の ID を返す"""
+        with self.pool.connection() as conn, conn:
+            return conn.execute(self.statements[name], args).lastrowid
+
+    def fetchone(self, name, args):
+        with self.pool.connection() as conn:
+            row = conn.execute(self.statements[name], args).fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self, name, args):
+        with self.pool.connection() as conn:
+            return [dict(row) for row in conn.execute(self.statements[name], args).fetchall()]
+
+
+class PostgresBackend:
+    statements = STATEMENTS['postgres']
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def execute(self, name, args):
+        with self.pool.connection() as conn:
+            return conn.execute(self.statements[name], args).rowcount
+
+    def executemany(self, name, rows):
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.executemany(self.statements[name], rows)
+            return cursor.rowcount
+
+    def insert(self, name, args):
+        with self.pool.connection() as conn:
+            return conn.execute(self.statements[name], args).fetchone()['id']
+
+    def fetchone(self, name, args):
+        with self.pool.connection() as conn:
+            return conn.execute(self.statements[name], args).fetchone()
+
+    def fetchall(self, name, args):
+        with self.pool.connection() as conn:
+            return conn.execute(self.statements[name], args).fetchall()
+
+
+def _backend():
+    """現在の設定の保存先（プロセスごとに1つのプールを作る）"""
+    url = os.environ.get('DATABASE_URL', '')
+    key = url if url.startswith(('postgresql://', 'postgres://')) else database_path()
+    backend = _pools.get(key)
+    if backend is None or backend.pool.pid != os.getpid():
+        with _pools_lock:
+            backend = _pools.get(key)
+            if backend is None or backend.pool.pid != os.getpid():
+                max_size = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+                if key == url:
+                    backend = PostgresBackend(db.PostgresPool(url, max_size, schema=_POSTGRES_SCHEMA))
+                else:
+                    backend = SQLiteBackend(db.SQLitePool(key, max_size, schema=_SQLITE_SCHEMA))
+                    _migrate_sqlite(backend)
+                _pools[key] = backend
+    return backend
+
+
+def _migrate_sqlite(backend):
+    """古いスキーマの SQLite に後から加えた列を足す（SQLite には ADD COLUMN IF NOT EXISTS がない）"""
+    with backend.pool.connection() as conn, conn:
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(participant_state)')}
+        if 'block_token' not in columns:
+            conn.execute('ALTER TABLE participant_state ADD COLUMN block_token TEXT')
+
+
+def pool_stats():
+    """現在の保存先のコネクションプールの統計（db.py を参照）"""
+    return _backend().pool.stats()
+
+
+def save_block(session_id, study_id, task, seed, trials, results):
+    """1ブロック分のデータを保存して ID を返す"""
+    return _backend().insert('insert_block', (
+        session_id, study_id, task, None if seed is None else str(seed), bytes(trials),
+        json.dumps(results, ensure_ascii=False), time.time()))
+
+
+def _row_to_block(row):
+    block = dict(row)
+    block['trials'] = bytes(block['trials'])
+    block['results'] = json.loads(block['results'])
+    return block
+
+
+def archive_dir():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'archive')
+    return os.environ.get('ARCHIVE_DIR', default)
+
+
+def _archive():
+    """archive.py で書き出したアーカイブ（なければ None）"""
+    path = archive_dir()
+    if not os.path.isdir(path):
+        return None
+    import archive
+    return archive.reader(path)
+
+
+def get_block(block_id):
+    row = _backend().fetchone('get_block', (block_id,))
+    if row:
+        return _row_to_block(row)
+    archived = _archive()
+    return archived.get_block(block_id) if archived else None
+
+
+def iter_live_blocks(task=None, before=None, batch_size=500, after_id=0):
+    """DB にあるブロックを ID 順に返す（before を指定すればそれより前に保存したもの、
+    after_id を指定すればそれより後の ID のものだけ）"""
+    backend = _backend()
+    last_id = after_id
+    while True:
+        if before is not None:
+            rows = backend.fetchall('iter_blocks_before', (before, last_id, batch_size))
+        elif task is None:
+            rows = backend.fetchall('iter_blocks', (last_id, batch_size))
+        else:
+            rows = backend.fetchall('iter_task_blocks', (task, last_id, batch_size))
+        if not rows:
+            return
+        for row in rows:
+            yield _row_to_block(row)
+        last_id = rows[-1]['id']
+
+
+def iter_blocks(task=None, batch_size=500, after_id=0):
+    """保存済みのブロックを ID 順に返す（アーカイブしたブロックを先に返す）
+
+    after_id を指定すればそれより後の ID のブロックだけを返す（差分の処理用）。
+    """
+    archived_ids = set()
+    archived = _archive()
+    if archived:
+        for block in archived.iter_blocks(task, after_id):
+            archived_ids.add(block['id'])
+            yield block
+    for block in iter_live_blocks(task, batch_size=batch_size, after_id=after_id):
+        # アーカイブの書き出し後、DB から消す前に中断した場合は同じブロックが両方にある
+        if block['id'] not in archived_ids:
+            yield block
+
+
+def get_blocks_by_sessions(session_ids, task=None, study_id=None, since=None, until=None):
+    """指定したセッションのブロックを ID 順に返す（アーカイブしたブロックも含む）
+
+    課題・研究・保存日時の範囲 [since, until)（UNIX時刻）で絞り込める。
+    アーカイブは課題と月のディレクトリで読むファイルを絞る。
+    """
+    if not session_ids:
+        return []
+    rows = _backend().fetchall('blocks_by_sessions', (
+        json.dumps(list(session_ids)), task, task, study_id, study_id, since, since, until, until))
+    blocks = {row['id']: _row_to_block(row) for row in rows}
+    archived = _archive()
+    if archived:
+        for block in archived.blocks_by_sessions(session_ids, task, study_id, since, until):
+            blocks.setdefault(block['id'], block)
+    return [blocks[block_id] for block_id in sorted(blocks)]
+
+
+def delete_blocks(block_ids):
+    """ブロックを DB から消す（アーカイブに移したもの）"""
+    return _backend().execute('delete_blocks', (json.dumps(list(block_ids)),))
+
+
+def purge_responses(before):
+    """before より前に追記した反応を response_log から消す
+
+    参加者の途中経過（participant_state）が参照している未完了のブロックの反応は残す。
+    """
+    return _backend().execute('purge_responses', (before,))
+
+
+def append_response(block_token, seq, result):
+    """試行 seq の結果を追記する（記録済みなら何もせず False を返す）"""
+    return _backend().execute('append_response', (
+        block_token, seq, json.dumps(result, ensure_ascii=False), time.time())) == 1
+
+
+def append_responses(block_token, results):
+    """(seq, 結果) の組をまとめて追記し、追記した件数を返す（記録済みの seq は無視する）"""
+    now = time.time()
+    return _backend().executemany('append_response', [
+        (block_token, seq, json.dumps(result, ensure_ascii=False), now) for seq, result in results])
+
+
+def load_responses(block_token):
+    """ブロックの記録済みの結果を seq 順に返す"""
+    return [json.loads(row['result']) for row in _backend().fetchall('load_responses', (block_token,))]
+
+
+def load_response(block_token, seq):
+    """試行 seq の記録済みの結果を返す（なければ None）"""
+    row = _backend().fetchone('load_response', (block_token, seq))
+    return json.loads(row['result']) if row is not None else None
+
+
+def count_responses(block_token):
+    """ブロックの記録済みの結果の数（主キーの範囲を数えるだけで、結果は読まない）"""
+    return _backend().fetchone('count_responses', (block_token,))['n']
+
+
+def register_participant(participant_id):
+    """参加者IDを登録する（登録済みなら何もしない）"""
+    _backend().execute('register_participant', (participant_id, time.time()))
+
+
+def save_state(participant_id, study_id, task, trials, current_trial, results, seed, block_id, block_token=None):
+    """参加者の課題の途中経過を上書き保存する
+
+    block_token を渡した場合、結果はそのトークンの response_log から読むので results は空でよい。
+    """
+    _backend().execute('save_state', (
+        participant_id, study_id, task, bytes(trials), current_trial,
+        json.dumps(results, ensure_ascii=False), None if seed is None else str(seed), block_id, time.time(),
+        block_token))
+
+
+def load_state(participant_id, study_id, task):
+    """参加者の課題の途中経過を返す（なければ None）"""
+    state = _backend().fetchone('load_state', (participant_id, study_id, task))
+    if state is None:
+        return None
+    state['trials'] = bytes(state['trials'])
+    state['results'] = json.loads(state['results'])
+    return state
@@ -4,9 +4,12 @@ import time
 from datetime import datetime
 import json
 
+from log_config import get_logger
+
 app = Flask(__name__)
 app.secret_key = "stroop_task_secret_key"
 app.config['SESSION_TYPE'] = 'filesystem'
+logger = get_logger('stroop')
 
 # ストループ課題の文字と色
 COLORS = {
@@ -38,7 +41,7 @@ def index():
     session['current_trial'] = 0
     session['results'] = []
     session['start_time'] = None
-    print("セッション初期化完了")  # デバッグ用
+    logger.debug("セッション初期化完了")
     return render_template('stroopindex.html', template='index')
 
 @app.route('/start', methods=['POST'])
@@ -46,7 +49,7 @@ def start():
     # 試行回数を設定（デフォルト：一致条件20回、不一致条件20回、計40試行）
     congruent_trials = int(request.form.get('congruent_trials', 20))
     incongruent_trials = int(request.form.get('incongruent_trials', 20))
-    print(f"開始: 一致条件 {congruent_trials} 回、不一致条件 {incongruent_trials} 回")  # デバッグ用
+    logger.debug("開始: 一致条件 %d 回、不一致条件 %d 回", congruent_trials, incongruent_trials)
     
     # 各刺激をランダムに配置した試行リストを作成
     trials = []
@@ -76,7 +79,7 @@ def start():
         })
     
     random.shuffle(trials)
-    print(f"試行リスト作成完了: {len(trials)} 試行")  # デバッグ用
+    logger.debug("試行リスト作成完了: %d 試行", len(trials))
     
     # セッションに試行リストを保存
     session['trials'] = trials
@@ -94,11 +97,11 @@ def next_trial():
     trials = session.get('trials', [])
     current_trial = session.get('current_trial', 0)
     
-    print(f"次の試行: {current_trial + 1}/{len(trials)}")  # デバッグ用
+    logger.debug("次の試行: %d/%d", current_trial + 1, len(trials))
     
     # すべての試行が終了した場合
     if current_trial >= len(trials):
-        print("すべての試行完了")  # デバッグ用
+        logger.debug("すべての試行完了")
         return jsonify({
             'status': 'completed'
         })
@@ -113,7 +116,7 @@ def next_trial():
     else:
         display_color_code = COLORS[trial_data['display_color']]['color']
     
-    print(f"刺激: {trial_data['text']} (文字の意味: {trial_data['text_color']}, 表示色: {trial_data.get('display_color', trial_data['text_color'])})")  # デバッグ用
+    logger.debug("刺激: %s (文字の意味: %s, 表示色: %s)", trial_data['text'], trial_data['text_color'], trial_data.get('display_color', trial_data['text_color']))
     
     return jsonify({
         'status': 'next',
@@ -134,17 +137,17 @@ def next_trial():
 def record_response():
     try:
         data = request.get_json()
-        print(f"受信したデータ: {data}")  # デバッグ用
+        logger.debug("受信したデータ", extra={'fields': {'data': data}})
         
         # 前の試行のインデックス
         trial_idx = session.get('current_trial', 0) - 1
         if trial_idx < 0:
-            print("試行が開始されていません")  # デバッグ用
+            logger.warning("試行が開始されていません")
             return jsonify({'status': 'error', 'message': '試行が開始されていません'})
         
         trials = session.get('trials', [])
         if not trials or trial_idx >= len(trials):
-            print(f"試行インデックスエラー: {trial_idx}, 試行数: {len(trials) if trials else 0}")
+            logger.warning("試行インデックスエラー: %d, 試行数: %d", trial_idx, len(trials) if trials else 0)
             return jsonify({'status': 'error', 'message': '試行インデックスエラー'})
             
         trial_data = trials[trial_idx]
@@ -174,7 +177,7 @@ def record_response():
             'is_correct': is_correct
         }
         
-        print(f"記録する結果: {result}")  # デバッグ用
+        logger.debug("記録する結果", extra={'fields': {'result': result}})
         
         # セッションから結果リストを取得（なければ新規作成）
         if 'results' not in session:
@@ -186,9 +189,7 @@ def record_response():
         
         return jsonify({'status': 'success', 'recorded': True})
     except Exception as e:
-        print(f"エラー発生: {str(e)}")
-        import traceback
-        traceback.print_exc()  # より詳細なエラー情報
+        logger.exception("エラー発生: %s", e)
         return jsonify({'status': 'error', 'message': str(e)})
 
 @app.route('/results')
@@ -197,10 +198,10 @@ def show_results():
         results = session.get('results', [])
         
         if not results:
-            print("結果がありません")
+            logger.info("結果がありません")
             return render_template('stroopindex.html', error='結果がありません', template='results')
         
-        print(f"結果件数: {len(results)}")
+        logger.debug("結果件数: %d", len(results))
         
         # 集計データを準備
         total_trials = len(results)
@@ -240,7 +241,7 @@ def show_results():
             'stroop_effect': round(stroop_effect, 2)
         }
         
-        print(f"サマリー: {summary}")
+        logger.info("サマリー", extra={'fields': {'summary': summary}})
         
         # 試行ごとのデータ
         trial_data = []
@@ -259,9 +260,7 @@ def show_results():
         
         return render_template('stroopindex.html', summary=summary, trial_data=trial_data, template='results')
     except Exception as e:
-        print(f"結果表示エラー: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("結果表示エラー: %s", e)
         return render_template('stroopindex.html', error=f'エラーが発生しました: {str(e)}', template='results')
 
 if __name__ == '__main__':
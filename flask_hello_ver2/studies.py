@@ -0,0 +1,128 @@
+"""研究（study）ごとの課題設定
+
+1つのデプロイで複数の研究室・研究を扱えるように、実施する課題のリスト、
+課題ごとのパラメータ（提示時間・試行数・反応キーなど）、乱数シードを
+研究単位のファイルで定義する。
+
+studies/ ディレクトリに <study_id>.json（PyYAML があれば .yaml / .yml も可）を置く:
+
+    {
+        "name": "〇〇研究室 2026年度",
+        "tasks": ["flanker", "stroop"],
+        "seed": 20260401,
+        "norm_group": "adults",
+        "params": {
+            "flanker": {"trials_per_stimulus": 10},
+            "stroop": {"stimulus_duration": 800}
+        }
+    }
+
+norm_group は結果画面で比べる基準集団（norms.py）。年齢帯などで研究を分けている場合に、
+同じ集団の研究で同じ名前を付ける（省略時は研究ID）。
+
+ファイルは読み込み時に既定値と合成しておき、リクエストごとの参照は dict の検索だけにする。
+ディレクトリの変更は reload_interval 秒ごとに mtime で確認し、変わっていれば読み直す
+（再起動は不要）。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from log_config import get_logger
+
+DEFAULT_STUDY_ID = 'default'
+
+logger = get_logger('main')
+
+
+class Study:
+    """1つの研究の設定"""
+
+    __slots__ = ('study_id', 'name', 'tasks', 'seed', 'params', 'norm_group', 'version')
+
+    def __init__(self, study_id, name, tasks, seed, params, norm_group=None):
+        self.study_id = study_id
+        self.name = name
+        self.tasks = tasks
+        self.seed = seed
+        self.params = params
+        self.norm_group = norm_group or study_id
+        # パラメータの内容のハッシュ（ファイルを読み直してパラメータが変われば変わる。集計のキャッシュに使う）
+        self.version = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _load_file(path):
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            return json.load(f)
+        import yaml
+        return yaml.safe_load(f)
+
+
+class StudyRegistry:
+    """研究設定の読み込みとキャッシュ"""
+
+    EXTENSIONS = ('.json', '.yaml', '.yml')
+
+    def __init__(self, directory, defaults, reload_interval=5.0):
+        self.directory = directory
+        self.defaults = defaults
+        self.reload_interval = reload_interval
+        self._studies = {}
+        self._signature = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def get(self, study_id):
+        """研究IDから設定を返す（存在しなければ None）"""
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval:
+            self._maybe_reload(now)
+        return self._studies.get(study_id)
+
+    def ids(self):
+        return list(self._studies)
+
+    def _scan(self):
+        entries = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(self.EXTENSIONS):
+                    entries.append((entry.name, entry.stat().st_mtime_ns))
+        return tuple(sorted(entries))
+
+    def _maybe_reload(self, now):
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return
+            self._checked_at = now
+            signature = self._scan()
+            if signature == self._signature:
+                return
+            self._studies = self._load_all(signature)
+            self._signature = signature
+            logger.info("研究設定を読み込みました", extra={'fields': {'studies': list(self._studies)}})
+
+    def _load_all(self, signature):
+        studies = {DEFAULT_STUDY_ID: self._build(DEFAULT_STUDY_ID, {})}
+        for name, _ in signature:
+            study_id = os.path.splitext(name)[0]
+            try:
+                studies[study_id] = self._build(study_id, _load_file(os.path.join(self.directory, name)) or {})
+            except Exception as e:
+                logger.exception("研究設定の読み込みに失敗しました: %s (%s)", name, e)
+        return studies
+
+    def _build(self, study_id, raw):
+        tasks = [t for t in raw.get('tasks', self.defaults) if t in self.defaults]
+        overrides = raw.get('params', {})
+        params = {}
+        for task, defaults in self.defaults.items():
+            task_overrides = overrides.get(task, {})
+            unknown = set(task_overrides) - set(defaults)
+            if unknown:
+                logger.warning("未知のパラメータを無視します: %s.%s %s", study_id, task, sorted(unknown))
+            params[task] = {key: task_overrides.get(key, value) for key, value in defaults.items()}
+        return Study(study_id, raw.get('name', study_id), tasks, raw.get('seed'), params, raw.get('norm_group'))
@@ -0,0 +1,72 @@
+"""結果の集計のキャッシュ
+
+結果画面を再読み込みするたびに summarize_<task> で全試行を集計し直さないよう、
+(セッションID, 課題) ごとに最後の集計を LRU で保持する。
+
+集計には、その時点の結果の版（results_version。反応を記録するたびに進む）、研究ID、
+研究のパラメータの版（Study.version。研究設定を読み直して採点に使うパラメータが
+変われば変わる）をスタンプとして付けておき、取り出すときにスタンプが一致しなければ使わない。
+反応の記録時には invalidate() で古い集計をすぐに捨てる。
+
+キャッシュはプロセスごとに持つ（gunicorn のワーカー間では共有しない）。
+
+環境変数:
+    SUMMARY_CACHE_SIZE  保持する集計の数（デフォルト: 1024、0 で無効）
+"""
+import collections
+import os
+import threading
+
+DEFAULT_SIZE = 1024
+
+
+class SummaryCache:
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, stamp):
+        """スタンプが一致する集計を返す（なければ None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != stamp:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, stamp, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (stamp, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, stamp, compute):
+        value = self.get(key, stamp)
+        if value is None:
+            value = compute()
+            self.put(key, stamp, value)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+def from_env():
+    return SummaryCache(int(os.environ.get('SUMMARY_CACHE_SIZE', DEFAULT_SIZE)))
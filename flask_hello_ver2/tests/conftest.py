@@ -0,0 +1,72 @@
+"""テストの共通設定
+
+main_app は import 時に設定を読むので、保存先などの環境変数は import より前に一時ディレクトリに向ける。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix='cognitive_task_test_')
+os.environ.update({
+    'DATABASE_PATH': os.path.join(_tmp, 'test.db'),
+    'ARCHIVE_DIR': os.path.join(_tmp, 'archive'),
+    'NORMS_PATH': os.path.join(_tmp, 'norms.json'),
+    'WARMUP': '0',
+    'RATE_LIMIT_ENABLED': '0',
+})
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('SESSION_BACKEND', None)
+
+
+@pytest.fixture
+def app():
+    import main_app
+    return main_app.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def run_block(client, task, form, respond):
+    """課題を開始して最後まで実施する（respond(試行の情報, 添字) が送る反応の dict を返す）"""
+    assert client.get(f'/{task}').status_code == 200
+    assert client.post(f'/{task}/start', data=form).get_json()['status'] == 'success'
+    i = 0
+    while True:
+        trial = client.get(f'/{task}/next_trial').get_json()
+        if trial['status'] != 'next':
+            break
+        client.post(f'/{task}/record_response', json={'trial_id': trial['trial_id'], **respond(trial, i)})
+        i += 1
+    return i
+
+
+def enter(app, participant_id):
+    """参加者IDを設定した新しいクライアント（別のブラウザ）"""
+    client = app.test_client()
+    client.get(f'/p/{participant_id}')
+    return client
+
+
+def respond(client, trial):
+    response = 'left' if trial['stimulus'][2] == '<' else 'right'
+    client.post('/flanker/record_response', json={
+        'trial_id': trial['trial_id'], 'response': response, 'reaction_time': 400})
+
+
+def answer(client, count):
+    """フランカー課題の次の count 試行に正しく反応し、提示された試行を返す"""
+    trials = []
+    for _ in range(count):
+        trial = client.get('/flanker/next_trial').get_json()
+        assert trial['status'] == 'next'
+        respond(client, trial)
+        trials.append(trial)
+    return trials
@@ -0,0 +1,86 @@
+import pytest
+
+from conftest import answer
+
+TOKEN = 'test-token'
+UNKNOWN = '0' * 32  # 保存したブロックのないセッションID
+
+
+@pytest.fixture
+def api(client, monkeypatch):
+    import main_app
+    monkeypatch.setattr(main_app, 'RESULTS_API_TOKEN', TOKEN)
+    return client
+
+
+def bulk(client, sessions, token=TOKEN, **filters):
+    headers = {} if token is None else {'Authorization': f'Bearer {token}'}
+    return client.post('/api/results', json={'sessions': sessions, **filters}, headers=headers)
+
+
+def finished_session(client):
+    client.get('/flanker')
+    client.post('/flanker/start', data={'trials_per_stimulus': '1'})
+    answer(client, 4)
+    client.get('/flanker/next_trial')
+    return client.get('/api/flanker/results').get_json()
+
+
+def test_task_results(client):
+    results = finished_session(client)
+    assert results['status'] == 'success'
+    assert results['completed'] is True
+    assert results['block_id'] is not None
+    assert results['total_trials'] == len(results['trials']) == 4
+    assert results['summary']['accuracy'] == 100
+
+
+def test_task_results_are_for_the_current_task_only(client):
+    finished_session(client)
+    assert client.get('/api/stroop/results').status_code == 404
+    assert client.get('/api/unknown/results').status_code == 404
+
+
+def test_task_results_without_results(client):
+    client.get('/flanker')
+    assert client.get('/api/flanker/results').status_code == 404
+
+
+def test_bulk_results_are_disabled_without_token(client):
+    assert bulk(client, []).status_code == 404
+    assert client.get('/api/db_stats').status_code == 404
+
+
+@pytest.mark.parametrize('token', [None, 'wrong', TOKEN + 'x', 'tést'])
+def test_bulk_results_reject_bad_tokens(api, token):
+    response = bulk(api, [], token=token)
+    assert response.status_code == 401
+    assert response.get_json()['status'] == 'error'
+
+
+def test_db_stats_requires_token(api):
+    assert api.get('/api/db_stats').status_code == 401
+    response = api.get('/api/db_stats', headers={'Authorization': f'Bearer {TOKEN}'})
+    assert response.status_code == 200
+    assert 'pool' in response.get_json()
+
+
+def test_bulk_results(api):
+    results = finished_session(api)
+    session_id = results['session_id']
+    response = bulk(api, [session_id, UNKNOWN])
+    assert response.status_code == 200
+    sessions = response.get_json()['sessions']
+    assert sessions[UNKNOWN] == []
+    [block] = sessions[session_id]
+    assert block['block_id'] == results['block_id']
+    assert block['summary'] == results['summary']
+    assert block['trials'] == results['trials']
+
+    assert bulk(api, [session_id], task='stroop').get_json()['sessions'][session_id] == []
+    assert bulk(api, [session_id], since=block['created_at'] + 1).get_json()['sessions'][session_id] == []
+
+
+def test_bulk_results_validate_the_body(api):
+    assert bulk(api, ['x'] * 101).status_code == 400
+    assert bulk(api, ['bad session id!']).status_code == 400
@@ -0,0 +1,85 @@
+import datetime
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+import archive  # noqa: E402
+import storage  # noqa: E402
+from conftest import answer, enter  # noqa: E402
+
+APRIL = datetime.datetime(2026, 4, 10, tzinfo=datetime.timezone.utc).timestamp()
+MAY = datetime.datetime(2026, 5, 10, tzinfo=datetime.timezone.utc).timestamp()
+
+
+def make_block(block_id, created_at, task='stroop', session_id='s1'):
+    results = [
+        # 整数・小数・None・欠けた項目・型の混じった項目・入れ子の値
+        {'trial': 1, 'response': '1', 'reaction_time': 400, 'is_correct': True, 'extra': 'a'},
+        {'trial': 2, 'response': None, 'reaction_time': None, 'is_correct': False, 'extra': 3},
+        {'trial': 3, 'response': '2', 'reaction_time': 512.5, 'is_correct': True,
+         'flags': ['anticipatory'], 'detail': {'key': 'x'}},
+    ]
+    return {'id': block_id, 'session_id': session_id, 'study_id': 'default', 'task': task, 'seed': '42',
+            'trials': bytes([1, 2, 3]), 'results': results, 'created_at': created_at}
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_round_trip(tmp_path, fmt):
+    april = [make_block(1, APRIL), make_block(2, APRIL + 60, session_id='s2')]
+    may = [make_block(3, MAY)]
+    archive.write_part(str(tmp_path), 'stroop', '2026-04', april, fmt)
+    archive.write_part(str(tmp_path), 'stroop', '2026-05', may, fmt)
+
+    reader = archive.ArchiveReader(str(tmp_path))
+    assert list(reader.iter_blocks()) == april + may
+    assert list(reader.iter_blocks(after_id=2)) == may
+    assert list(reader.iter_blocks(task='flanker')) == []
+    assert reader.get_block(2) == april[1]
+    assert reader.get_block(4) is None
+    assert reader.blocks_by_sessions(['s1']) == [april[0], may[0]]
+    assert reader.blocks_by_sessions(['s1'], since=MAY - 1) == may
+
+
+def test_reads_prune_partitions(tmp_path):
+    archive.write_part(str(tmp_path), 'stroop', '2026-05', [make_block(3, MAY)])
+    # 絞り込みで外れるディレクトリのファイルは開かない（壊れていても読める）
+    for task, month in (('flanker', '2026-05'), ('stroop', '2026-04')):
+        directory = tmp_path / f'task={task}' / f'month={month}'
+        directory.mkdir(parents=True)
+        (directory / 'blocks-00000001-00000002.parquet').write_bytes(b'broken')
+
+    reader = archive.ArchiveReader(str(tmp_path))
+    assert [b['id'] for b in reader.blocks_by_sessions(['s1'], task='stroop', since=MAY - 1)] == [3]
+
+
+def test_archive_blocks_and_purge(app):
+    # 匿名で最後まで実施したブロックと、参加者が中断したブロック
+    done = app.test_client()
+    done.get('/flanker')
+    done.post('/flanker/start', data={'trials_per_stimulus': '1'})
+    answer(done, 4)
+    done.get('/flanker/next_trial')
+    with done.session_transaction() as session:
+        done_token, block_id = session['block_token'], session['block_id']
+    before = storage.get_block(block_id)
+
+    participant = f'p-{uuid.uuid4().hex[:12]}'
+    paused = enter(app, participant)
+    paused.get('/flanker')
+    paused.post('/flanker/start', data={'trials_per_stimulus': '2'})
+    answer(paused, 3)
+    paused_token = storage.load_state(participant, 'default', 'flanker')['block_token']
+
+    archive.archive_blocks(storage.archive_dir(), time.time() + 1)
+
+    assert block_id not in [block['id'] for block in storage.iter_live_blocks()]
+    assert storage.get_block(block_id) == before
+    assert storage.count_responses(done_token) == 0
+    assert storage.count_responses(paused_token) == 3
+
+    resumed = enter(app, participant)
+    resumed.get('/flanker')
+    assert resumed.get('/flanker/next_trial').get_json()['trial_number'] == 4
@@ -0,0 +1,62 @@
+import io
+import json
+import logging
+import logging.handlers
+import queue
+
+from log_config import JsonFormatter, StructuredQueueHandler
+
+
+def queued_line(log):
+    log_queue = queue.SimpleQueue()
+    logger = logging.getLogger('cognitive_task.test_log_config')
+    logger.propagate = False
+    handler = StructuredQueueHandler(log_queue)
+    logger.addHandler(handler)
+    try:
+        log(logger)
+    finally:
+        logger.removeHandler(handler)
+    return json.loads(JsonFormatter().format(log_queue.get_nowait()))
+
+
+def test_exception_goes_to_exc_field():
+    def log(logger):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("boom %s", 'here', extra={'fields': {'task': 'stroop'}})
+
+    line = queued_line(log)
+    assert line['msg'] == 'boom here'
+    assert line['task'] == 'stroop'
+    assert 'Traceback' in line['exc']
+    assert 'ZeroDivisionError' in line['exc']
+
+
+def test_plain_record_has_no_exc():
+    line = queued_line(lambda logger: logger.warning("value %d", 3))
+    assert line['msg'] == 'value 3'
+    assert 'exc' not in line
+
+
+def test_listener_writes_exc():
+    stream = io.StringIO()
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    logger = logging.getLogger('cognitive_task.test_log_config.listener')
+    logger.propagate = False
+    logger.addHandler(StructuredQueueHandler(log_queue))
+    listener.start()
+    try:
+        try:
+            {}['missing']
+        except KeyError:
+            logger.exception("lookup failed")
+    finally:
+        listener.stop()
+    line = json.loads(stream.getvalue())
+    assert line['msg'] == 'lookup failed'
+    assert 'KeyError' in line['exc']
@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+import norms
+import storage
+from norms import ALL_GROUPS, MAX_POINTS, Distribution, NormTable
+
+
+def test_percentile_counts_ties_as_half():
+    dist = Distribution([1, 2, 3, 4], [1, 1, 1, 1])
+    assert dist.percentile(2) == 37.5
+    assert dist.percentile(0) == 0
+    assert dist.percentile(5) == 100
+
+
+def test_large_distributions_are_binned_by_equal_counts():
+    dist = Distribution()
+    dist.add(range(5000))
+    assert dist.total == 5000
+    assert dist.counts == [5000 // MAX_POINTS] * MAX_POINTS
+    assert dist.values[0] == 12  # 0〜24 の平均
+    assert dist.percentile(2500) == pytest.approx(50, abs=100 / MAX_POINTS)
+
+
+def test_incremental_adds_stay_bounded():
+    dist = Distribution()
+    values = list(range(5000))
+    random.Random(0).shuffle(values)
+    for start in range(0, len(values), 1000):
+        dist.add(values[start:start + 1000])
+    assert dist.total == 5000
+    assert len(dist.values) <= MAX_POINTS + 1
+    assert dist.values == sorted(dist.values)
+    for value in (500, 2500, 4500):
+        assert dist.percentile(value) == pytest.approx(value / 50, abs=2 * 100 / MAX_POINTS)
+
+
+def test_small_groups_fall_back_to_all_groups():
+    table = NormTable()
+    table.add('small', 'flanker', 'accuracy', [90.0] * 5)
+    table.add('other', 'flanker', 'accuracy', [80.0] * 40)
+    group, dist = table.distribution('small', 'flanker', 'accuracy')
+    assert group == ALL_GROUPS
+    assert dist.total == 45
+
+
+def test_save_and_load(tmp_path):
+    table = NormTable()
+    table.add('g', 'stroop', 'stroop_effect', [10.0, 20.0, 30.0])
+    table.last_block_id = 7
+    path = str(tmp_path / 'norms.json')
+    table.save(path)
+    loaded = NormTable.load(path)
+    assert loaded.last_block_id == 7
+    assert loaded.distributions[('g', 'stroop', 'stroop_effect')].to_dict() == {
+        'values': [10.0, 20.0, 30.0], 'counts': [1, 1, 1]}
+
+
+def test_percentiles_skip_metrics_without_data():
+    table = NormTable()
+    table.add('g', 'flanker', 'avg_rt', [400.0] * 40)
+    summary = {'avg_rt': 0, 'rt_count': 0}
+    metrics = {'avg_rt': '平均反応時間'}
+    assert table.percentiles('g', 'flanker', summary, metrics, {'avg_rt': ('rt_count',)}) == []
+    summary = {'avg_rt': 450.0, 'rt_count': 12}
+    assert table.percentiles('g', 'flanker', summary, metrics, {'avg_rt': ('rt_count',)})[0]['percentile'] == 100
+
+
+def save_flanker_block(correct):
+    import main_app
+    spec = main_app.TASKS['flanker']
+    params = main_app.studies.get(main_app.DEFAULT_STUDY_ID).params['flanker']
+    trials = spec['generate'](random.Random(1), {**params, 'trials_per_stimulus': 3})
+    results = []
+    for i, stimulus in enumerate(trials):
+        right = 'left' if stimulus[2] == '<' else 'right'
+        wrong = 'right' if right == 'left' else 'left'
+        data = {'response': right if correct else wrong, 'reaction_time': 400 + i}
+        results.append(spec['score'](stimulus, i, data, params))
+    return storage.save_block('norms-test', main_app.DEFAULT_STUDY_ID, 'flanker', 1,
+                              spec['codec'].encode(trials), results)
+
+
+def test_update_is_incremental_and_skips_missing_rts():
+    table = NormTable()
+    table.last_block_id = max((block['id'] for block in storage.iter_blocks()), default=0)
+    save_flanker_block(correct=True)
+    last = save_flanker_block(correct=False)  # 正解がない（平均反応時間は 0）
+
+    assert norms.update(table) == 2
+    assert table.last_block_id == last
+    assert table.distributions[ALL_GROUPS, 'flanker', 'accuracy'].total == 2
+    assert table.distributions[ALL_GROUPS, 'flanker', 'avg_rt'].values == [405.5]
+    assert (ALL_GROUPS, 'flanker', 'interference_effect') in table.distributions
+
+    assert norms.update(table) == 0
+    save_flanker_block(correct=True)
+    assert norms.update(table) == 1
+    assert table.distributions[ALL_GROUPS, 'flanker', 'accuracy'].total == 3
@@ -0,0 +1,41 @@
+import pytest
+from flask import Flask
+
+import profiling
+
+
+@pytest.fixture
+def profiled(tmp_path):
+    app = Flask(__name__)
+
+    @app.route('/ping')
+    def ping():
+        return 'ok'
+
+    app.wsgi_app = profiling.CProfileMiddleware(app.wsgi_app, str(tmp_path), 'secret')
+    return app.test_client(), tmp_path
+
+
+def profiles(directory):
+    return list(directory.rglob('*.prof'))
+
+
+def test_profiles_with_token(profiled):
+    client, directory = profiled
+    assert client.get('/ping', headers={'X-Profile': 'secret'}).status_code == 200
+    assert len(profiles(directory)) == 1
+
+
+@pytest.mark.parametrize('header', [None, 'wrong', 'sécret', 'secret\xff'])
+def test_no_profile_without_token(profiled, header):
+    client, directory = profiled
+    headers = {} if header is None else {'X-Profile': header}
+    assert client.get('/ping', headers=headers).status_code == 200
+    assert profiles(directory) == []
+
+
+def test_cprofile_requires_token(monkeypatch):
+    monkeypatch.setenv('PROFILE_MODE', 'cprofile')
+    monkeypatch.delenv('PROFILE_TOKEN', raising=False)
+    with pytest.raises(ValueError):
+        profiling.init_profiling(Flask(__name__))
@@ -0,0 +1,84 @@
+import pytest
+
+import quality
+from conftest import run_block
+from quality import QUALITY_DEFAULTS
+
+NO_RESPONSE = {'response': None, 'reaction_time': None}
+
+
+def flags_for(results, **params):
+    quality.flag_results(results, {**QUALITY_DEFAULTS, **params})
+    return [r.get('flags', []) for r in results]
+
+
+def test_anticipatory():
+    flags = flags_for([
+        {'response': 'left', 'reaction_time': 90, 'is_correct': True},
+        {'response': 'right', 'reaction_time': 400, 'is_correct': True},
+    ])
+    assert flags == [['anticipatory'], []]
+
+
+def test_same_key_run():
+    results = [{'response': 'left', 'reaction_time': 400, 'is_correct': True} for _ in range(4)]
+    assert flags_for(results, quality_same_key_run=3) == [[], [], ['same_key_run'], ['same_key_run']]
+
+
+def test_miss_run_is_not_reset_by_correct_withholds():
+    # 誤りの無反応と、反応しないのが正解の無反応が交互に続く
+    results = [{**NO_RESPONSE, 'is_correct': i % 2 == 1} for i in range(10)]
+    flags = flags_for(results, quality_miss_run=3)
+    assert flags[:4] == [[], [], [], []]
+    assert all(f == ['miss_run'] for f in flags[4:])
+
+
+def test_miss_run_is_reset_by_a_response():
+    results = [{**NO_RESPONSE, 'is_correct': False} for _ in range(3)]
+    results.append({'response': 'left', 'reaction_time': 400, 'is_correct': True})
+    results.append({**NO_RESPONSE, 'is_correct': False})
+    assert flags_for(results, quality_miss_run=3) == [[], [], ['miss_run'], [], []]
+
+
+def test_disabled_checks():
+    results = [{'response': 'left', 'reaction_time': 50, 'is_correct': True} for _ in range(10)]
+    flags = flags_for(results, quality_anticipatory_rt=None, quality_same_key_run=None)
+    assert flags == [[]] * 10
+
+
+def test_quality_fields():
+    results = [{'flags': ['anticipatory']}, {'flags': ['anticipatory', 'miss_run']}, {}, {}, {}]
+    fields = quality.quality_fields(results, QUALITY_DEFAULTS)
+    assert fields['flagged_trials'] == 2
+    assert fields['anticipatory_trials'] == 2
+    assert fields['miss_run_trials'] == 1
+    assert fields['same_key_run_trials'] == 0
+    assert fields['quality_warning'] is True
+
+
+@pytest.mark.parametrize('task, form', [
+    ('gonogo', {'go_trials': '20', 'nogo_trials': '10'}),
+    ('nback', {'total_trials': '60'}),
+])
+def test_absent_participant_is_flagged(client, task, form):
+    run_block(client, task, form, lambda trial, i: NO_RESPONSE)
+    results = client.get(f'/api/{task}/results').get_json()
+    # 誤りの無反応が quality_miss_run 回続いた試行からあとは、正しい無反応の試行も含めてすべて旗が付く
+    misses = [i for i, t in enumerate(results['trials']) if not t['is_correct']]
+    first = misses[QUALITY_DEFAULTS['quality_miss_run'] - 1]
+    assert all('miss_run' in t['flags'] for t in results['trials'][first:])
+    assert not any(t['flags'] for t in results['trials'][:first])
+    assert results['summary']['quality_warning'] is True
+
+
+def test_state_does_not_carry_over_to_the_next_block(client):
+    form = {'trials_per_stimulus': '3'}
+    respond = lambda trial, i: {'response': 'left', 'reaction_time': 400}  # noqa: E731
+    run_block(client, 'flanker', form, respond)
+    assert client.get('/api/flanker/results').get_json()['summary']['same_key_run_trials'] > 0
+
+    assert client.post('/flanker/start', data=form).get_json()['status'] == 'success'
+    trial = client.get('/flanker/next_trial').get_json()
+    client.post('/flanker/record_response', json={'trial_id': trial['trial_id'], **respond(trial, 0)})
+    results = client.get('/api/flanker/results').get_json()
+    assert results['summary']['flagged_trials'] == 0
@@ -0,0 +1,81 @@
+import pytest
+from flask import Flask
+
+from ratelimit import Limit, MemoryBackend, RateLimiter
+
+
+def test_bucket_allows_burst_then_refills():
+    backend = MemoryBackend()
+    limit = Limit(rate=1, burst=3)
+    assert [backend.consume('k', limit, 0.0)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = backend.consume('k', limit, 0.0)
+    assert not allowed
+    assert retry_after == pytest.approx(1.0)
+    assert backend.consume('k', limit, 0.5) == (False, pytest.approx(0.5))
+    assert backend.consume('k', limit, 1.0)[0]
+
+
+def test_keys_are_independent():
+    backend = MemoryBackend()
+    limit = Limit(rate=1, burst=1)
+    assert backend.consume('a', limit, 0.0)[0]
+    assert not backend.consume('a', limit, 0.0)[0]
+    assert backend.consume('b', limit, 0.0)[0]
+
+
+def test_idle_keys_are_evicted():
+    backend = MemoryBackend(max_keys=2)
+    limit = Limit(rate=1, burst=1)
+    backend.consume('a', limit, 0.0)
+    backend.consume('b', limit, 0.0)
+    backend.consume('c', limit, 1000.0)
+    assert set(backend._index) == {'c'}
+    assert len(backend._state) == 2
+    assert backend.consume('a', limit, 1000.0)[0]
+
+
+@pytest.fixture
+def limited_app(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_ENABLED', '1')
+    app = Flask(__name__)
+    app.secret_key = 'test'
+
+    @app.route('/ping')
+    def ping():
+        return 'ok'
+
+    @app.route('/free')
+    def free():
+        return 'ok'
+
+    limiter = RateLimiter(app, backend=MemoryBackend())
+    limiter.limit('ping', per_ip=Limit(rate=0.01, burst=5), per_session=Limit(rate=0.01, burst=2))
+    return app
+
+
+def test_session_limit_returns_429(limited_app):
+    client = limited_app.test_client()
+    assert [client.get('/ping').status_code for _ in range(2)] == [200, 200]
+    response = client.get('/ping')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert response.get_json()['status'] == 'error'
+    assert limited_app.test_client().get('/ping').status_code == 200
+
+
+def test_ip_limit_is_shared_across_sessions(limited_app):
+    codes = [limited_app.test_client().get('/ping').status_code for _ in range(6)]
+    assert codes == [200] * 5 + [429]
+
+
+def test_unlimited_endpoint(limited_app):
+    client = limited_app.test_client()
+    assert all(client.get('/free').status_code == 200 for _ in range(20))
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_ENABLED', '0')
+    app = Flask(__name__)
+    limiter = RateLimiter(app)
+    assert limiter.backend is None
+    assert not app.before_request_funcs
@@ -0,0 +1,83 @@
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def flanker(client):
+    client.get('/flanker')
+    client.post('/flanker/start', data={'trials_per_stimulus': '2'})
+    return client
+
+
+def next_trial(client):
+    trial = client.get('/flanker/next_trial').get_json()
+    assert trial['status'] == 'next'
+    return trial
+
+
+def post(client, trial_id, response='left', reaction_time=400):
+    return client.post('/flanker/record_response', json={
+        'trial_id': trial_id, 'response': response, 'reaction_time': reaction_time}).get_json()
+
+
+def results(client):
+    return client.get('/api/flanker/results').get_json()['trials']
+
+
+def block_token(client):
+    with client.session_transaction() as session:
+        return session['block_token']
+
+
+def test_trial_id_is_token_and_seq(flanker):
+    trial = next_trial(flanker)
+    assert trial['trial_id'] == f'{block_token(flanker)}:0'
+
+
+def test_late_response_is_attributed_to_its_trial(flanker):
+    first, second = next_trial(flanker), next_trial(flanker)
+    assert post(flanker, second['trial_id'], 'right')['recorded'] is True
+    assert post(flanker, first['trial_id'], 'left')['recorded'] is True
+    rows = results(flanker)
+    assert [(r['trial'], r['stimulus'], r['response']) for r in rows] == [
+        (1, first['stimulus'], 'left'), (2, second['stimulus'], 'right')]
+
+
+def test_unknown_trial_ids_are_rejected(flanker):
+    trial = next_trial(flanker)
+    token = block_token(flanker)
+    for trial_id in (f'{token}:1', f'{"0" * len(token)}:0'):  # 未提示の試行・別のブロック
+        assert post(flanker, trial_id)['status'] == 'error'
+    assert post(flanker, trial['trial_id'])['recorded'] is True
+
+
+def test_duplicate_response_is_ignored(flanker):
+    trial = next_trial(flanker)
+    assert post(flanker, trial['trial_id'], 'left')['recorded'] is True
+    assert post(flanker, trial['trial_id'], 'right')['recorded'] is False
+    assert [r['response'] for r in results(flanker)] == ['left']
+
+
+def test_rolled_back_cookie_keeps_the_logged_response(flanker):
+    trial = next_trial(flanker)
+    before = flanker.get_cookie('session').value
+    assert post(flanker, trial['trial_id'], 'left', 400)['recorded'] is True
+    flanker.set_cookie('session', before)
+
+    assert post(flanker, trial['trial_id'], 'right', 900)['recorded'] is False
+    rows = results(flanker)
+    assert [(r['response'], r['reaction_time']) for r in rows] == [('left', 400)]
+    assert storage.load_responses(block_token(flanker))[0]['response'] == 'left'
+
+
+def test_lost_cookie_is_recovered_from_the_log(flanker):
+    first = next_trial(flanker)
+    post(flanker, first['trial_id'], 'left')
+    second = next_trial(flanker)
+    before = flanker.get_cookie('session').value
+    post(flanker, second['trial_id'], 'right')
+    flanker.set_cookie('session', before)  # 2試行目の結果がクッキーから落ちた
+
+    rows = results(flanker)
+    assert [(r['trial'], r['response']) for r in rows] == [(1, 'left'), (2, 'right')]
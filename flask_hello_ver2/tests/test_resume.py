@@ -0,0 +1,101 @@
+import time
+import uuid
+
+import pytest
+
+import storage
+from conftest import answer, enter, respond
+
+FORM = {'trials_per_stimulus': '2'}  # 8試行
+
+
+@pytest.fixture
+def participant():
+    return f'p-{uuid.uuid4().hex[:12]}'
+
+
+def test_resume_from_another_browser(app, participant):
+    client = enter(app, participant)
+    client.get('/flanker')
+    client.post('/flanker/start', data=FORM)
+    answered = answer(client, 3)
+
+    state = storage.load_state(participant, 'default', 'flanker')
+    assert state['block_token']
+    assert state['results'] == []  # 結果は response_log から読み直す
+
+    other = enter(app, participant)
+    page = other.get('/flanker')
+    assert page.status_code == 200
+    trial = other.get('/flanker/next_trial').get_json()
+    assert trial['trial_number'] == 4
+    assert trial['total_trials'] == 8
+
+    respond(other, trial)
+    rest = [trial] + answer(other, 4)
+    assert other.get('/flanker/next_trial').get_json()['status'] == 'completed'
+
+    results = other.get('/api/flanker/results').get_json()
+    assert results['completed'] is True
+    assert [t['trial'] for t in results['trials']] == list(range(1, 9))
+    assert results['summary']['accuracy'] == 100
+    assert [t['stimulus'] for t in answered + rest] == [t['stimulus'] for t in results['trials']]
+
+
+def test_completed_block_is_not_resumed(app, participant):
+    client = enter(app, participant)
+    client.get('/flanker')
+    client.post('/flanker/start', data=FORM)
+    answer(client, 8)
+    assert client.get('/flanker/next_trial').get_json()['status'] == 'completed'
+
+    other = enter(app, participant)
+    other.get('/flanker')
+    assert other.get('/flanker/next_trial').get_json()['status'] == 'completed'
+
+
+def test_completed_block_is_not_resumed_after_archiving(app, participant):
+    pytest.importorskip('pyarrow')
+    import archive
+
+    client = enter(app, participant)
+    client.get('/flanker')
+    client.post('/flanker/start', data=FORM)
+    answer(client, 8)
+    client.get('/flanker/next_trial')
+    archive.archive_blocks(storage.archive_dir(), time.time() + 1)
+
+    other = enter(app, participant)
+    other.get('/flanker')
+    assert other.get('/flanker/next_trial').get_json()['status'] == 'completed'
+
+    # 新しく始めたブロックは保存される
+    other.post('/flanker/start', data=FORM)
+    answer(other, 8)
+    assert other.get('/flanker/next_trial').get_json()['status'] == 'completed'
+    block_id = other.get('/api/flanker/results').get_json()['block_id']
+    assert block_id in [block['id'] for block in storage.iter_live_blocks()]
+
+
+def test_resume_from_legacy_state(app, participant):
+    # 結果を participant_state に持っていた（トークンのない）古い途中経過からも再開できる
+    import main_app
+    trials = main_app.FLANKER_CODEC.encode(['<<<<<', '>>>>>', '<<><<'])
+    result = {'trial': 1, 'stimulus': '<<<<<', 'response': 'left', 'reaction_time': 400,
+              'is_correct': True, 'trial_type': 'congruent'}
+    storage.register_participant(participant)
+    storage.save_state(participant, 'default', 'flanker', trials, 1, [result], 1, None)
+
+    client = enter(app, participant)
+    client.get('/flanker')
+    trial = client.get('/flanker/next_trial').get_json()
+    assert trial['trial_number'] == 2
+    assert trial['stimulus'] == '>>>>>'
+    results = client.get('/api/flanker/results').get_json()
+    assert results['total_trials'] == 1
+    assert results['trials'][0]['stimulus'] == '<<<<<'
+
+
+def test_no_participant_no_resume(client):
+    client.get('/flanker')
+    assert client.get('/flanker/next_trial').get_json()['status'] == 'completed'
@@ -0,0 +1,100 @@
+import math
+import random
+
+import pytest
+
+from rt_stats import RT_DEFAULTS, exclude_outliers, fit_exgauss, rt_fields, trimmed_mean
+
+
+def params(**overrides):
+    return {**RT_DEFAULTS, **overrides}
+
+
+def test_no_exclusion_by_default():
+    assert exclude_outliers([300, 100, 200], params()) == [100, 200, 300]
+
+
+def test_absolute_limits():
+    assert exclude_outliers([100, 200, 300, 5000], params(rt_min=150, rt_max=1000)) == [200, 300]
+
+
+def test_sd_cutoff():
+    assert exclude_outliers([400] * 9 + [2000], params(rt_sd_cutoff=2)) == [400] * 9
+
+
+def test_mad_cutoff():
+    rts = [400, 410, 420, 430, 440, 2000]
+    assert exclude_outliers(rts, params(rt_mad_cutoff=3)) == [400, 410, 420, 430, 440]
+
+
+def test_zero_mad_keeps_everything():
+    # 半数以上が同じ値（粗いタイマー）だと MAD は 0
+    rts = [400] * 6 + [416, 433]
+    assert exclude_outliers(rts, params(rt_mad_cutoff=3)) == sorted(rts)
+
+
+def test_zero_variance_keeps_everything():
+    assert exclude_outliers([400] * 5, params(rt_sd_cutoff=2, rt_mad_cutoff=3)) == [400] * 5
+
+
+@pytest.mark.parametrize('rts', [[], [500], [100, 5000]])
+def test_too_few_trials_are_not_filtered(rts):
+    assert exclude_outliers(rts, params(rt_sd_cutoff=0.1, rt_mad_cutoff=0.1)) == sorted(rts)
+
+
+def test_trimmed_mean():
+    rts = list(range(1, 11))
+    assert trimmed_mean(rts, 0.1) == 5.5  # 2〜9 の平均
+    assert trimmed_mean([1, 2, 3, 100], 0.25) == 2.5
+    assert trimmed_mean([1, 2, 3, 100], None) == 26.5
+    assert trimmed_mean([1, 2, 3, 4], 0.5) == 2.5  # すべて除かれる場合は中央値
+
+
+def test_exgauss_needs_enough_trials():
+    assert fit_exgauss([400.0] * 9) is None
+
+
+def test_exgauss_zero_variance():
+    assert fit_exgauss([500.0] * 10) == (500.0, 0.0, 0.0)
+
+
+def test_exgauss_symmetric_sample_has_no_tau():
+    rts = [float(x) for x in range(1, 11)]
+    mu, sigma, tau = fit_exgauss(rts)
+    assert (mu, tau) == (5.5, 0.0)
+    assert sigma == pytest.approx(math.sqrt(55 / 6))
+
+
+def test_exgauss_too_skewed():
+    assert fit_exgauss([400.0] * 30 + [5000.0]) is None
+
+
+def test_exgauss_recovers_parameters():
+    rng = random.Random(0)
+    rts = [rng.gauss(400, 40) + rng.expovariate(1 / 100) for _ in range(20000)]
+    mu, sigma, tau = fit_exgauss(rts)
+    assert mu == pytest.approx(400, abs=10)
+    assert sigma == pytest.approx(40, abs=10)
+    assert tau == pytest.approx(100, abs=10)
+    mean = sum(rts) / len(rts)
+    assert mu + tau == pytest.approx(mean)
+
+
+def test_rt_fields():
+    rts = [400, 410, 420, 430, 440, 2000]
+    fields, kept = rt_fields('go', rts, params(rt_mad_cutoff=3, rt_trim=0))
+    assert kept == [400, 410, 420, 430, 440]
+    assert fields['go_avg_rt'] == 420
+    assert fields['go_median_rt'] == 420
+    assert fields['go_trimmed_rt'] == 420
+    assert fields['go_rt_excluded'] == 1
+    assert fields['go_rt_count'] == 5
+    assert fields['go_exg_mu'] is None  # 10試行未満
+
+
+def test_rt_fields_without_rts():
+    fields, kept = rt_fields('go', [], params())
+    assert kept == []
+    assert fields['go_avg_rt'] == fields['go_median_rt'] == 0
+    assert fields['go_rt_count'] == 0
+    assert fields['go_exg_tau'] is None
@@ -0,0 +1,94 @@
+import pytest
+
+from conftest import answer
+from studies import DEFAULT_STUDY_ID, Study
+from summary_cache import SummaryCache
+
+
+def test_stamp_must_match():
+    cache = SummaryCache()
+    cache.put('k', (1, 'default', 'v1'), 'summary')
+    assert cache.get('k', (1, 'default', 'v1')) == 'summary'
+    assert cache.get('k', (2, 'default', 'v1')) is None
+    assert cache.get('k', (1, 'default', 'v2')) is None
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_least_recently_used_is_evicted():
+    cache = SummaryCache(maxsize=2)
+    cache.put('a', 0, 1)
+    cache.put('b', 0, 2)
+    cache.get('a', 0)
+    cache.put('c', 0, 3)
+    assert cache.get('b', 0) is None
+    assert cache.get('a', 0) == 1
+
+
+def test_get_or_compute_and_invalidate():
+    cache = SummaryCache()
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)  # noqa: E731
+    assert cache.get_or_compute('k', 0, compute) == 1
+    assert cache.get_or_compute('k', 0, compute) == 1
+    cache.invalidate('k')
+    assert cache.get_or_compute('k', 0, compute) == 2
+
+
+def test_disabled():
+    cache = SummaryCache(maxsize=0)
+    cache.put('k', 0, 'summary')
+    assert cache.get('k', 0) is None
+
+
+@pytest.fixture
+def main_app():
+    import main_app
+    return main_app
+
+
+def changed_study(main_app, **flanker_params):
+    study = main_app.studies.get(DEFAULT_STUDY_ID)
+    params = {**study.params, 'flanker': {**study.params['flanker'], **flanker_params}}
+    return Study(study.study_id, study.name, study.tasks, study.seed, params, study.norm_group)
+
+
+def summary(client):
+    return client.get('/api/flanker/results').get_json()['summary']
+
+
+def test_new_responses_invalidate_the_summary(client, main_app):
+    client.get('/flanker')
+    client.post('/flanker/start', data={'trials_per_stimulus': '2'})
+    answer(client, 2)
+    assert summary(client)['total_trials'] == 2
+    hits = main_app.summaries.hits
+    assert summary(client)['total_trials'] == 2
+    assert main_app.summaries.hits == hits + 1
+    answer(client, 1)
+    assert summary(client)['total_trials'] == 3
+
+
+def test_study_change_invalidates_the_summary(client, main_app, monkeypatch):
+    client.get('/flanker')
+    client.post('/flanker/start', data={'trials_per_stimulus': '2'})
+    answer(client, 4)  # 反応時間はすべて 400ms
+    assert summary(client)['rt_count'] == 4
+
+    study = changed_study(main_app, rt_min=450)
+    monkeypatch.setattr(main_app.studies, 'get', lambda study_id: study)
+    assert summary(client)['rt_count'] == 0
+
+
+def test_study_change_invalidates_stored_block_summaries(client, main_app, monkeypatch):
+    client.get('/flanker')
+    client.post('/flanker/start', data={'trials_per_stimulus': '1'})
+    answer(client, 4)
+    client.get('/flanker/next_trial')
+    with client.session_transaction() as session:
+        block = main_app.storage.get_block(session['block_id'])
+    assert main_app.stored_block_results(block)['summary']['rt_count'] == 4
+
+    study = changed_study(main_app, rt_min=450)
+    monkeypatch.setattr(main_app.studies, 'get', lambda study_id: study)
+    assert main_app.stored_block_results(block)['summary']['rt_count'] == 0
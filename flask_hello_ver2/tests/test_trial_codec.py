@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from trial_codec import gonogo_codec, nback_codec, stroop_codec
+
+TASKS = ('flanker', 'gonogo', 'stroop', 'nback')
+
+
+@pytest.fixture(scope='module')
+def main_app():
+    import main_app
+    return main_app
+
+
+@pytest.mark.parametrize('task', TASKS)
+def test_generated_trials_round_trip(main_app, task):
+    spec = main_app.TASKS[task]
+    params = main_app.studies.get(main_app.DEFAULT_STUDY_ID).params[task]
+    trials = spec['generate'](random.Random(1), params)
+    blob = spec['codec'].encode(trials)
+    assert isinstance(blob, bytes)
+    assert len(blob) == len(trials)
+    assert spec['codec'].decode(blob) == trials
+    assert [spec['codec'].trial(blob, i) for i in range(len(blob))] == trials
+
+
+def test_gonogo_codes():
+    codec = gonogo_codec({'go': 'G', 'nogo': 'N'})
+    assert codec.encode([{'type': 'go'}, {'type': 'nogo'}]) == b'\x00\x01'
+    assert codec.trial(b'\x00\x01', 1) == {'type': 'nogo', 'stimulus': 'N'}
+
+
+def test_stroop_codes():
+    colors = {'red': {'name': 'あか'}, 'blue': {'name': 'あお'}}
+    codec = stroop_codec(colors)
+    blob = codec.encode([{'text_color': 'blue', 'display_color': 'red'}])
+    assert blob == bytes([0x10])
+    assert codec.trial(blob, 0) == {'type': 'incongruent', 'text': 'あお',
+                                    'text_color': 'blue', 'display_color': 'red'}
+
+
+def test_stroop_rejects_too_many_colors():
+    with pytest.raises(ValueError):
+        stroop_codec({f'c{i}': {'name': str(i)} for i in range(17)})
+
+
+def test_nback_flag_bit():
+    positions = [{'id': 1}, {'id': 2}]
+    codec = nback_codec(positions)
+    blob = codec.encode([{'position': {'id': 2}, 'is_nback': False},
+                         {'position': {'id': 2}, 'is_nback': True}])
+    assert blob == bytes([0x01, 0x81])
+    assert codec.trial(blob, 1) == {'trial_number': 2, 'position': {'id': 2}, 'is_nback': True}
+
+
+def legacy_session(client, trials, current_trial):
+    with client.session_transaction() as session:
+        session['trials'] = trials
+        session['current_trial'] = current_trial
+        session['results'] = []
+
+
+def test_legacy_flanker_session_is_re_encoded(client):
+    legacy_session(client, ['<<<<<', '>><>>', '>>>>>'], 1)
+    trial = client.get('/flanker/next_trial').get_json()
+    assert (trial['trial_number'], trial['stimulus'], trial['total_trials']) == (2, '>><>>', 3)
+    with client.session_transaction() as session:
+        assert isinstance(session['trials'], bytes)
+    response = client.post('/flanker/record_response', json={
+        'trial_id': trial['trial_id'], 'response': 'right', 'reaction_time': 400}).get_json()
+    assert response['recorded'] is True
+
+
+def test_legacy_gonogo_session_is_re_encoded(client):
+    legacy_session(client, [{'type': 'go', 'stimulus': 'go'}, {'type': 'nogo', 'stimulus': 'nogo'}], 1)
+    trial = client.get('/gonogo/next_trial').get_json()
+    assert trial['status'] == 'next'
+    assert trial['trial_number'] == 2
+
+
+def test_unconvertible_legacy_session_is_cleared(client):
+    legacy_session(client, [{'type': 'go', 'stimulus': 'go'}], 0)
+    assert client.get('/flanker/next_trial').get_json()['status'] == 'completed'
+    with client.session_transaction() as session:
+        assert session['trials'] == b''
@@ -0,0 +1,77 @@
+import pytest
+
+from validation import ValidationError, compile_schema
+
+SCHEMA = compile_schema({
+    'trials': ('int', 1, 50, 10),
+    'reaction_time': ('number', 0, 10000),
+    'response': ('choice', ('left', 'right')),
+    'items': ('list', 3),
+    'trial_id': ('pattern', r'[0-9a-f]{8}', False),
+})
+
+
+def test_valid_payload():
+    data = SCHEMA({'trials': '5', 'reaction_time': 412.5, 'response': 'left', 'items': [1, 2],
+                   'trial_id': 'deadbeef', 'extra': 'dropped'})
+    assert data == {'trials': 5, 'reaction_time': 412.5, 'response': 'left', 'items': [1, 2],
+                    'trial_id': 'deadbeef'}
+
+
+def test_defaults_and_optional_fields():
+    data = SCHEMA({'trials': '', 'items': []})
+    assert data == {'trials': 10, 'reaction_time': None, 'response': None, 'items': [], 'trial_id': None}
+
+
+@pytest.mark.parametrize('payload', [
+    {'trials': '0'},
+    {'trials': '51'},
+    {'trials': 'abc'},
+    {'trials': 2.5},
+    {'trials': True},
+    {'reaction_time': -1},
+    {'reaction_time': 10001},
+    {'reaction_time': '400'},
+    {'reaction_time': False},
+    {'response': 'up'},
+    {'response': 1},
+    {'items': [1, 2, 3, 4]},
+    {'items': 'abc'},
+    {'trial_id': 'deadbeef0'},
+    {'trial_id': 'DEADBEEF'},
+])
+def test_invalid_values(payload):
+    with pytest.raises(ValidationError):
+        SCHEMA({'items': [], **payload})
+
+
+def test_required_pattern():
+    validate = compile_schema({'token': ('pattern', r'[a-z]+')})
+    assert validate({'token': 'abc'}) == {'token': 'abc'}
+    with pytest.raises(ValidationError):
+        validate({})
+
+
+def test_payload_must_be_a_mapping():
+    with pytest.raises(ValidationError):
+        SCHEMA([1, 2, 3])
+
+
+def test_invalid_start_form_is_rejected(client):
+    client.get('/gonogo')
+    response = client.post('/gonogo/start', data={'go_trials': '100000'})
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_oversized_body_is_rejected(client):
+    client.get('/flanker')
+    response = client.post('/flanker/start', data={'trials_per_stimulus': '1' * 5000})
+    assert response.status_code == 400
+
+
+def test_response_requires_json(client):
+    client.get('/flanker')
+    client.post('/flanker/start', data={'trials_per_stimulus': '1'})
+    response = client.post('/flanker/record_response', data='not json', content_type='text/plain')
+    assert response.status_code == 400
@@ -0,0 +1,82 @@
+"""試行リストのコンパクトな表現
+
+セッションや保存先には1試行を1バイトの整数コードとして詰めた bytes を置き、
+刺激の文字列や位置情報などの dict への展開は API の応答を作るときだけ行う。
+コードは各課題の刺激テーブル（STIMULI_FLANKER, COLORS_STROOP, POSITIONS_NBACK など）
+の添字なので、テーブルの並びを変えると保存済みの試行の意味が変わる点に注意。
+"""
+
+
+class TrialCodec:
+    """試行 dict と1バイトのコードを相互に変換する"""
+
+    def __init__(self, pack, unpack):
+        self._pack = pack
+        self._unpack = unpack
+
+    def encode(self, trials):
+        """試行 dict のリストを bytes に詰める"""
+        return bytes(self._pack(trial) for trial in trials)
+
+    def decode(self, blob):
+        """bytes 全体を試行 dict のリストに展開する"""
+        unpack = self._unpack
+        return [unpack(code, idx) for idx, code in enumerate(blob)]
+
+    def trial(self, blob, idx):
+        """idx 番目の試行だけを展開する"""
+        return self._unpack(blob[idx], idx)
+
+
+def flanker_codec(stimuli):
+    """フランカー刺激: 刺激リストの添字"""
+    codes = {stimulus: i for i, stimulus in enumerate(stimuli)}
+    return TrialCodec(lambda trial: codes[trial], lambda code, idx: stimuli[code])
+
+
+def gonogo_codec(stimuli):
+    """Go/NoGo: 0 = go, 1 = nogo"""
+    types = ('go', 'nogo')
+    codes = {t: i for i, t in enumerate(types)}
+    return TrialCodec(
+        lambda trial: codes[trial['type']],
+        lambda code, idx: {'type': types[code], 'stimulus': stimuli[types[code]]},
+    )
+
+
+def stroop_codec(colors):
+    """ストループ: 上位4ビットが文字の意味、下位4ビットが表示色の添字"""
+    names = list(colors)
+    codes = {name: i for i, name in enumerate(names)}
+    if len(names) > 16:
+        raise ValueError('色の数が多すぎます（最大16色）')
+
+    def pack(trial):
+        return codes[trial['text_color']] << 4 | codes[trial['display_color']]
+
+    def unpack(code, idx):
+        text_color = names[code >> 4]
+        display_color = names[code & 0x0F]
+        return {
+            'type': 'congruent' if text_color == display_color else 'incongruent',
+            'text': colors[text_color]['name'],
+            'text_color': text_color,
+            'display_color': display_color,
+        }
+    return TrialCodec(pack, unpack)
+
+
+def nback_codec(positions):
+    """N-back: 下位7ビットが位置リストの添字、最上位ビットが1-back一致フラグ"""
+    codes = {p['id']: i for i, p in enumerate(positions)}
+
+    def pack(trial):
+        return codes[trial['position']['id']] | (0x80 if trial['is_nback'] else 0)
+
+    def unpack(code, idx):
+        return {
+            'trial_number': idx + 1,
+            'position': positions[code & 0x7F],
+            'is_nback': bool(code & 0x80),
+        }
+    return TrialCodec(pack, unpack)
@@ -0,0 +1,138 @@
+"""リクエストの入力検証
+
+スキーマはモジュール読み込み時に一度だけ検証関数へコンパイルし、
+リクエストごとの処理は事前に組み立てた比較を順に実行するだけにする。
+ボディの大きさはパース前に Content-Length で判定するため、
+巨大なペイロードや試行数が指定されても試行リストの生成には進まない。
+
+スキーマの書き方:
+    {'フィールド名': ('int', 最小値, 最大値, 既定値),
+     'フィールド名': ('number', 最小値, 最大値),          # None 可
+     'フィールド名': ('choice', 許可する値の集合),       # None 可
+     'フィールド名': ('list', 最大要素数),               # 要素の検証は呼び出し側で行う
+     'フィールド名': ('pattern', 正規表現),              # 文字列全体が一致すること（必須）
+     'フィールド名': ('pattern', 正規表現, False)}       # 同上（None 可）
+"""
+import re
+
+from flask import request
+
+MAX_FORM_BYTES = 1024
+MAX_JSON_BYTES = 1024
+
+
+class ValidationError(ValueError):
+    """入力が仕様外のときに送出する"""
+
+
+def _int_check(name, lo, hi, default):
+    message = f'{name} は {lo}〜{hi} の整数で指定してください'
+
+    def check(raw):
+        if raw is None or raw == '':
+            return default
+        if isinstance(raw, bool) or isinstance(raw, float):
+            raise ValidationError(message)
+        try:
+            value = int(raw)
+        except (TypeError, ValueError):
+            raise ValidationError(message) from None
+        if value < lo or value > hi:
+            raise ValidationError(message)
+        return value
+    return check
+
+
+def _number_check(name, lo, hi):
+    message = f'{name} は {lo}〜{hi} の数値で指定してください'
+
+    def check(raw):
+        if raw is None:
+            return None
+        if isinstance(raw, bool) or not isinstance(raw, (int, float)):
+            raise ValidationError(message)
+        if not lo <= raw <= hi:
+            raise ValidationError(message)
+        return raw
+    return check
+
+
+def _choice_check(name, choices):
+    allowed = frozenset(choices)
+    message = f'{name} の値が不正です'
+
+    def check(raw):
+        if raw is None:
+            return None
+        if not isinstance(raw, str) or raw not in allowed:
+            raise ValidationError(message)
+        return raw
+    return check
+
+
+def _list_check(name, max_items):
+    message = f'{name} は {max_items} 件以下の配列で指定してください'
+
+    def check(raw):
+        if not isinstance(raw, list) or len(raw) > max_items:
+            raise ValidationError(message)
+        return raw
+    return check
+
+
+def _pattern_check(name, pattern, required=True):
+    regex = re.compile(pattern)
+    message = f'{name} の形式が不正です'
+
+    def check(raw):
+        if raw is None and not required:
+            return None
+        if not isinstance(raw, str) or regex.fullmatch(raw) is None:
+            raise ValidationError(message)
+        return raw
+    return check
+
+
+_BUILDERS = {
+    'int': _int_check,
+    'number': _number_check,
+    'choice': _choice_check,
+    'list': _list_check,
+    'pattern': _pattern_check,
+}
+
+
+def compile_schema(spec):
+    """スキーマ定義から検証関数を生成する
+
+    返す関数は dict を受け取り、スキーマにあるキーだけを持つ新しい dict を返す。
+    スキーマにないキーは捨てる。
+    """
+    checks = tuple((name, _BUILDERS[rule[0]](name, *rule[1:])) for name, rule in spec.items())
+
+    def validate(payload):
+        if not hasattr(payload, 'get'):
+            raise ValidationError('リクエストの形式が不正です')
+        return {name: check(payload.get(name)) for name, check in checks}
+    return validate
+
+
+def _check_length(max_bytes):
+    length = request.content_length
+    if length is not None and length > max_bytes:
+        raise ValidationError('リクエストが大きすぎます')
+
+
+def parse_form(validator, max_bytes=MAX_FORM_BYTES):
+    """フォームの値を検証して返す"""
+    _check_length(max_bytes)
+    return validator(request.form)
+
+
+def parse_json(validator, max_bytes=MAX_JSON_BYTES):
+    """JSONボディを検証して返す"""
+    _check_length(max_bytes)
+    data = request.get_json(silent=True)
+    if data is None:
+        raise ValidationError('JSONボディが必要です')
+    return validator(data)
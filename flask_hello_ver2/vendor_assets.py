@@ -0,0 +1,168 @@
+"""フロントエンドの依存ファイルを static/vendor/ に取り込む
+
+外部のCDN（jsdelivr / cdnjs / Google Fonts）に頼らずに、ネットワークのない実験室でも
+同じ見た目で動くよう、次のファイルを static/vendor/ に置く:
+
+    bootstrap.min.css       Bootstrap の CSS
+    bootstrap-icons.svg     テンプレートで使っているアイコン（{{ icon('名前') }}）だけの SVG スプライト
+    fonts/*.woff2           Noto Sans JP / Poppins をテンプレートで使っている文字だけに絞ったもの
+    fonts.css               上のフォントの @font-face
+    manifest.json           テンプレートで preload するファイルの一覧（main_app が起動時に読む）
+
+フォントの絞り込みには fontTools（pip install fonttools brotli）が必要。
+インストールされていない場合や --skip-fonts を指定した場合、fonts.css は端末にインストール済みの
+フォント（local()）だけを参照し、なければ OS の日本語フォントで表示される。
+
+使い方:
+    python vendor_assets.py                     # 取得して static/vendor/ を作り直す
+    python vendor_assets.py --source DIR        # DIR に置いたファイルを使う（ネットワークなし）
+    python vendor_assets.py --skip-fonts
+
+--source のディレクトリには SOURCES のファイル名で置く。テンプレートの文言や
+アイコンを変えたら実行し直して、static/vendor/ をコミットする。
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import urllib.request
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+VENDOR_DIR = os.path.join(BASE_DIR, 'static', 'vendor')
+TEMPLATE_DIR = os.path.join(BASE_DIR, 'templates')
+
+GOOGLE_FONTS = 'https://raw.githubusercontent.com/google/fonts/main/ofl'
+SOURCES = {
+    'bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/css/bootstrap.min.css',
+    'bootstrap-icons.svg': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.5/bootstrap-icons.svg',
+    'NotoSansJP[wght].ttf': f'{GOOGLE_FONTS}/notosansjp/NotoSansJP%5Bwght%5D.ttf',
+    'Poppins-Regular.ttf': f'{GOOGLE_FONTS}/poppins/Poppins-Regular.ttf',
+    'Poppins-SemiBold.ttf': f'{GOOGLE_FONTS}/poppins/Poppins-SemiBold.ttf',
+}
+
+# (ファミリー名, 元のファイル, 出力するファイル, font-weight)
+FONTS = [
+    ('Noto Sans JP', 'NotoSansJP[wght].ttf', 'NotoSansJP-subset.woff2', '100 900'),
+    ('Poppins', 'Poppins-Regular.ttf', 'Poppins-Regular-subset.woff2', '400'),
+    ('Poppins', 'Poppins-SemiBold.ttf', 'Poppins-SemiBold-subset.woff2', '600'),
+]
+# Noto Sans JP / Poppins を使うテンプレート（これらの文字だけを残す）
+FONT_TEMPLATES = ('task_selection.html',)
+ICON_PATTERN = re.compile(r"icon\('([a-z0-9-]+)'")
+
+
+def fetch(name, source_dir):
+    if source_dir is not None:
+        with open(os.path.join(source_dir, name), 'rb') as f:
+            return f.read()
+    with urllib.request.urlopen(SOURCES[name], timeout=60) as response:
+        return response.read()
+
+
+def used_icons():
+    names = set()
+    for path in glob.glob(os.path.join(TEMPLATE_DIR, '*.html')):
+        with open(path, encoding='utf-8') as f:
+            names.update(ICON_PATTERN.findall(f.read()))
+    return sorted(names)
+
+
+def used_text():
+    """フォントを使うテンプレートと研究設定（研究名が表示される）に現れる文字と ASCII"""
+    paths = [os.path.join(TEMPLATE_DIR, name) for name in FONT_TEMPLATES]
+    paths += glob.glob(os.path.join(BASE_DIR, 'studies', '*.json'))
+    chars = {chr(c) for c in range(0x20, 0x7f)}
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            chars.update(c for c in f.read() if c.isprintable())
+    return ''.join(sorted(chars))
+
+
+def icon_sprite(svg, names):
+    """SVG スプライトから names のアイコンだけを残す"""
+    symbols = []
+    for name in names:
+        match = re.search(rf'<symbol[^>]*\bid="{re.escape(name)}".*?</symbol>', svg, re.S)
+        if match is None:
+            raise SystemExit(f'アイコンが見つかりません: {name}')
+        symbols.append(match.group(0))
+    return ('<svg xmlns="http://www.w3.org/2000/svg">'
+            '<!-- Bootstrap Icons (https://icons.getbootstrap.com/), MIT License -->'
+            + ''.join(symbols) + '</svg>\n')
+
+
+def subset_font(data, text, path):
+    import io
+
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    options = subset.Options()
+    options.flavor = 'woff2'
+    options.layout_features = ['*']
+    font = TTFont(io.BytesIO(data))
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(text=text)
+    subsetter.subset(font)
+    font.flavor = 'woff2'
+    font.save(path)
+
+
+def font_face(family, weight, filename=None):
+    sources = [f"local('{family}')"]
+    if filename is not None:
+        sources.append(f"url('fonts/{filename}') format('woff2')")
+    return (f"@font-face {{\n    font-family: '{family}';\n    font-weight: {weight};\n"
+            f"    font-display: swap;\n    src: {', '.join(sources)};\n}}\n")
+
+
+def build(source_dir=None, skip_fonts=False):
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    preload = [{'href': 'vendor/bootstrap.min.css', 'as': 'style'}]
+
+    with open(os.path.join(VENDOR_DIR, 'bootstrap.min.css'), 'wb') as f:
+        f.write(fetch('bootstrap.min.css', source_dir))
+    sprite = icon_sprite(fetch('bootstrap-icons.svg', source_dir).decode('utf-8'), used_icons())
+    with open(os.path.join(VENDOR_DIR, 'bootstrap-icons.svg'), 'w', encoding='utf-8') as f:
+        f.write(sprite)
+
+    if not skip_fonts:
+        try:
+            import fontTools  # noqa: F401
+        except ImportError:
+            print('fontTools がないためフォントは取り込みません（pip install fonttools brotli）', file=sys.stderr)
+            skip_fonts = True
+
+    faces = []
+    if skip_fonts:
+        faces = [font_face(family, weight) for family, _, _, weight in FONTS]
+    else:
+        text = used_text()
+        os.makedirs(os.path.join(VENDOR_DIR, 'fonts'), exist_ok=True)
+        for family, source, filename, weight in FONTS:
+            subset_font(fetch(source, source_dir), text, os.path.join(VENDOR_DIR, 'fonts', filename))
+            faces.append(font_face(family, weight, filename))
+            preload.append({'href': f'vendor/fonts/{filename}', 'as': 'font', 'type': 'font/woff2'})
+    with open(os.path.join(VENDOR_DIR, 'fonts.css'), 'w', encoding='utf-8') as f:
+        f.write('/* vendor_assets.py で生成 */\n' + '\n'.join(faces))
+
+    with open(os.path.join(VENDOR_DIR, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'preload': preload}, f, indent=2)
+        f.write('\n')
+    return preload
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='フロントエンドの依存ファイルを static/vendor/ に取り込む')
+    parser.add_argument('--source', help='取得済みのファイルを置いたディレクトリ（指定しなければダウンロードする）')
+    parser.add_argument('--skip-fonts', action='store_true', help='フォントを取り込まない')
+    args = parser.parse_args(argv)
+    for asset in build(args.source, args.skip_fonts):
+        print(asset['href'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""起動直後の準備（ウォームアップ）と起動時間の計測
+
+Render の無料・Starter プランではしばらくアクセスがないとインスタンスが止まり、
+次のアクセスで起動し直す（コールドスタート）。起動直後の最初のリクエストで
+テンプレートのコンパイル・研究設定の読み込み・DB の接続とスキーマの作成が
+まとめて走らないよう、起動時にバックグラウンドのスレッドで済ませておく。
+終わるまで /readyz は 503 を返すので、Render のヘルスチェック（healthCheckPath）に
+/readyz を指定すれば、準備ができてから参加者のリクエストが振り分けられる。
+
+テンプレートのコンパイル結果は instance/template_cache に保存し（Jinja のバイトコードキャッシュ）、
+次の起動ではコンパイルせずに読み込む。ビルド時に python warmup.py --compile-only を
+実行しておけば、最初の起動からキャッシュが使える。テンプレートを変更した場合は
+内容のチェックサムが変わるので、古いキャッシュは使われない。
+
+使い方:
+    python warmup.py                  # main_app の import の内訳とウォームアップの各段階の時間を表示する
+    python warmup.py --top 30         # import に時間のかかったモジュールを30件表示する
+    python warmup.py --compile-only   # テンプレートをコンパイルしてキャッシュに保存する（ビルド時用）
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from log_config import configure_logging, get_logger
+
+
+class Warmup:
+    """起動時に一度だけ実行する準備の段階を順に実行する"""
+
+    def __init__(self):
+        self.steps = []
+        self.timings = {}
+        self.error = None
+        self.ready = threading.Event()
+
+    def add(self, name, func):
+        self.steps.append((name, func))
+
+    def run(self):
+        started = time.perf_counter()
+        for name, func in self.steps:
+            t0 = time.perf_counter()
+            try:
+                func()
+            except Exception as e:
+                # 準備に失敗してもリクエストの処理はできる（その処理が最初のリクエストで行われるだけ）
+                self.error = f'{name}: {e}'
+                get_logger('main').exception("ウォームアップに失敗しました: %s", name)
+            self.timings[name] = round((time.perf_counter() - t0) * 1000, 1)
+        self.timings['total'] = round((time.perf_counter() - started) * 1000, 1)
+        self.ready.set()
+        get_logger('main').info("ウォームアップが完了しました", extra={'fields': {'timings_ms': self.timings}})
+
+    def skip(self):
+        """実行せずに準備完了とする（WARMUP=0。各処理は最初に使われたときに行われる）"""
+        self.timings = {}
+        self.ready.set()
+
+    def start(self):
+        """バックグラウンドのスレッドで実行する（ポートを開くのを待たせない）"""
+        threading.Thread(target=self.run, name='warmup', daemon=True).start()
+
+    def status(self):
+        return {'ready': self.ready.is_set(), 'timings_ms': dict(self.timings), 'error': self.error}
+
+
+def compile_templates(app):
+    """すべてのテンプレートを読み込む（キャッシュがなければコンパイルして保存する）"""
+    env = app.jinja_env
+    for name in env.list_templates(extensions=('html',)):
+        env.get_template(name)
+
+
+def import_times(top=15):
+    """別のプロセスで python -X importtime -c 'import main_app' を実行し、
+    (累積のマイクロ秒, モジュール名) を時間の長い順に返す"""
+    env = dict(os.environ, WARMUP='0')
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main_app'],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                          capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='起動時間の計測とウォームアップ')
+    parser.add_argument('--top', type=int, default=15, help='表示するモジュールの数')
+    parser.add_argument('--compile-only', action='store_true', help='テンプレートのキャッシュを作るだけ')
+    args = parser.parse_args(argv)
+    os.environ['WARMUP'] = '0'  # ここで順に実行して時間を測る
+    configure_logging(sys.stderr)
+
+    if not args.compile_only:
+        print('import（累積ミリ秒）')
+        for micros, name in import_times(args.top):
+            print(f'  {micros / 1000:8.1f}  {name}')
+
+    t0 = time.perf_counter()
+    import main_app
+    print(f'import main_app: {(time.perf_counter() - t0) * 1000:.1f} ms')
+    if args.compile_only:
+        compile_templates(main_app.app)
+        print(f'テンプレートのキャッシュ: {main_app.TEMPLATE_CACHE_DIR}')
+        return 0
+    main_app.warmup.run()
+    print('ウォームアップ（ミリ秒）')
+    for name, ms in main_app.warmup.timings.items():
+        print(f'  {ms:8.1f}  {name}')
+    return 1 if main_app.warmup.error else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())